@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+    Outils de benchmark du tracking sur les images enregistrées de data/raw.
+
+    Usage (depuis src/) :
+        python benchmark.py detectors --backends tensorflow opencv onnx
+        python benchmark.py record --section ParcelTracker1 --cam cam1 --output detections.npz
+        python benchmark.py tracking --section ParcelTracker1 --log detections.npz --strategies hungarian greedy
+        python benchmark.py tracking --section ParcelTracker1 --log detections.npz --drop 0.2
+        python benchmark.py resolutions --sizes 1456x1088 1296x972 972x726 728x544
+        python benchmark.py undistortion --section ParcelTracker1 --cam cam1 cam2
+        python benchmark.py replay --cam cam1 cam2 --workers 1 4 --speed 0
+        python benchmark.py pack --section ParcelTracker1 --cam cam1 --output frames_cam1
+        python benchmark.py store --section ParcelTracker1 --store frames_cam1
+        python benchmark.py association --tracks 10 50 100 200 400 1000
+        python benchmark.py kalman --tracks 10 50 100 200 400 1000
+"""
+import argparse
+import configparser as cfg
+import contextlib
+import itertools
+import os
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from config.directories import directories as dirs
+from constants import C_PARCELTRACKER, C_TRACKER1
+from libs.fasterObjectDetection.factory import createDetector
+from libs.features.detection import fitImageSize
+from libs.vision.costMatrix import boxesToArray, centerDistanceMatrix, centersFromBoxes, iouScoreMatrix
+from libs.vision.batchKalmanPredictor import BatchKalmanPredictor
+from libs.vision.gatedAssociation import gatedAssignment
+from libs.vision.kalmanPredictor import KalmanFilterPredictor
+from libs.vision.parcelAssociator import (ASSOCIATION_STRATEGIES, computeCenterFromRelativeBox,
+                                          computeEuclideanDistForCenters, computeIOUforRelativeBoxes)
+from libs.fasterObjectDetection.recordedDetector import DetectionLog, DetectionRecorder, RecordedDetector
+from parcels.parcel import Parcel
+from parcelTracker import ParcelTracker
+from utils.frameStore import FrameStore, packFrames
+from utils.rawFrames import buildManifest, listRawFrames, ReplaySource
+
+INFERENCE_BACKENDS = ['tensorflow', 'opencv', 'onnx']
+
+
+def loadBenchmarkFrames(limit=50):
+    """
+    Charge les images des dossiers caméra de data/raw.
+
+    Args:
+        limit: nombre maximum d'images chargées.
+
+    Returns:
+        La liste des images décodées.
+    """
+    frames = []
+    for camDir in sorted(os.listdir(dirs.dir_raw)):
+        if not os.path.isdir(dirs.dir_raw / camDir):
+            continue
+        for fileName in sorted(os.listdir(dirs.dir_raw / camDir)):
+            if fileName.endswith('.jpg') and len(frames) < limit:
+                frames.append(cv2.imread(str(dirs.dir_raw / camDir / fileName)))
+    return frames
+
+
+def readDetectorSettings(configFile, sectionName):
+    """
+    Lit les paramètres du détecteur d'une section de parcelTracker.ini.
+
+    Returns:
+        Un dictionnaire d'arguments pour createDetector (hors backend).
+    """
+    config = cfg.ConfigParser()
+    config.read(configFile)
+    return {'PATH_TO_CKPT': dirs.dir_model / config.get(sectionName, 'PATH_TO_CKPT'),
+            'PATH_TO_LABELS': dirs.dir_labels / config.get(sectionName, 'PATH_TO_LABELS'),
+            'min_score_threshold': config.getfloat(sectionName, 'detectionThreshold'),
+            'gpuDevice': config.get(sectionName, 'gpuNum'),
+            'gpuFraction': config.getfloat(sectionName, 'gpuMemoryFraction'),
+            'cpuThreads': config.getint(sectionName, 'cpuThreads', fallback=0),
+            'PATH_TO_CONFIG': dirs.dir_model / config.get(sectionName, 'PATH_TO_DNN_CONFIG', fallback='')}
+
+
+def timeDetector(detector, frames):
+    """
+    Mesure la latence par image d'un détecteur.
+
+    Returns:
+        Les latences en secondes et le nombre de détections par image.
+    """
+    latencies = []
+    counts = []
+    for frame in frames:
+        t0 = time.perf_counter()
+        numObj, _ = detector.run_inference_for_frame(frame)
+        latencies.append(time.perf_counter() - t0)
+        counts.append(numObj)
+    return np.array(latencies), np.array(counts)
+
+
+def printLatencyReport(name, latencies, counts, extra=''):
+    print('{:<22} mean {:8.1f} ms  p50 {:8.1f} ms  p95 {:8.1f} ms  {:6.1f} fps  {:5.2f} det/img {}'.format(
+        name, 1000 * latencies.mean(), 1000 * np.percentile(latencies, 50),
+        1000 * np.percentile(latencies, 95), 1 / latencies.mean(), counts.mean(), extra))
+
+
+def benchmarkDetectors(backends, sectionName=C_TRACKER1, limit=50):
+    """
+    Compare les backends de détection sur les mêmes images et indique le
+    plus rapide pour la machine courante.
+    """
+    settings = readDetectorSettings(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    frames = loadBenchmarkFrames(limit)
+    initSize = frames[0].shape
+    print('Benchmark of {} frames {}'.format(len(frames), initSize))
+
+    results = {}
+    for backend in backends:
+        try:
+            t0 = time.perf_counter()
+            detector = createDetector(backend, initSize=initSize, **settings)
+            loadTime = time.perf_counter() - t0
+        except Exception as e:
+            print('{:<22} unavailable : {}'.format(backend, e))
+            continue
+        latencies, counts = timeDetector(detector, frames)
+        results[backend] = latencies.mean()
+        printLatencyReport(backend, latencies, counts, '(load {:.1f} s)'.format(loadTime))
+
+    if len(results) > 0:
+        print('Fastest backend on this host : {}'.format(min(results, key=results.get)))
+    return results
+
+
+def benchmarkResolutions(sizes, sectionName=C_TRACKER1, limit=50):
+    """
+    Mesure la latence et le nombre de détections du détecteur d'un tracker
+    à plusieurs résolutions d'inférence, pour choisir le point de fonctionnement.
+    Les images sont redimensionnées pour tenir dans chaque taille en gardant
+    leurs proportions, comme par ParcelTracker.prepareImage.
+
+    Args:
+        sizes: liste de tailles maximales (largeur, hauteur).
+    """
+    config = cfg.ConfigParser()
+    config.read(dirs.dir_config / C_PARCELTRACKER)
+    backend = config.get(sectionName, 'detectorBackend', fallback='tensorflow')
+    settings = readDetectorSettings(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    frames = loadBenchmarkFrames(limit)
+    print('Benchmark of {} frames, backend {}'.format(len(frames), backend))
+
+    width, height = fitImageSize(frames[0].shape[1], frames[0].shape[0], sizes[0])
+    detector = createDetector(backend, initSize=(height, width, 3), **settings)
+    for size in sizes:
+        resized = [cv2.resize(frame, fitImageSize(frame.shape[1], frame.shape[0], size),
+                              interpolation=cv2.INTER_AREA) for frame in frames]
+        # préchauffage à la taille mesurée
+        detector.run_inference_for_frame(resized[0])
+        latencies, counts = timeDetector(detector, resized)
+        printLatencyReport('{}x{}'.format(*size), latencies, counts)
+
+
+def matchDetections(reference, candidate):
+    """
+    Associe deux listes de détections par IOU (algorithme hongrois).
+
+    Returns:
+        Les IOU des paires associées et le nombre de détections non associées.
+    """
+    if len(reference) == 0 or len(candidate) == 0:
+        return [], len(reference) + len(candidate)
+    scoreMatrix = iouScoreMatrix(boxesToArray([ref[2] for ref in reference]),
+                                 boxesToArray([cand[2] for cand in candidate]))
+    rows, cols = linear_sum_assignment(scoreMatrix)
+    ious = [1 - scoreMatrix[i, j] for i, j in zip(rows, cols) if scoreMatrix[i, j] < 1]
+    return ious, len(reference) + len(candidate) - 2 * len(ious)
+
+
+def benchmarkUndistortion(sectionName, camDirs, limit=50):
+    """
+    Compare la correction de la distortion sur l'image complète (référence)
+    à la correction des seules box détectées sur l'image brute, sur les
+    images enregistrées : IOU des détections associées, détections perdues
+    ou en trop, et temps de préparation + détection de chaque chemin.
+    """
+    parcelTracker = ParcelTracker(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    if not parcelTracker.trackerSpace.doUndistortion:
+        print('doUndistortion is False for {}, nothing to compare'.format(sectionName))
+        return
+    ious = []
+    unmatched = 0
+    detections = 0
+    latencies = {False: [], True: []}
+    for camDir in camDirs:
+        for frame in listRawFrames(camDir)[:limit]:
+            raw = cv2.imread(str(frame['path']))
+            results = {}
+            for boxUndistortion in (False, True):
+                parcelTracker.boxUndistortion = boxUndistortion
+                t0 = time.perf_counter()
+                _, results[boxUndistortion] = parcelTracker.detect(parcelTracker.prepareImage(raw))
+                latencies[boxUndistortion].append(time.perf_counter() - t0)
+            frameIous, frameUnmatched = matchDetections(results[False], results[True])
+            ious.extend(frameIous)
+            unmatched += frameUnmatched
+            detections += len(results[False])
+
+    if len(ious) == 0:
+        print('No detection to compare')
+        return
+    ious = np.array(ious)
+    print('{} reference detections, {} matched, {} unmatched'.format(detections, len(ious), unmatched))
+    print('IoU box vs image undistortion : mean {:.4f}  p5 {:.4f}  min {:.4f}  >0.9 {:.1%}'.format(
+        ious.mean(), np.percentile(ious, 5), ious.min(), (ious > 0.9).mean()))
+    for boxUndistortion, name in ((False, 'image undistortion'), (True, 'box undistortion')):
+        values = np.array(latencies[boxUndistortion])
+        print('{:<22} mean {:8.1f} ms  p95 {:8.1f} ms (prepare + detect)'.format(
+            name, 1000 * values.mean(), 1000 * np.percentile(values, 95)))
+
+
+def recordSession(sectionName, camDirs, outputPath):
+    """
+    Exécute une fois le détecteur réel d'un tracker sur les images enregistrées
+    et sauvegarde les détections, indexées par caméra et timestamp.
+    """
+    parcelTracker = ParcelTracker(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    recorder = DetectionRecorder(parcelTracker.parcelDetector)
+    for camDir in camDirs:
+        for frame in listRawFrames(camDir):
+            image = parcelTracker.prepareImage(cv2.imread(str(frame['path'])))
+            numObj, objects = parcelTracker.detect(image)
+            recorder.record((frame['cam'], frame['ts']), objects)
+    recorder.save(outputPath)
+    print('Recorded {} frames in {}'.format(len(recorder.log), outputPath))
+
+
+def benchmarkTracking(sectionName, logPath, repeat=1, strategies=None, dropRate=0.0):
+    """
+    Mesure le chemin de tracking seul (association, Kalman, peer-to-peer,
+    géométrie) en rejouant un journal de détections, sans image ni modèle,
+    pour chaque stratégie d'association (celle de la section si None).
+    Une fraction dropRate des images, tirée au hasard, est sautée comme les
+    images perdues par la file de réception sous charge ; l'erreur de
+    prédiction de Kalman est donnée par intervalle réel entre les images.
+    """
+    rng = np.random.default_rng(0)
+    log = DetectionLog.load(logPath)
+    settings = readDetectorSettings(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    detector = RecordedDetector(log, settings['PATH_TO_LABELS'], settings['min_score_threshold'])
+
+    for cam, strategy in itertools.product(log.cameras(), strategies or [None]):
+        parcelTracker = ParcelTracker(dirs.dir_config / C_PARCELTRACKER, sectionName, detector=detector)
+        if strategy is not None:
+            parcelTracker.setAssociationStrategy(strategy)
+        timestamps = log.timestamps(cam)
+        if dropRate > 0:
+            timestamps = [ts for ts in timestamps if rng.random() >= dropRate]
+        latencies = []
+        counts = []
+        # le tracking trace beaucoup sur la sortie standard
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                for ts in timestamps:
+                    t0 = time.perf_counter()
+                    detector.setFrameKey(cam, ts)
+                    numObj, objects = detector.run_inference_for_frame(None)
+                    parcels, _, _ = parcelTracker.updateWithDetections(numObj, objects, [None], cam, ts)
+                    latencies.append(time.perf_counter() - t0)
+                    counts.append(len(parcels))
+        printLatencyReport('tracking ' + cam, np.array(latencies), np.array(counts), '(parcels/frame)')
+        print('    association : {}'.format(parcelTracker.detectionTracker.PA.stats()))
+        print('    prediction error by frame interval : {}'.format(parcelTracker.detectionTracker.predictionStats()))
+
+
+def benchmarkReplay(camDirs, workers, speed=0, limit=0):
+    """
+    Mesure le débit du rejeu des images enregistrées (lecture et décodage),
+    dans l'ordre des timestamps, pour chaque nombre de threads de lecture.
+    """
+    t0 = time.perf_counter()
+    frames = [frame for frame in buildManifest() if frame['cam'] in camDirs]
+    print('Manifest : {} frames in {:.1f} ms'.format(len(frames), 1000 * (time.perf_counter() - t0)))
+    if limit > 0:
+        frames = frames[:limit]
+    for workerCount in workers:
+        source = ReplaySource(frames, speed, prefetch=2 * workerCount, workers=workerCount,
+                              decode=lambda data: cv2.imdecode(data, cv2.IMREAD_COLOR))
+        for _ in source:
+            pass
+        stats = source.stats()
+        print('{:>2} workers : {:6.1f} frames/s, {} frames late, max lag {:.1f} ms'.format(
+            workerCount, stats['fps'], stats['lateFrames'], 1000 * stats['maxLag']))
+
+
+def packSession(sectionName, camDirs, outputPath, raw=False):
+    """
+    Écrit les images enregistrées dans un stockage memory-map (utils.frameStore),
+    préparées pour la détection par le tracker de la section sauf si raw.
+    """
+    frames = [frame for frame in buildManifest() if frame['cam'] in camDirs]
+    parcelTracker = None if raw else ParcelTracker(dirs.dir_config / C_PARCELTRACKER, sectionName)
+    t0 = time.perf_counter()
+    store = packFrames(frames, outputPath, parcelTracker)
+    print('Packed {} frames ({:.1f} MB) in {} in {:.1f} s'.format(
+        len(store), store.data.nbytes / 1024 / 1024, outputPath, time.perf_counter() - t0))
+
+
+def benchmarkStore(sectionName, storePath, repeat=1):
+    """
+    Mesure ParcelTracker.update (détection et tracking) sur les images d'un
+    stockage memory-map, sans lecture ni décodage de JPEG.
+    """
+    store = FrameStore(storePath)
+    if store.prepared and store.section != sectionName:
+        print('Warning : frames prepared by {}, benchmarked with {}'.format(store.section, sectionName))
+    for cam in store.cameras():
+        parcelTracker = ParcelTracker(dirs.dir_config / C_PARCELTRACKER, sectionName)
+        latencies = []
+        counts = []
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                for _, ts, image, roi in store.frames(cam):
+                    t0 = time.perf_counter()
+                    parcels, _, _ = parcelTracker.update(image, [None], cam, ts,
+                                                         roi if store.prepared else None)
+                    latencies.append(time.perf_counter() - t0)
+                    counts.append(len(parcels))
+        printLatencyReport('store ' + cam, np.array(latencies), np.array(counts), '(parcels/frame)')
+
+
+def randomBoxes(rng, count):
+    """
+    Tire des box relatives aléatoires de taille comparable à celle des colis,
+    triées par xmax comme les détections, le long d'un convoyeur dont la
+    longueur croît avec le nombre de colis.
+    """
+    corners = np.stack((rng.uniform(0, 0.8, count), rng.uniform(0, 0.012 * count, count)), axis=1)
+    sizes = rng.uniform(0.02, 0.1, (count, 2))
+    boxes = np.concatenate((corners, corners + sizes), axis=1)
+    return boxes[np.argsort(boxes[:, 3])]
+
+
+def benchmarkAssociation(trackCounts, repeat=5):
+    """
+    Compare le calcul des matrices de coût de l'association (IOU et distance
+    des centres) par double boucle et par numpy, puis mesure l'association
+    hongroise dense et par composantes (gated), pour un nombre croissant de
+    Parcels suivis (autant de détections) répartis le long du convoyeur.
+    """
+    rng = np.random.default_rng(0)
+    print('{:>6} {:>14} {:>14} {:>14} {:>14} {:>14} {:>14}'.format(
+        'tracks', 'IOU loop ms', 'IOU numpy ms', 'dist loop ms', 'dist numpy ms', 'hungarian ms', 'gated ms'))
+    for count in trackCounts:
+        tracks = randomBoxes(rng, count)
+        detections = tracks + rng.normal(0, 0.005, tracks.shape)
+        trackList = [tuple(box) for box in tracks]
+        detectionList = [tuple(box) for box in detections]
+        trackCenters = [computeCenterFromRelativeBox(box) for box in trackList]
+
+        timings = []
+        for compute in (
+                lambda: np.array([[computeIOUforRelativeBoxes(t, d) for d in detectionList] for t in trackList]),
+                lambda: iouScoreMatrix(boxesToArray(trackList), boxesToArray(detectionList)),
+                lambda: np.array([[computeEuclideanDistForCenters(c, computeCenterFromRelativeBox(d))
+                                   for d in detectionList] for c in trackCenters]),
+                lambda: centerDistanceMatrix(np.asarray(trackCenters), centersFromBoxes(boxesToArray(detectionList)))):
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                compute()
+            timings.append((time.perf_counter() - t0) / repeat)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            linear_sum_assignment(iouScoreMatrix(tracks, detections))
+        timings.append((time.perf_counter() - t0) / repeat)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            gatedAssignment(tracks, detections, 0.75)
+        timings.append((time.perf_counter() - t0) / repeat)
+        print('{:>6} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+            count, *(1000 * t for t in timings)))
+
+
+def benchmarkKalman(trackCounts, frames=50):
+    """
+    Compare la mise à jour de Kalman des Parcels suivis par le filtre OpenCV
+    (une correction et une prédiction par Parcel), par le filtre vectorisé et
+    par le filtre vectorisé à gain stationnaire (après 20 corrections), pour
+    un nombre croissant de Parcels avançant le long du convoyeur.
+    """
+    rng = np.random.default_rng(0)
+    print('{:>6} {:>14} {:>14} {:>14} {:>16} {:>16} {:>16}'.format(
+        'tracks', 'opencv ms', 'batch ms', 'steady ms', 'opencv us/track', 'batch us/track', 'steady us/track'))
+    for count in trackCounts:
+        boxes = randomBoxes(rng, count)
+        noise = rng.normal(0, 0.002, (frames, count, 4))
+        timings = []
+        for predictor in (KalmanFilterPredictor(8), BatchKalmanPredictor(8), BatchKalmanPredictor(8, 20)):
+            parcels = [Parcel('B{}'.format(i), 'Coral', 0, tuple(box)) for i, box in enumerate(boxes.tolist())]
+            elapsed = 0.0
+            for frame in range(frames):
+                # détection au voisinage de la position réelle, avançant de 0.01 par image
+                for parcel, box, delta in zip(parcels, boxes.tolist(), noise[frame].tolist()):
+                    parcel.relativeBox = (box[0] + delta[0], box[1] + 0.01 * frame + delta[1],
+                                          box[2] + delta[2], box[3] + 0.01 * frame + delta[3])
+                t0 = time.perf_counter()
+                predictor.updateStates(parcels)
+                elapsed += time.perf_counter() - t0
+            timings.append(elapsed / frames)
+        print('{:>6} {:>14.3f} {:>14.3f} {:>14.3f} {:>16.2f} {:>16.2f} {:>16.2f}'.format(
+            count, *(1000 * t for t in timings), *(1e6 * t / count for t in timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+
+    detectorsParser = subparsers.add_parser('detectors', help='compare detector backends')
+    detectorsParser.add_argument('--backends', nargs='+', default=INFERENCE_BACKENDS)
+    detectorsParser.add_argument('--section', default=C_TRACKER1)
+    detectorsParser.add_argument('--limit', type=int, default=50)
+
+    recordParser = subparsers.add_parser('record', help='record detections of the real detector')
+    recordParser.add_argument('--section', default=C_TRACKER1)
+    recordParser.add_argument('--cam', nargs='+', default=['cam1'])
+    recordParser.add_argument('--output', default=str(dirs.dir_model / 'detections.npz'))
+
+    trackingParser = subparsers.add_parser('tracking', help='replay recorded detections through the tracker')
+    trackingParser.add_argument('--section', default=C_TRACKER1)
+    trackingParser.add_argument('--log', default=str(dirs.dir_model / 'detections.npz'))
+    trackingParser.add_argument('--repeat', type=int, default=1)
+    trackingParser.add_argument('--strategies', nargs='+', choices=ASSOCIATION_STRATEGIES)
+    trackingParser.add_argument('--drop', type=float, default=0.0, help='fraction of frames dropped at random')
+
+    resolutionsParser = subparsers.add_parser('resolutions', help='compare inference resolutions')
+    resolutionsParser.add_argument('--sizes', nargs='+', default=['1456x1088', '1296x972', '972x726', '728x544'])
+    resolutionsParser.add_argument('--section', default=C_TRACKER1)
+    resolutionsParser.add_argument('--limit', type=int, default=50)
+
+    undistortionParser = subparsers.add_parser('undistortion', help='compare box and full-frame undistortion')
+    undistortionParser.add_argument('--section', default=C_TRACKER1)
+    undistortionParser.add_argument('--cam', nargs='+', default=['cam1'])
+    undistortionParser.add_argument('--limit', type=int, default=50)
+
+    replayParser = subparsers.add_parser('replay', help='measure recorded frames replay throughput')
+    replayParser.add_argument('--cam', nargs='+', default=['cam1', 'cam2'])
+    replayParser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    replayParser.add_argument('--speed', type=float, default=0)
+    replayParser.add_argument('--limit', type=int, default=0)
+
+    packParser = subparsers.add_parser('pack', help='pack recorded frames into a memory-mapped store')
+    packParser.add_argument('--section', default=C_TRACKER1)
+    packParser.add_argument('--cam', nargs='+', default=['cam1'])
+    packParser.add_argument('--output', default=str(dirs.dir_model / 'frameStore'))
+    packParser.add_argument('--raw', action='store_true', help='store decoded frames without preparation')
+
+    storeParser = subparsers.add_parser('store', help='run the tracker on a memory-mapped frame store')
+    storeParser.add_argument('--section', default=C_TRACKER1)
+    storeParser.add_argument('--store', default=str(dirs.dir_model / 'frameStore'))
+    storeParser.add_argument('--repeat', type=int, default=1)
+
+    associationParser = subparsers.add_parser('association', help='time association cost matrices')
+    associationParser.add_argument('--tracks', type=int, nargs='+', default=[10, 50, 100, 200, 400, 1000])
+    associationParser.add_argument('--repeat', type=int, default=5)
+
+    kalmanParser = subparsers.add_parser('kalman', help='time Kalman updates of the tracked parcels')
+    kalmanParser.add_argument('--tracks', type=int, nargs='+', default=[10, 50, 100, 200, 400, 1000])
+    kalmanParser.add_argument('--frames', type=int, default=50)
+
+    args = parser.parse_args()
+    if args.command == 'detectors':
+        benchmarkDetectors(args.backends, args.section, args.limit)
+    elif args.command == 'record':
+        recordSession(args.section, args.cam, args.output)
+    elif args.command == 'tracking':
+        benchmarkTracking(args.section, args.log, args.repeat, args.strategies, args.drop)
+    elif args.command == 'resolutions':
+        sizes = [tuple(int(x) for x in size.split('x')) for size in args.sizes]
+        benchmarkResolutions(sizes, args.section, args.limit)
+    elif args.command == 'undistortion':
+        benchmarkUndistortion(args.section, args.cam, args.limit)
+    elif args.command == 'replay':
+        benchmarkReplay(args.cam, args.workers, args.speed, args.limit)
+    elif args.command == 'pack':
+        packSession(args.section, args.cam, Path(args.output), args.raw)
+    elif args.command == 'store':
+        benchmarkStore(args.section, Path(args.store), args.repeat)
+    elif args.command == 'association':
+        benchmarkAssociation(args.tracks, args.repeat)
+    elif args.command == 'kalman':
+        benchmarkKalman(args.tracks, args.frames)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
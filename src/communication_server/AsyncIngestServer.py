@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+import logging
+import threading
+import time
+from queue import Empty, Full
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# taille maximale de la ligne de requête et des en-têtes
+MAX_HEADER_BYTES = 64 * 1024
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 431: 'Request Header Fields Too Large'}
+
+
+class CameraMailboxes:
+    """
+        Boîtes aux lettres des images reçues, une par caméra : seule la
+        dernière image de chaque caméra est gardée, une image non lue
+        remplacée par une plus récente est comptée comme perdue.
+
+        S'utilise comme la file imageQ du worker (get avec timeout, Empty) ;
+        put ne bloque jamais, la réception n'attend donc pas le tracking. Les
+        caméras ayant une image en attente sont servies à tour de rôle.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.latest = dict()
+        self.cameras = []
+        self.lastCam = -1
+        self.frames = dict()
+        self.drops = dict()
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Dépose une image {'file', 'ts', 'cam'} dans la boîte de sa caméra.
+        """
+        cam = item.get('cam')
+        with self.condition:
+            if cam not in self.frames:
+                self.cameras.append(cam)
+                self.frames[cam] = 0
+                self.drops[cam] = 0
+            if cam in self.latest:
+                self.drops[cam] += 1
+            self.latest[cam] = item
+            self.frames[cam] += 1
+            self.condition.notify()
+
+    def get(self, block=True, timeout=None):
+        """
+        Retourne la prochaine image en attente.
+
+        Raises:
+            Empty: si aucune image n'arrive avant timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.latest) > 0, timeout if block else 0):
+                raise Empty
+            for i in range(1, len(self.cameras) + 1):
+                index = (self.lastCam + i) % len(self.cameras)
+                if self.cameras[index] in self.latest:
+                    self.lastCam = index
+                    return self.latest.pop(self.cameras[index])
+
+    def empty(self):
+        with self.condition:
+            return len(self.latest) == 0
+
+    def full(self):
+        return False
+
+    def qsize(self):
+        with self.condition:
+            return len(self.latest)
+
+    def stats(self):
+        """
+        Returns:
+            Un dictionnaire par caméra : images reçues et perdues.
+        """
+        with self.condition:
+            return {cam: {'frames': self.frames[cam], 'drops': self.drops[cam]} for cam in self.cameras}
+
+
+class _HttpError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class AsyncIngestServer():
+    """
+        Serveur de réception des images et des résultats du tracker précédent,
+        sur une boucle asyncio (routes /postimage, /trtresult et /shutdown du
+        HttpServer Flask).
+
+        Les connexions des caméras restent ouvertes entre deux requêtes
+        (keep-alive HTTP/1.1). Un corps plus grand que maxBodyMB est refusé
+        (413). Les dépôts dans les files ne bloquent jamais : la plus ancienne
+        entrée est remplacée et comptée comme perdue.
+    """
+
+    def __init__(self, imageQ, incomingQ, logger, frameRing=None, maxBodyMB=16,
+                 keepAliveTimeout=60, statsInterval=60):
+        """
+        Args:
+            imageQ: file des images du worker, de préférence CameraMailboxes.
+            incomingQ: file des résultats du tracker précédent.
+            logger: logger du process.
+            frameRing: anneau partagé du worker (useFrameRing), utilisé à la place de imageQ.
+            maxBodyMB: taille maximale du corps d'une requête.
+            keepAliveTimeout: durée en secondes avant la fermeture d'une connexion inactive.
+            statsInterval: période en secondes de la trace des statistiques, 0 pour la désactiver.
+        """
+        self.imageQ = imageQ
+        self.incomingQ = incomingQ
+        self.logger = logger
+        self.frameRing = frameRing
+        self.maxBodyBytes = int(maxBodyMB * 1024 * 1024)
+        self.keepAliveTimeout = keepAliveTimeout
+        self.statsInterval = statsInterval
+
+        self.stoppingFlag = threading.Event()
+        self.loop = None
+        self.stopEvent = None
+        self.openConnectionTasks = dict()
+
+        self.connections = 0
+        self.openConnections = 0
+        self.requests = dict()
+        self.imageDrops = 0
+        self.incomingDrops = 0
+        self.oversize = 0
+        self.badRequests = 0
+        self.maxHandlingTime = 0.0
+
+    def run(self, host='0.0.0.0', port=5000):
+        """
+        Sert les requêtes jusqu'à /shutdown ou l'appel de stop.
+        """
+        asyncio.run(self._serve(host, port))
+        self.logger.info('Ingest server stats : {}'.format(self.stats()))
+
+    def stop(self):
+        self.stoppingFlag.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopEvent.set)
+
+    async def _serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self.stopEvent = asyncio.Event()
+        if self.stoppingFlag.is_set():
+            return
+        server = await asyncio.start_server(self._handleConnection, host, port, limit=MAX_HEADER_BYTES)
+        print('Ingest server listening on {}:{}'.format(host, port))
+        statsTask = self.loop.create_task(self._statsLoop()) if self.statsInterval > 0 else None
+        async with server:
+            await self.stopEvent.wait()
+            self.stoppingFlag.set()
+            # les connexions keep-alive en attente d'une requête sont fermées
+            for writer in list(self.openConnectionTasks.values()):
+                writer.close()
+            if len(self.openConnectionTasks) > 0:
+                await asyncio.wait(list(self.openConnectionTasks), timeout=1)
+        if statsTask is not None:
+            statsTask.cancel()
+
+    async def _statsLoop(self):
+        while True:
+            await asyncio.sleep(self.statsInterval)
+            self.logger.info('Ingest server stats : {}'.format(self.stats()))
+
+    async def _handleConnection(self, reader, writer):
+        self.connections += 1
+        self.openConnections += 1
+        self.openConnectionTasks[asyncio.current_task()] = writer
+        try:
+            while not self.stoppingFlag.is_set():
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepAliveTimeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                try:
+                    try:
+                        method, path, query, keepAlive, headers = self._parseHead(head)
+                    except ValueError:
+                        raise _HttpError(400, 'Bad request')
+                    body = await self._readBody(reader, writer, headers)
+                except _HttpError as e:
+                    if e.status == 413:
+                        self.oversize += 1
+                    else:
+                        self.badRequests += 1
+                    # le corps n'a pas été lu : la connexion ne peut pas être réutilisée
+                    await self._respond(writer, e.status, str(e), False)
+                    break
+                t0 = time.perf_counter()
+                status, text = self._route(method, path, query, body)
+                self.maxHandlingTime = max(self.maxHandlingTime, time.perf_counter() - t0)
+                await self._respond(writer, status, text, keepAlive)
+                if path == '/shutdown' and status == 200:
+                    self.stopEvent.set()
+                if not keepAlive:
+                    break
+        except asyncio.LimitOverrunError:
+            self.badRequests += 1
+            await self._respond(writer, 431, 'Request header too large', False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.openConnections -= 1
+            self.openConnectionTasks.pop(asyncio.current_task(), None)
+            writer.close()
+
+    def _parseHead(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = dict()
+        for line in lines[1:]:
+            if line == '':
+                continue
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keepAlive = connection != 'close'
+        elif version == 'HTTP/1.0':
+            keepAlive = connection == 'keep-alive'
+        else:
+            raise ValueError(version)
+        return method, url.path, query, keepAlive, headers
+
+    async def _readBody(self, reader, writer, headers):
+        chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise _HttpError(400, 'Invalid Content-Length')
+        if length > self.maxBodyBytes:
+            raise _HttpError(413, 'Body larger than {} bytes'.format(self.maxBodyBytes))
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        if not chunked:
+            return await reader.readexactly(length) if length > 0 else b''
+
+        chunks = []
+        received = 0
+        while True:
+            try:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            except ValueError:
+                raise _HttpError(400, 'Invalid chunk size')
+            if size == 0:
+                # en-têtes de fin ignorés
+                while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                    pass
+                return b''.join(chunks)
+            received += size
+            if received > self.maxBodyBytes:
+                raise _HttpError(413, 'Body larger than {} bytes'.format(self.maxBodyBytes))
+            chunks.append((await reader.readexactly(size + 2))[:-2])
+
+    async def _respond(self, writer, status, text, keepAlive):
+        body = text.encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: {}\r\n{}\r\n'.format(
+            status, _REASONS.get(status, ''), len(body), '' if keepAlive else 'Connection: close\r\n').encode('latin-1')
+            + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _route(self, method, path, query, body):
+        if path not in ('/postimage', '/trtresult', '/shutdown'):
+            return 404, 'Not found'
+        if method != 'POST':
+            return 405, 'Method not allowed'
+        self.requests[path] = self.requests.get(path, 0) + 1
+
+        if path == '/postimage':
+            if len(body) > 0:
+                if self.frameRing is not None:
+                    # l'image la plus récente remplace celle qui n'a pas encore été traitée
+                    received = self.frameRing.put(query.get('cam'), query.get('ts'), body)
+                else:
+                    self.imageDrops += self._offer(self.imageQ, {'file': io.BytesIO(body), 'ts': query.get('ts'),
+                                                                 'cam': query.get('cam')})
+                    received = True
+                if received:
+                    self.logger.info("--- image bien recue par le trt ---")
+            return 200, 'Image received(%d)' % len(body)
+
+        if path == '/trtresult':
+            self.logger.info("--- parcels_json trt {} {} ---".format(body, len(body)))
+            if len(body) > 0:
+                self.incomingDrops += self._offer(self.incomingQ, {'file': body, 'ts': query.get('ts')})
+                self.logger.info("--- trt_suivant a bien recu les infos du trt_result_prec ---")
+            return 200, 'trtresult received(%d)' % len(body)
+
+        print('Server shutting down...')
+        return 200, 'Server shutting down...'
+
+    def _offer(self, queue, item):
+        """
+        Dépose sans attendre dans une file bornée, en retirant l'entrée la plus
+        ancienne si elle est pleine.
+
+        Returns:
+            Le nombre d'entrées perdues (0 ou 1).
+        """
+        dropped = 0
+        while True:
+            try:
+                queue.put(item, block=False)
+                return dropped
+            except Full:
+                try:
+                    queue.get(block=False)
+                    dropped += 1
+                except Empty:
+                    pass
+
+    def stats(self):
+        """
+        Retourne les statistiques de réception.
+
+        Returns:
+            Un dictionnaire : connexions, requêtes par route, images et
+            résultats perdus, requêtes refusées, temps de traitement maximal
+            et, si disponible, le détail par caméra.
+        """
+        stats = {'connections': self.connections,
+                 'openConnections': self.openConnections,
+                 'requests': dict(self.requests),
+                 'imageDrops': self.imageDrops,
+                 'incomingDrops': self.incomingDrops,
+                 'oversize': self.oversize,
+                 'badRequests': self.badRequests,
+                 'maxHandlingMs': 1000 * self.maxHandlingTime}
+        if self.frameRing is not None:
+            stats['cameras'] = self.frameRing.stats()
+        elif hasattr(self.imageQ, 'stats'):
+            stats['cameras'] = self.imageQ.stats()
+        return stats
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from queue import Empty
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8 : segment en fichier mappé (_MmapSegment)
+    shared_memory = None
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# en-tête du segment : dimensions, pour qu'un autre process s'y attache sans configuration
+_HEADER_DTYPE = np.dtype([('cameras', np.int64), ('slots', np.int64), ('slotBytes', np.int64)])
+# une voie par caméra ; writeSeq/latestSlot/drops écrits par le producteur, readSeq par le consommateur
+_LANE_DTYPE = np.dtype([('cam', 'S32'), ('writeSeq', np.uint64), ('readSeq', np.uint64),
+                        ('latestSlot', np.int64), ('drops', np.uint64), ('oversize', np.uint64),
+                        ('torn', np.uint64)])
+# seq impair pendant l'écriture du slot (seqlock)
+_SLOT_DTYPE = np.dtype([('seq', np.uint64), ('length', np.int64), ('frameSeq', np.uint64), ('ts', 'S32')])
+
+
+class _MmapSegment:
+    """
+        Segment de mémoire partagée en fichier mappé sous /dev/shm, avec
+        l'interface de shared_memory.SharedMemory utilisée par FrameRing, pour
+        les versions de Python qui n'ont pas multiprocessing.shared_memory.
+    """
+
+    def __init__(self, name, create=False, size=0):
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.name = name
+        self.path = os.path.join(directory, name)
+        # FileExistsError / FileNotFoundError comme SharedMemory
+        fd = os.open(self.path, os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0), 0o600)
+        try:
+            if create:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+    def unlink(self):
+        os.unlink(self.path)
+
+
+def _openSegment(name, create=False, size=0):
+    if shared_memory is not None:
+        return shared_memory.SharedMemory(name=name, create=create, size=size)
+    return _MmapSegment(name, create, size)
+
+
+class Frame:
+    """
+        Image lue dans l'anneau : caméra, timestamp, numéro de séquence de la
+        voie et données (image décodée ou octets encodés).
+    """
+
+    def __init__(self, cam, ts, seq, data):
+        self.cam = cam
+        self.ts = ts
+        self.seq = seq
+        self.data = data
+
+
+class FrameRing:
+    """
+        Anneau d'images encodées en mémoire partagée, une voie de slots
+        préalloués par caméra.
+
+        Le producteur (HttpServer) écrit chaque image dans le slot suivant de la
+        voie de sa caméra, sans allocation. Le consommateur ne lit que la
+        dernière image de chaque voie : une image non lue remplacée par une plus
+        récente est comptée comme perdue. Chaque slot est protégé par un seqlock
+        : une lecture recouverte par une écriture est détectée et abandonnée.
+        Un seul producteur et un seul consommateur par anneau. Sans
+        multiprocessing.shared_memory (Python < 3.8), le segment est un fichier
+        mappé sous /dev/shm.
+    """
+
+    def __init__(self, name, cameras=4, slots=4, slotBytes=8 * 1024 * 1024, create=True):
+        """
+        Args:
+            name: nom du segment de mémoire partagée.
+            cameras: nombre maximum de caméras (voies).
+            slots: nombre de slots par caméra.
+            slotBytes: taille maximale d'une image encodée.
+            create: True pour créer le segment, False pour s'attacher à un segment existant.
+        """
+        self.name = name
+        self.owner = create
+        if create:
+            size = (_HEADER_DTYPE.itemsize + cameras * _LANE_DTYPE.itemsize
+                    + cameras * slots * (_SLOT_DTYPE.itemsize + slotBytes))
+            try:
+                self.shm = _openSegment(name, create=True, size=size)
+            except FileExistsError:
+                # segment laissé par un process arrêté brutalement
+                stale = _openSegment(name)
+                stale.close()
+                stale.unlink()
+                self.shm = _openSegment(name, create=True, size=size)
+            header = np.ndarray((1,), _HEADER_DTYPE, self.shm.buf)
+            header[0] = (cameras, slots, slotBytes)
+        else:
+            self.shm = _openSegment(name)
+            header = np.ndarray((1,), _HEADER_DTYPE, self.shm.buf)
+            cameras, slots, slotBytes = (int(x) for x in header[0])
+
+        self.cameras = cameras
+        self.slots = slots
+        self.slotBytes = slotBytes
+
+        offset = _HEADER_DTYPE.itemsize
+        self.lanes = np.ndarray((cameras,), _LANE_DTYPE, self.shm.buf, offset)
+        offset += cameras * _LANE_DTYPE.itemsize
+        self.slotInfo = np.ndarray((cameras, slots), _SLOT_DTYPE, self.shm.buf, offset)
+        offset += cameras * slots * _SLOT_DTYPE.itemsize
+        self.data = np.ndarray((cameras, slots, slotBytes), np.uint8, self.shm.buf, offset)
+        if create:
+            self.lanes[:] = np.zeros(cameras, _LANE_DTYPE)
+            self.lanes['latestSlot'] = -1
+            self.slotInfo[:] = np.zeros((cameras, slots), _SLOT_DTYPE)
+
+        self.laneLock = threading.Lock()
+        self.lastReadLane = -1
+
+    def close(self):
+        """
+        Détache le segment ; le créateur le supprime.
+        """
+        del self.lanes, self.slotInfo, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _lane(self, cam):
+        key = str(cam).encode('utf-8')[:32]
+        with self.laneLock:
+            for lane in range(self.cameras):
+                if self.lanes['cam'][lane] == key:
+                    return lane
+                if len(self.lanes['cam'][lane]) == 0:
+                    # première image de la caméra : voie libre suivante
+                    self.lanes['cam'][lane] = key
+                    return lane
+            raise ValueError('FrameRing {} : no lane left for camera {}'.format(self.name, cam))
+
+    def _beginWrite(self, cam, length):
+        lane = self._lane(cam)
+        if length > self.slotBytes:
+            self.lanes['oversize'][lane] += 1
+            logger.warning('FrameRing {} : frame of {} bytes exceeds slot size {}, dropped'.format(
+                self.name, length, self.slotBytes))
+            return lane, None
+        slot = (int(self.lanes['latestSlot'][lane]) + 1) % self.slots
+        self.slotInfo['seq'][lane, slot] += 1
+        return lane, slot
+
+    def _endWrite(self, lane, slot, ts, length):
+        info = self.slotInfo[lane, slot]
+        writeSeq = int(self.lanes['writeSeq'][lane]) + 1
+        info['length'] = length
+        info['frameSeq'] = writeSeq
+        info['ts'] = ('' if ts is None else str(ts)).encode('utf-8')[:32]
+        self.slotInfo['seq'][lane, slot] += 1
+        # l'image précédente n'a pas été lue : elle est remplacée (dernière image gagnante)
+        if writeSeq - 1 > int(self.lanes['readSeq'][lane]):
+            self.lanes['drops'][lane] += 1
+        self.lanes['latestSlot'][lane] = slot
+        self.lanes['writeSeq'][lane] = writeSeq
+
+    def put(self, cam, ts, data):
+        """
+        Copie une image encodée dans le prochain slot de la voie de la caméra.
+
+        Returns:
+            False si l'image dépasse la taille d'un slot.
+        """
+        length = len(data)
+        lane, slot = self._beginWrite(cam, length)
+        if slot is None:
+            return False
+        self.data[lane, slot, :length] = np.frombuffer(data, np.uint8)
+        self._endWrite(lane, slot, ts, length)
+        return True
+
+    def putFromStream(self, cam, ts, stream, length):
+        """
+        Lit une image encodée depuis un flux (corps de la requête HTTP)
+        directement dans le prochain slot, sans tampon intermédiaire.
+
+        Returns:
+            False si l'image dépasse la taille d'un slot ou si le flux est incomplet.
+        """
+        lane, slot = self._beginWrite(cam, length)
+        if slot is None:
+            return False
+        view = memoryview(self.data[lane, slot])[:length]
+        received = 0
+        while received < length:
+            if hasattr(stream, 'readinto'):
+                n = stream.readinto(view[received:])
+            else:
+                chunk = stream.read(length - received)
+                n = len(chunk)
+                view[received:received + n] = chunk
+            if not n:
+                break
+            received += n
+        if received < length:
+            # slot abandonné : le seqlock reste cohérent, l'image n'est pas publiée
+            self.slotInfo['seq'][lane, slot] += 1
+            return False
+        self._endWrite(lane, slot, ts, length)
+        return True
+
+    def _pendingLane(self):
+        # voies ayant une image non lue, servies à tour de rôle
+        pending = np.flatnonzero(self.lanes['writeSeq'] > self.lanes['readSeq'])
+        if len(pending) == 0:
+            return None
+        after = pending[pending > self.lastReadLane]
+        lane = int(after[0]) if len(after) > 0 else int(pending[0])
+        self.lastReadLane = lane
+        return lane
+
+    def get(self, timeout=None, decode=None, pollInterval=0.0005):
+        """
+        Retourne la dernière image non lue, en attendant au plus timeout secondes.
+
+        Args:
+            timeout: attente maximale en secondes, None pour attendre indéfiniment.
+            decode: fonction appliquée directement sur la vue du slot (par
+                exemple cv2.imdecode), sans copie. None pour recevoir une copie des octets.
+            pollInterval: période de scrutation de l'anneau.
+
+        Returns:
+            Un objet Frame.
+
+        Raises:
+            Empty: si aucune image n'arrive avant timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            lane = self._pendingLane()
+            if lane is not None:
+                frame = self._read(lane, decode)
+                if frame is not None:
+                    return frame
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                raise Empty
+            time.sleep(pollInterval)
+
+    def _read(self, lane, decode):
+        slot = int(self.lanes['latestSlot'][lane])
+        seq = int(self.slotInfo['seq'][lane, slot])
+        info = self.slotInfo[lane, slot].copy()
+        if seq % 2 == 1:
+            return None
+        view = self.data[lane, slot, :int(info['length'])]
+        data = decode(view) if decode is not None else view.tobytes()
+        if int(self.slotInfo['seq'][lane, slot]) != seq:
+            # slot réécrit pendant la lecture
+            self.lanes['torn'][lane] += 1
+            return None
+        self.lanes['readSeq'][lane] = info['frameSeq']
+        ts = info['ts'].decode('utf-8')
+        return Frame(self.lanes['cam'][lane].decode('utf-8'), ts if ts != '' else None,
+                     int(info['frameSeq']), data)
+
+    def stats(self):
+        """
+        Retourne les compteurs par caméra.
+
+        Returns:
+            Un dictionnaire par caméra : images écrites, perdues (remplacées
+            avant lecture), trop grandes et lectures recouvertes par une écriture.
+        """
+        return {cam.decode('utf-8'): {'frames': int(writeSeq), 'drops': int(drops),
+                                      'oversize': int(oversize), 'torn': int(torn)}
+                for cam, writeSeq, drops, oversize, torn
+                in zip(self.lanes['cam'], self.lanes['writeSeq'], self.lanes['drops'],
+                       self.lanes['oversize'], self.lanes['torn'])
+                if len(cam) > 0}
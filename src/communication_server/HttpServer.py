@@ -17,12 +17,27 @@ import io
 
 class HttpServer():
 
-    def __init__(self, imageQ,incomingQ, logger):
+    def __init__(self, imageQ,incomingQ, logger, frameRing=None):
         self.app = Flask(__name__)
         #app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
         self.logger = logger
+        self.frameRing = frameRing
         @self.app.route("/postimage", methods=['POST'])
         def imageIncoming():
+            if request.method == 'POST' and self.frameRing is not None:
+                # l'image est lue directement dans un slot de l'anneau partagé,
+                # la plus récente remplace celle qui n'a pas encore été traitée
+                length = request.content_length
+                if length is None:
+                    data = request.get_data()
+                    length = len(data)
+                    received = length > 0 and self.frameRing.put(request.args.get('cam'), request.args.get('ts'), data)
+                else:
+                    received = length > 0 and self.frameRing.putFromStream(request.args.get('cam'), request.args.get('ts'),
+                                                                          request.stream, length)
+                if received:
+                    self.logger.info("--- image bien recue par le trt ---")
+                return "Image received(%d)"%length
             if request.method == 'POST':
                 in_memory_file = io.BytesIO(request.get_data())
                 # print("Type:",type(request.data))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+import logging
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+from queue import Queue, Empty
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _ClientState:
+    """
+        Connexion d'un tracker au serveur d'inférence et ses statistiques.
+    """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.sendLock = threading.Lock()
+        self.connected = True
+
+        self.requests = 0
+        self.pending = 0
+        self.maxPending = 0
+        self.totalWait = 0.0
+        self.maxWait = 0.0
+        self.totalService = 0.0
+
+    def send(self, message):
+        with self.sendLock:
+            self.conn.send(message)
+
+    def stats(self):
+        return {'connected': self.connected,
+                'requests': self.requests,
+                'queueDepth': self.pending,
+                'maxQueueDepth': self.maxPending,
+                'meanWaitMs': 1000 * self.totalWait / self.requests if self.requests > 0 else 0.0,
+                'maxWaitMs': 1000 * self.maxWait,
+                'meanServiceMs': 1000 * self.totalService / self.requests if self.requests > 0 else 0.0}
+
+
+class _Request:
+
+    def __init__(self, client, image, frameKey):
+        self.client = client
+        self.image = image
+        self.frameKey = frameKey
+        self.tReceived = time.perf_counter()
+
+
+class InferenceServer():
+    """
+        Serveur d'inférence local : un seul détecteur chargé pour toutes les
+        instances de tracking de la machine.
+
+        Les trackers se connectent par une socket Unix (pas de réseau) avec le
+        backend 'remote', authentifiés par une clé partagée ; la socket est créée
+        dans un répertoire réservé à l'utilisateur du serveur. Les requêtes de toutes les caméras sont regroupées en
+        micro-batchs : un batch part dès qu'il contient maxBatchSize images ou
+        que la plus ancienne requête a attendu batchDeadlineMs.
+    """
+
+    def __init__(self, detector, socketPath, authkey, maxBatchSize=4, batchDeadlineMs=10, statsInterval=60):
+        """
+        Args:
+            detector: détecteur chargé une seule fois (createDetector).
+            socketPath: chemin de la socket Unix, dans un répertoire privé (créé en 0700 si absent).
+            authkey: clé partagée avec les trackers (inferenceAuthkey de parcelTracker.ini).
+            maxBatchSize: nombre maximum d'images par appel au détecteur.
+            batchDeadlineMs: attente maximale d'une requête avant l'envoi du batch.
+            statsInterval: période en secondes de la trace des statistiques, 0 pour la désactiver.
+
+        Raises:
+            ValueError: si la clé est vide.
+            PermissionError: si le répertoire de la socket n'est pas réservé à l'utilisateur.
+        """
+        if not authkey:
+            raise ValueError('The inference server requires a non empty authkey')
+        self.detector = detector
+        self.socketPath = str(socketPath)
+        self.maxBatchSize = maxBatchSize
+        self.batchDeadline = batchDeadlineMs / 1000
+        self.statsInterval = statsInterval
+
+        self.stoppingFlag = threading.Event()
+        self.requestQ = Queue()
+        self.clients = []
+        self.clientsLock = threading.Lock()
+        self.batches = 0
+        self.batchedImages = 0
+
+        self._checkSocketDir()
+        # une socket restée d'une exécution précédente empêche l'écoute
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        self.listener = Listener(self.socketPath, family='AF_UNIX', authkey=authkey.encode())
+        os.chmod(self.socketPath, 0o600)
+
+    def _checkSocketDir(self):
+        """
+        Crée le répertoire de la socket en 0700 et vérifie qu'il n'est
+        accessible qu'à l'utilisateur du serveur.
+        """
+        socketDir = os.path.dirname(os.path.abspath(self.socketPath))
+        os.makedirs(socketDir, mode=0o700, exist_ok=True)
+        status = os.stat(socketDir)
+        if status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise PermissionError('Inference socket directory {} must be owned by the server user '
+                                  'with mode 0700'.format(socketDir))
+
+    def run(self):
+        """
+        Sert les trackers jusqu'à l'appel de stop.
+        """
+        batchThread = threading.Thread(target=self._batchLoop, name='inferenceBatch')
+        batchThread.daemon = True
+        batchThread.start()
+        if self.statsInterval > 0:
+            statsThread = threading.Thread(target=self._statsLoop, name='inferenceStats')
+            statsThread.daemon = True
+            statsThread.start()
+
+        logger.info('Inference server listening on {}'.format(self.socketPath))
+        print('Inference server listening on {}'.format(self.socketPath))
+        while not self.stoppingFlag.is_set():
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError as e:
+                logger.warning('Inference client rejected : {}'.format(e))
+                continue
+            except (OSError, EOFError) as e:
+                # listener fermé par stop, ou client déconnecté pendant l'authentification
+                if self.stoppingFlag.is_set():
+                    break
+                logger.warning('Inference client connection failed : {}'.format(e))
+                continue
+            clientThread = threading.Thread(target=self._serveClient, args=(conn,))
+            clientThread.daemon = True
+            clientThread.start()
+        batchThread.join()
+
+    def stop(self):
+        self.stoppingFlag.set()
+        self.listener.close()
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+
+    def _serveClient(self, conn):
+        client = None
+        try:
+            _, name = conn.recv()
+            client = _ClientState(conn, name)
+            with self.clientsLock:
+                # une reconnexion remplace les statistiques de la connexion précédente
+                self.clients = [c for c in self.clients if c.connected or c.name != name]
+                self.clients.append(client)
+            logger.info('Inference client connected : {}'.format(name))
+
+            while not self.stoppingFlag.is_set():
+                message = conn.recv()
+                if message[0] == 'detect':
+                    _, cam, ts, shape, dtype = message
+                    image = np.frombuffer(conn.recv_bytes(), dtype).reshape(shape)
+                    client.pending += 1
+                    client.maxPending = max(client.maxPending, client.pending)
+                    self.requestQ.put(_Request(client, image, (cam, ts)))
+                elif message[0] == 'stats':
+                    client.send(('stats', self.stats()))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.error('Invalid request from inference client {} : {}'.format(client.name if client else '?', e))
+        finally:
+            if client is not None:
+                client.connected = False
+                logger.info('Inference client disconnected : {}'.format(client.name))
+            conn.close()
+
+    def _batchLoop(self):
+        while not self.stoppingFlag.is_set():
+            try:
+                batch = [self.requestQ.get(timeout=0.5)]
+            except Empty:
+                continue
+            deadline = batch[0].tReceived + self.batchDeadline
+            while len(batch) < self.maxBatchSize:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requestQ.get(timeout=remaining))
+                except Empty:
+                    break
+            self._runBatch(batch)
+
+    def _runBatch(self, batch):
+        tStart = time.perf_counter()
+        try:
+            results = self.detector.run_inference_for_frames_array([request.image for request in batch],
+                                                                   [request.frameKey for request in batch])
+            messages = [('detections', detections) for detections in results]
+        except Exception as e:
+            logger.error('Inference failed on a batch of {} images : {}'.format(len(batch), e))
+            messages = [('error', str(e))] * len(batch)
+        tEnd = time.perf_counter()
+
+        self.batches += 1
+        self.batchedImages += len(batch)
+        for request, message in zip(batch, messages):
+            client = request.client
+            wait = tStart - request.tReceived
+            client.requests += 1
+            client.pending -= 1
+            client.totalWait += wait
+            client.maxWait = max(client.maxWait, wait)
+            client.totalService += tEnd - request.tReceived
+            if not client.connected:
+                continue
+            try:
+                client.send(message)
+            except OSError:
+                client.connected = False
+
+    def _statsLoop(self):
+        while not self.stoppingFlag.wait(self.statsInterval):
+            logger.info('Inference server stats : {}'.format(self.stats()))
+
+    def stats(self):
+        """
+        Retourne les statistiques du serveur.
+
+        Returns:
+            Un dictionnaire : nombre de batchs, taille moyenne des batchs et,
+            par client, requêtes, profondeur de file et temps d'attente.
+        """
+        with self.clientsLock:
+            clients = list(self.clients)
+        return {'batches': self.batches,
+                'meanBatchSize': self.batchedImages / self.batches if self.batches > 0 else 0.0,
+                'clients': {client.name: client.stats() for client in clients}}
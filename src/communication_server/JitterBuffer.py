@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import heapq
+import itertools
+import threading
+import time
+from queue import Empty
+
+
+class JitterBuffer:
+    """
+        Tampon de gigue des images reçues par une unité, ordonné par le
+        timestamp des caméras (paramètre ts des requêtes, en millisecondes).
+
+        Une image est gardée holdMs après sa réception pour laisser arriver les
+        images plus anciennes retardées par le réseau, puis rendue avec toutes
+        les images en attente dont le timestamp est dans la même fenêtre de
+        groupWindowMs (images des différentes caméras d'un même instant).
+        Sont abandonnées :
+            les images arrivées après qu'une image plus récente a été rendue (late),
+            les images plus anciennes que deadlineMs par rapport à la plus
+            récente reçue (stale),
+            les plus anciennes images au-delà de maxFrames en attente (overflow).
+
+        S'utilise comme la file imageQ du worker (put, get avec timeout, Empty) ;
+        put ne bloque jamais.
+    """
+
+    def __init__(self, holdMs=60, deadlineMs=500, groupWindowMs=20, maxFrames=32):
+        """
+        Args:
+            holdMs: durée de rétention d'une image avant qu'elle soit rendue.
+            deadlineMs: âge maximal d'une image, par rapport au timestamp le plus récent reçu.
+            groupWindowMs: fenêtre de timestamps des images rendues ensemble.
+            maxFrames: nombre maximum d'images en attente.
+        """
+        self.hold = holdMs / 1000
+        self.deadlineMs = deadlineMs
+        self.groupWindowMs = groupWindowMs
+        self.maxFrames = maxFrames
+
+        self.condition = threading.Condition()
+        # (ts, numéro d'arrivée, instant de réception, image)
+        self.pending = []
+        self.ready = []
+        self.arrivals = itertools.count()
+        self.newestTs = None
+        self.lastReleasedTs = None
+
+        self.received = 0
+        self.released = 0
+        self.untimed = 0
+        self.reordered = 0
+        self.late = 0
+        self.stale = 0
+        self.overflow = 0
+        self.groups = 0
+        self.groupedFrames = 0
+        self.totalLateness = 0.0
+        self.maxLateness = 0.0
+
+    @staticmethod
+    def _parseTs(ts):
+        try:
+            return float(ts)
+        except (TypeError, ValueError):
+            return None
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Dépose une image {'file', 'ts', 'cam'}.
+        """
+        ts = self._parseTs(item.get('ts'))
+        with self.condition:
+            self.received += 1
+            if ts is None:
+                # sans timestamp l'image ne peut pas être ordonnée : rendue telle quelle
+                self.untimed += 1
+                self.ready.append(item)
+                self.condition.notify()
+                return
+            if self.lastReleasedTs is not None and ts <= self.lastReleasedTs:
+                self.late += 1
+                return
+            if self.newestTs is not None and ts < self.newestTs:
+                # arrivée dans le désordre, encore à temps pour être réordonnée
+                lateness = self.newestTs - ts
+                if lateness > self.deadlineMs:
+                    self.stale += 1
+                    return
+                self.reordered += 1
+                self.totalLateness += lateness
+                self.maxLateness = max(self.maxLateness, lateness)
+            else:
+                self.newestTs = ts
+            heapq.heappush(self.pending, (ts, next(self.arrivals), time.monotonic(), item))
+
+            while self.pending and self.newestTs - self.pending[0][0] > self.deadlineMs:
+                heapq.heappop(self.pending)
+                self.stale += 1
+            while len(self.pending) > self.maxFrames:
+                heapq.heappop(self.pending)
+                self.overflow += 1
+            self.condition.notify()
+
+    def _releaseGroup(self):
+        # la plus ancienne image et celles de sa fenêtre, dans l'ordre des timestamps
+        groupEnd = self.pending[0][0] + self.groupWindowMs
+        while self.pending and self.pending[0][0] <= groupEnd:
+            ts, _, _, item = heapq.heappop(self.pending)
+            self.ready.append(item)
+            self.lastReleasedTs = ts
+            self.groupedFrames += 1
+        self.groups += 1
+
+    def get(self, block=True, timeout=None):
+        """
+        Retourne la prochaine image dans l'ordre des timestamps.
+
+        Raises:
+            Empty: si aucune image n'est rendue avant timeout.
+        """
+        deadline = None if timeout is None or not block else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if not self.ready and self.pending and now >= self.pending[0][2] + self.hold:
+                    self._releaseGroup()
+                if self.ready:
+                    self.released += 1
+                    return self.ready.pop(0)
+
+                wait = self.pending[0][2] + self.hold - now if self.pending else None
+                if not block:
+                    raise Empty
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+
+    def empty(self):
+        with self.condition:
+            return not self.ready and not self.pending
+
+    def full(self):
+        return False
+
+    def qsize(self):
+        with self.condition:
+            return len(self.ready) + len(self.pending)
+
+    def stats(self):
+        """
+        Retourne les statistiques du tampon.
+
+        Returns:
+            Un dictionnaire : images reçues, rendues, réordonnées, abandonnées
+            (late, stale, overflow), nombre et taille moyenne des groupes et
+            retard des images réordonnées en millisecondes de timestamp.
+        """
+        with self.condition:
+            return {'received': self.received,
+                    'released': self.released,
+                    'untimed': self.untimed,
+                    'reordered': self.reordered,
+                    'late': self.late,
+                    'stale': self.stale,
+                    'overflow': self.overflow,
+                    'groups': self.groups,
+                    'meanGroupSize': self.groupedFrames / self.groups if self.groups > 0 else 0.0,
+                    'meanLatenessMs': self.totalLateness / self.reordered if self.reordered > 0 else 0.0,
+                    'maxLatenessMs': self.maxLateness}
@@ -0,0 +1,133 @@
+import logging
+import numpy as np
+
+from libs.fasterObjectDetection.util import load_labelmap
+
+logger = logging.getLogger(__name__)
+
+# détections compactes : box (ymin, xmin, ymax, xmax) normalisée, score, id de classe
+DETECTION_DTYPE = np.dtype([('box', np.float32, (4,)), ('score', np.float32), ('classId', np.int32)])
+
+
+class BaseDetector:
+    """
+        Classe BaseDetector, interface commune des backends de détection.
+
+        Un backend n'a qu'à implémenter _runBatch, qui retourne un dictionnaire
+        au format de l'API TF Object Detection ('num_detections',
+        'detection_boxes', 'detection_scores', 'detection_classes') pour un
+        batch d'images. Le post-traitement commun garantit le même contrat
+        (numObj, objectList) quel que soit le backend.
+    """
+
+    backendName = 'base'
+    supportsBatch = True
+
+    def __init__(self, PATH_TO_LABELS, min_score_threshold=0.5):
+        self.category_index = load_labelmap(PATH_TO_LABELS)
+        self.classNames = {int(classId): name for classId, name in self.category_index.items()}
+        self.min_score_threshold = min_score_threshold
+        self.frameKey = (None, None)
+
+    def setFrameKey(self, cam, ts):
+        """
+        Indique la caméra et le timestamp de la prochaine image passée au
+        détecteur. Sans effet pour les backends d'inférence, utilisé par
+        l'enregistrement et le rejeu des détections.
+        """
+        self.frameKey = (cam, ts)
+
+    def _runBatch(self, images):
+        """
+        Réalise l'inférence brute sur un batch d'images.
+
+        Args:
+            images: tableau numpy (batch, hauteur, largeur, 3).
+
+        Returns:
+            Le dictionnaire de sortie au format TF Object Detection.
+        """
+        raise NotImplementedError
+
+    def _initRun(self, initSize):
+        data = np.random.randint(0, high=255, size=initSize).astype(np.uint8)
+        self._runBatch(np.expand_dims(data, 0))
+
+    def run_inference_for_frame_array(self, image):
+        """
+        Réalise l'inférence sur une image.
+
+        Returns:
+            Le tableau structuré (DETECTION_DTYPE) des détections au dessus du seuil.
+        """
+        output_dict = self._runBatch(np.expand_dims(image, 0))
+        return self._transformOutputdictInDetections(output_dict)
+
+    def run_inference_for_frame(self, image):
+        # Run inference
+        return self.detectionsToObjectList(self.run_inference_for_frame_array(image))
+
+    def run_inference_for_frames_array(self, images, frameKeys=None):
+        """
+        Réalise l'inférence sur plusieurs images en un seul appel de session
+        (une image par caméra pour un même tick).
+
+        Args:
+            images: liste d'images de même dimension.
+            frameKeys: liste optionnelle des (caméra, timestamp) des images.
+
+        Returns:
+            Une liste de tableaux structurés (DETECTION_DTYPE), un par image,
+            dans l'ordre des images fournies.
+        """
+        if len(images) == 0:
+            return []
+        if not self.supportsBatch or len(images) == 1 or len({image.shape for image in images}) != 1:
+            # le graphe ne prend qu'un batch d'images de même taille
+            results = []
+            for i, image in enumerate(images):
+                if frameKeys is not None:
+                    self.setFrameKey(*frameKeys[i])
+                results.append(self.run_inference_for_frame_array(image))
+            return results
+
+        output_dict = self._runBatch(np.stack(images))
+        return [self._transformOutputdictInDetections(output_dict, i) for i in range(len(images))]
+
+    def run_inference_for_frames(self, images, frameKeys=None):
+        """
+        Comme run_inference_for_frames_array, au format (numObj, objectList).
+        """
+        return [self.detectionsToObjectList(detections)
+                for detections in self.run_inference_for_frames_array(images, frameKeys)]
+
+    def _transformOutputdictInDetections(self, output_dict, index=0):
+        """
+        Filtre par seuil de score les sorties brutes d'une image du batch,
+        sans boucle Python.
+
+        Returns:
+            Le tableau structuré (DETECTION_DTYPE) des détections retenues.
+        """
+        scores = np.asarray(output_dict['detection_scores'][index], np.float32)
+        numDetections = min(int(output_dict['num_detections'][index]), len(scores))
+        keep = np.flatnonzero(scores[:numDetections] > self.min_score_threshold)
+
+        detections = np.empty(len(keep), DETECTION_DTYPE)
+        detections['box'] = np.asarray(output_dict['detection_boxes'][index], np.float32)[keep]
+        detections['score'] = scores[keep]
+        detections['classId'] = np.asarray(output_dict['detection_classes'][index])[keep].astype(np.int32)
+        return detections
+
+    def detectionsToObjectList(self, detections):
+        """
+        Vue de compatibilité : convertit le tableau structuré au format
+        [class, score, box] attendu par detectAndFilterParcels.
+
+        Returns:
+            Le tuple (numObj, objectList).
+        """
+        boxes = detections['box'].tolist()
+        objectList = [[self.classNames.get(classId, str(classId)), score, tuple(box)]
+                      for classId, score, box in zip(detections['classId'].tolist(), detections['score'], boxes)]
+        return len(objectList), objectList
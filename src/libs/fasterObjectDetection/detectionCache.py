@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def detectorIdentity(backend, modelPath, min_score_threshold, *extra):
+    """
+    Construit l'identité d'un détecteur pour le cache : backend, modèle (chemin,
+    taille et date de modification) et seuil. Changer l'un d'eux invalide le cache.
+
+    Returns:
+        Une chaîne identifiant le détecteur.
+    """
+    try:
+        stat = os.stat(str(modelPath))
+        modelStamp = '{}:{}'.format(stat.st_size, int(stat.st_mtime))
+    except OSError:
+        modelStamp = 'missing'
+    return '|'.join([backend, str(modelPath), modelStamp, repr(float(min_score_threshold))] + [str(e) for e in extra])
+
+
+class CachedDetector:
+    """
+        Enveloppe un détecteur avec un cache des détections par contenu d'image.
+
+        La clé est un hash rapide (blake2b) des pixels décodés, de la forme de
+        l'image et de l'identité du détecteur. Un LRU en mémoire est placé devant
+        un cache disque borné en taille (les entrées les moins récemment
+        utilisées sont supprimées en premier).
+    """
+
+    def __init__(self, detector, identity, maxEntries=256, cacheDir=None, maxDiskBytes=0):
+        """
+        Args:
+            detector: le détecteur enveloppé.
+            identity: identité du détecteur (voir detectorIdentity).
+            maxEntries: nombre d'entrées du LRU mémoire.
+            cacheDir: dossier du cache disque, None pour le désactiver.
+            maxDiskBytes: taille maximale du cache disque en octets, 0 pour le désactiver.
+        """
+        self.detector = detector
+        self.identity = identity.encode('utf-8')
+        self.maxEntries = maxEntries
+        self.memory = OrderedDict()
+
+        self.cacheDir = str(cacheDir) if cacheDir is not None and maxDiskBytes > 0 else None
+        self.maxDiskBytes = maxDiskBytes
+        self.diskBytes = 0
+
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.diskEvictions = 0
+
+        if self.cacheDir is not None:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self.diskBytes = sum(entry.stat().st_size for entry in os.scandir(self.cacheDir)
+                                 if entry.name.endswith('.pkl'))
+            self._evictDisk()
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def setFrameKey(self, cam, ts):
+        self.detector.setFrameKey(cam, ts)
+
+    def _imageKey(self, image):
+        image = np.ascontiguousarray(image)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.identity)
+        h.update(str(image.shape).encode('ascii'))
+        h.update(image.dtype.str.encode('ascii'))
+        h.update(image.data)
+        return h.hexdigest()
+
+    def _diskPath(self, key):
+        return os.path.join(self.cacheDir, key + '.pkl')
+
+    def _lookup(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.memoryHits += 1
+            return self.memory[key]
+
+        if self.cacheDir is not None:
+            path = self._diskPath(key)
+            try:
+                with open(path, 'rb') as fp:
+                    result = pickle.load(fp)
+                os.utime(path)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                result = None
+            if result is not None:
+                self.diskHits += 1
+                self._storeMemory(key, result)
+                return result
+
+        self.misses += 1
+        return None
+
+    def _storeMemory(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last=False)
+
+    def _store(self, key, result):
+        self._storeMemory(key, result)
+        if self.cacheDir is None:
+            return
+        path = self._diskPath(key)
+        tmpPath = path + '.tmp'
+        try:
+            with open(tmpPath, 'wb') as fp:
+                pickle.dump(result, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, path)
+            self.diskBytes += os.path.getsize(path)
+        except OSError as e:
+            logger.warning('Detection cache write failed : {}'.format(e))
+            return
+        self._evictDisk()
+
+    def _evictDisk(self):
+        if self.diskBytes <= self.maxDiskBytes:
+            return
+        entries = sorted((entry for entry in os.scandir(self.cacheDir) if entry.name.endswith('.pkl')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.diskBytes <= self.maxDiskBytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.diskBytes -= size
+            self.diskEvictions += 1
+
+    def run_inference_for_frame(self, image):
+        key = self._imageKey(image)
+        result = self._lookup(key)
+        if result is None:
+            result = self.detector.run_inference_for_frame(image)
+            self._store(key, result)
+        return result
+
+    def run_inference_for_frames(self, images, frameKeys=None):
+        keys = [self._imageKey(image) for image in images]
+        results = [self._lookup(key) for key in keys]
+        missing = [i for i in range(len(images)) if results[i] is None]
+        if len(missing) > 0:
+            computed = self.detector.run_inference_for_frames(
+                [images[i] for i in missing],
+                [frameKeys[i] for i in missing] if frameKeys is not None else None)
+            for i, result in zip(missing, computed):
+                results[i] = result
+                self._store(keys[i], result)
+        return results
+
+    def stats(self):
+        """
+        Retourne les compteurs du cache.
+
+        Returns:
+            Un dictionnaire des hits mémoire et disque, miss, taux de hit et
+            occupation des deux niveaux.
+        """
+        lookups = self.memoryHits + self.diskHits + self.misses
+        return {'memoryHits': self.memoryHits,
+                'diskHits': self.diskHits,
+                'misses': self.misses,
+                'hitRate': (self.memoryHits + self.diskHits) / lookups if lookups > 0 else 0.0,
+                'memoryEntries': len(self.memory),
+                'diskBytes': self.diskBytes,
+                'diskEvictions': self.diskEvictions}
@@ -3,26 +3,25 @@ import numpy as np
 import tensorflow as tf
 import os
 
-from PIL import Image
-from config.directories import directories as dirs
-from libs.fasterObjectDetection.util import load_labelmap
+from libs.fasterObjectDetection.baseDetector import BaseDetector
 
 logger = logging.getLogger(__name__)
 
 
-class ObjectDetector:
+class ObjectDetector(BaseDetector):
     """
-        Classe ObjectDector.
+        Classe ObjectDector, backend TensorFlow (graphe TF1 gelé).
     """
 
+    backendName = 'tensorflow'
+
     def __init__(self, PATH_TO_CKPT, PATH_TO_LABELS,
                  min_score_threshold=0.5, gpuDevice="0",
-                 gpuFraction=0.5, initSize=(972, 1296, 3)):
+                 gpuFraction=0.5, initSize=(972, 1296, 3), cpuThreads=0):
 
         logger.info('\nInitialization of ObjectDetector, and GPU loadings')
 
-        self.category_index = load_labelmap(PATH_TO_LABELS)
-        self.min_score_threshold = min_score_threshold
+        BaseDetector.__init__(self, PATH_TO_LABELS, min_score_threshold)
         os.environ["CUDA_VISIBLE_DEVICES"] = gpuDevice
 
         # with tf.device('/device:GPU:1'):
@@ -37,6 +36,9 @@ class ObjectDetector:
 
             config = tf.compat.v1.ConfigProto() # tf.ConfigProto()
             config.gpu_options.per_process_gpu_memory_fraction = gpuFraction
+            if cpuThreads > 0:
+                config.intra_op_parallelism_threads = cpuThreads
+                config.inter_op_parallelism_threads = cpuThreads
             self.sess = tf.compat.v1.Session(graph=self.detection_graph, config=config) #tf.Session
 
         ops = self.detection_graph.get_operations()
@@ -50,38 +52,17 @@ class ObjectDetector:
 
         self.image_tensor = self.detection_graph.get_tensor_by_name('image_tensor:0')
 
+        # seuil appliqué dans le graphe : les sorties sont triées par score
+        # décroissant, seules les lignes utiles du batch sortent de la session
+        with self.detection_graph.as_default():
+            scores = self.tensor_dict['detection_scores']
+            keepCount = tf.reduce_max(tf.reduce_sum(tf.cast(scores > min_score_threshold, tf.int32), axis=1))
+            for key in ['detection_boxes', 'detection_scores', 'detection_classes']:
+                self.tensor_dict[key] = self.tensor_dict[key][:, :keepCount]
+
         logger.info('Starting initRun...')
-        self.__initRun(initSize)
+        self._initRun(initSize)
         logger.info('End of init, ObjectDector ready')
 
-    def __initRun(self, initSize):
-        data = Image.fromarray(np.random.randint(0, high=255, size=initSize), 'RGB')
-        self.sess.run(self.tensor_dict, feed_dict={self.image_tensor: np.expand_dims(data, 0)})
-
-    def run_inference_for_frame(self, image):
-        # Run inference
-        output_dict = self.sess.run(self.tensor_dict, feed_dict={self.image_tensor: np.expand_dims(image, 0)})
-        return self.__transformOutputdictInObjectList(output_dict)
-
-    def __transformOutputdictInObjectList(self, output_dict):
-
-        objectList = []
-        numObjects = 0
-
-        classes = output_dict['detection_classes'][0].astype(np.uint8)
-        detection_boxes = output_dict['detection_boxes'][0]
-        detection_scores = output_dict['detection_scores'][0]
-
-        for i in range(int(output_dict['num_detections'][0])):
-            score = detection_scores[i]
-            if score > self.min_score_threshold:
-                numObjects += 1
-                objectList.append([])
-                box = tuple(detection_boxes[i].tolist())
-                if str(classes[i]) in self.category_index.keys():
-                    class_name = self.category_index[str(classes[i])] #['name']
-                objectList[-1].append(class_name)
-                objectList[-1].append(score)
-                objectList[-1].append(box)
-
-        return numObjects, objectList
+    def _runBatch(self, images):
+        return self.sess.run(self.tensor_dict, feed_dict={self.image_tensor: images})
@@ -0,0 +1,57 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DETECTOR_BACKENDS = ['tensorflow', 'opencv', 'onnx', 'recorded', 'remote']
+
+
+def createDetector(backend, PATH_TO_CKPT, PATH_TO_LABELS, min_score_threshold=0.5,
+                   gpuDevice="0", gpuFraction=0.5, initSize=(972, 1296, 3),
+                   cpuThreads=0, PATH_TO_CONFIG=None, PATH_TO_LOG=None,
+                   PATH_TO_SOCKET=None, clientName=None, authkey=''):
+    """
+    Crée le détecteur correspondant au backend demandé. Les modules des
+    backends sont importés à la demande pour ne pas imposer toutes les
+    dépendances (tensorflow, onnxruntime) sur chaque machine.
+
+    Args:
+        backend: nom du backend ('tensorflow', 'opencv', 'onnx', 'recorded' ou 'remote').
+        PATH_TO_CKPT: chemin du modèle (.pb ou .onnx).
+        PATH_TO_LABELS: chemin du label map json.
+        min_score_threshold: seuil de score des détections.
+        gpuDevice: GPU visible (backend tensorflow uniquement).
+        gpuFraction: fraction mémoire GPU (backend tensorflow uniquement).
+        initSize: dimension de l'image de préchauffage.
+        cpuThreads: nombre de threads CPU, 0 pour le défaut du runtime.
+        PATH_TO_CONFIG: description texte du graphe (backend opencv uniquement).
+        PATH_TO_LOG: journal de détections enregistrées (backend recorded uniquement).
+        PATH_TO_SOCKET: socket du serveur d'inférence local (backend remote uniquement).
+        clientName: nom du client auprès du serveur d'inférence (backend remote uniquement).
+        authkey: clé partagée avec le serveur d'inférence (backend remote uniquement).
+
+    Returns:
+        Un détecteur respectant le contrat (numObj, objectList).
+
+    Raises:
+        ValueError: si le backend est inconnu.
+    """
+    if backend == 'tensorflow':
+        from libs.fasterObjectDetection.detector import ObjectDetector
+        return ObjectDetector(PATH_TO_CKPT, PATH_TO_LABELS, min_score_threshold,
+                              gpuDevice, gpuFraction, initSize, cpuThreads)
+    elif backend == 'opencv':
+        from libs.fasterObjectDetection.opencvDetector import OpenCVDetector
+        return OpenCVDetector(PATH_TO_CKPT, PATH_TO_LABELS, PATH_TO_CONFIG,
+                              min_score_threshold, initSize, cpuThreads)
+    elif backend == 'onnx':
+        from libs.fasterObjectDetection.onnxDetector import OnnxDetector
+        return OnnxDetector(PATH_TO_CKPT, PATH_TO_LABELS,
+                            min_score_threshold, initSize, cpuThreads)
+    elif backend == 'recorded':
+        from libs.fasterObjectDetection.recordedDetector import RecordedDetector
+        return RecordedDetector(PATH_TO_LOG, PATH_TO_LABELS, min_score_threshold)
+    elif backend == 'remote':
+        from libs.fasterObjectDetection.remoteDetector import RemoteDetector
+        return RemoteDetector(PATH_TO_SOCKET, PATH_TO_LABELS, min_score_threshold, clientName, authkey)
+
+    raise ValueError('Unknown detector backend : {} (expected one of {})'.format(backend, DETECTOR_BACKENDS))
@@ -0,0 +1,52 @@
+import logging
+import numpy as np
+import onnxruntime as ort
+
+from libs.fasterObjectDetection.baseDetector import BaseDetector
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_KEYS = ['num_detections', 'detection_boxes',
+               'detection_scores', 'detection_classes']
+
+
+class OnnxDetector(BaseDetector):
+    """
+        Classe OnnxDetector, backend CPU basé sur ONNX Runtime.
+
+        Le modèle est l'export ONNX (tf2onnx) du graphe gelé : il prend une
+        entrée uint8 NHWC et garde les sorties nommées de l'API TF Object Detection.
+    """
+
+    backendName = 'onnx'
+
+    def __init__(self, PATH_TO_CKPT, PATH_TO_LABELS,
+                 min_score_threshold=0.5, initSize=(972, 1296, 3), cpuThreads=0):
+
+        logger.info('\nInitialization of OnnxDetector')
+
+        BaseDetector.__init__(self, PATH_TO_LABELS, min_score_threshold)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if cpuThreads > 0:
+            options.intra_op_num_threads = cpuThreads
+        self.sess = ort.InferenceSession(str(PATH_TO_CKPT), options, providers=['CPUExecutionProvider'])
+
+        self.inputName = self.sess.get_inputs()[0].name
+        # tf2onnx conserve le suffixe ':0' des tenseurs TF
+        self.outputNames = {}
+        for output in self.sess.get_outputs():
+            key = output.name.split(':')[0]
+            if key in OUTPUT_KEYS:
+                self.outputNames[key] = output.name
+
+        logger.info('Starting initRun...')
+        self._initRun(initSize)
+        logger.info('End of init, OnnxDetector ready')
+
+    def _runBatch(self, images):
+        keys = list(self.outputNames.keys())
+        outputs = self.sess.run([self.outputNames[key] for key in keys],
+                                {self.inputName: np.ascontiguousarray(images, dtype=np.uint8)})
+        return dict(zip(keys, outputs))
@@ -0,0 +1,64 @@
+import logging
+import numpy as np
+import cv2
+
+from libs.fasterObjectDetection.baseDetector import BaseDetector
+
+logger = logging.getLogger(__name__)
+
+
+class OpenCVDetector(BaseDetector):
+    """
+        Classe OpenCVDetector, backend CPU basé sur le module DNN d'OpenCV.
+
+        Le graphe gelé est chargé avec sa description texte (.pbtxt générée par
+        tf_text_graph_faster_rcnn.py). La sortie DetectionOutput d'OpenCV est
+        convertie au format TF Object Detection pour partager le post-traitement.
+    """
+
+    backendName = 'opencv'
+
+    def __init__(self, PATH_TO_CKPT, PATH_TO_LABELS, PATH_TO_CONFIG,
+                 min_score_threshold=0.5, initSize=(972, 1296, 3), cpuThreads=0):
+
+        logger.info('\nInitialization of OpenCVDetector')
+
+        BaseDetector.__init__(self, PATH_TO_LABELS, min_score_threshold)
+        if cpuThreads > 0:
+            cv2.setNumThreads(cpuThreads)
+
+        self.net = cv2.dnn.readNetFromTensorflow(str(PATH_TO_CKPT), str(PATH_TO_CONFIG))
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+        logger.info('Starting initRun...')
+        self._initRun(initSize)
+        logger.info('End of init, OpenCVDetector ready')
+
+    def _runBatch(self, images):
+        # les images sont passées telles quelles (BGR) comme pour le backend TF
+        blob = cv2.dnn.blobFromImages(list(images), 1.0, swapRB=False, crop=False)
+        self.net.setInput(blob)
+        # detections : (1, 1, N, 7) -> [imageId, classId, score, xmin, ymin, xmax, ymax]
+        detections = self.net.forward().reshape(-1, 7)
+
+        batchSize = len(images)
+        imageIds = detections[:, 0].astype(np.int64)
+        maxDetections = max([int(np.sum(imageIds == i)) for i in range(batchSize)] + [1])
+
+        output_dict = {'num_detections': np.zeros(batchSize, np.float32),
+                       'detection_boxes': np.zeros((batchSize, maxDetections, 4), np.float32),
+                       'detection_scores': np.zeros((batchSize, maxDetections), np.float32),
+                       'detection_classes': np.zeros((batchSize, maxDetections), np.float32)}
+        for i in range(batchSize):
+            rows = detections[imageIds == i]
+            # tri par score décroissant comme la sortie du graphe TF
+            rows = rows[np.argsort(-rows[:, 2])]
+            n = len(rows)
+            output_dict['num_detections'][i] = n
+            output_dict['detection_boxes'][i, :n] = np.clip(rows[:, [4, 3, 6, 5]], 0, 1)
+            output_dict['detection_scores'][i, :n] = rows[:, 2]
+            # les classId de DetectionOutput commencent à 1 (0 = fond) comme le label map
+            output_dict['detection_classes'][i, :n] = rows[:, 1]
+
+        return output_dict
@@ -0,0 +1,160 @@
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+from libs.fasterObjectDetection.baseDetector import BaseDetector, DETECTION_DTYPE
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionLog:
+    """
+        Journal compact des détections par image, indexé par (caméra, timestamp).
+
+        Sur disque c'est un .npz de tableaux concaténés : une ligne par image
+        (caméra, timestamp, nombre de détections) et une ligne par détection
+        (box float32, score float32, classe int32).
+    """
+
+    def __init__(self):
+        self.frames = dict()
+
+    def add(self, cam, ts, boxes, scores, classes):
+        self.frames[(str(cam), float(ts))] = (np.asarray(boxes, np.float32).reshape(-1, 4),
+                                             np.asarray(scores, np.float32).reshape(-1),
+                                             np.asarray(classes, np.int32).reshape(-1))
+
+    def get(self, cam, ts):
+        return self.frames.get((str(cam), float(ts)))
+
+    def timestamps(self, cam):
+        """
+        Retourne les timestamps enregistrés d'une caméra, triés.
+        """
+        return sorted(ts for c, ts in self.frames if c == str(cam))
+
+    def cameras(self):
+        return sorted({cam for cam, _ in self.frames})
+
+    def __len__(self):
+        return len(self.frames)
+
+    def save(self, path):
+        keys = sorted(self.frames, key=lambda key: (key[1], key[0]))
+        counts = np.array([len(self.frames[key][1]) for key in keys], np.int32)
+        if len(keys) > 0:
+            boxes = np.concatenate([self.frames[key][0] for key in keys])
+            scores = np.concatenate([self.frames[key][1] for key in keys])
+            classes = np.concatenate([self.frames[key][2] for key in keys])
+        else:
+            boxes, scores, classes = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+        np.savez_compressed(path,
+                            cams=np.array([key[0] for key in keys]),
+                            ts=np.array([key[1] for key in keys], np.float64),
+                            counts=counts, boxes=boxes, scores=scores, classes=classes)
+        logger.info('Detection log saved : {} frames in {}'.format(len(keys), path))
+
+    @classmethod
+    def load(cls, path):
+        log = cls()
+        with np.load(path) as data:
+            offsets = np.concatenate([[0], np.cumsum(data['counts'])])
+            boxes, scores, classes = data['boxes'], data['scores'], data['classes']
+            for i, (cam, ts) in enumerate(zip(data['cams'], data['ts'])):
+                start, end = offsets[i], offsets[i + 1]
+                log.frames[(str(cam), float(ts))] = (boxes[start:end], scores[start:end], classes[start:end])
+        return log
+
+
+class DetectionRecorder:
+    """
+        Enveloppe un détecteur réel et enregistre ses détections dans un
+        DetectionLog sous la clé donnée par setFrameKey. Les box enregistrées
+        doivent être relatives à l'image complète : en cas de découpe, les
+        détections ramenées par ParcelTracker.mapDetections sont passées à record.
+    """
+
+    def __init__(self, detector, log=None):
+        self.detector = detector
+        self.log = log if log is not None else DetectionLog()
+        self.classIds = {name: int(classId) for classId, name in detector.category_index.items()}
+        self.frameKey = (None, None)
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def setFrameKey(self, cam, ts):
+        self.frameKey = (cam, ts)
+        self.detector.setFrameKey(cam, ts)
+
+    def record(self, frameKey, objects):
+        cam, ts = frameKey
+        if ts is None:
+            logger.warning('Detection not recorded, frame without timestamp (cam {})'.format(cam))
+            return
+        self.log.add(cam, ts,
+                     [obj[2] for obj in objects],
+                     [obj[1] for obj in objects],
+                     [self.classIds.get(obj[0], 0) for obj in objects])
+
+    def run_inference_for_frame(self, image):
+        numObj, objects = self.detector.run_inference_for_frame(image)
+        self.record(self.frameKey, objects)
+        return numObj, objects
+
+    def run_inference_for_frames(self, images, frameKeys):
+        results = self.detector.run_inference_for_frames(images, frameKeys)
+        for frameKey, (numObj, objects) in zip(frameKeys, results):
+            self.record(frameKey, objects)
+        return results
+
+    def save(self, path):
+        self.log.save(path)
+
+
+class RecordedDetector(BaseDetector):
+    """
+        Classe RecordedDetector, backend rejouant un DetectionLog.
+
+        Les détections sont servies pour la clé (caméra, timestamp) donnée par
+        setFrameKey. Sans timestamp, les images d'une caméra sont servies dans
+        l'ordre chronologique du journal. Le seuil de score ne peut qu'être
+        plus strict que celui de l'enregistrement.
+    """
+
+    backendName = 'recorded'
+    supportsBatch = False
+
+    def __init__(self, PATH_TO_LOG, PATH_TO_LABELS, min_score_threshold=0.5):
+
+        BaseDetector.__init__(self, PATH_TO_LABELS, min_score_threshold)
+        self.log = DetectionLog.load(PATH_TO_LOG) if not isinstance(PATH_TO_LOG, DetectionLog) else PATH_TO_LOG
+        self.sequences = {cam: self.log.timestamps(cam) for cam in self.log.cameras()}
+        self.nextIndex = defaultdict(int)
+        self.missingFrames = 0
+        logger.info('RecordedDetector ready : {} frames, cameras {}'.format(len(self.log), self.log.cameras()))
+
+    def _lookup(self, cam, ts):
+        if ts is None:
+            sequence = self.sequences.get(str(cam), [])
+            if self.nextIndex[str(cam)] >= len(sequence):
+                return None
+            ts = sequence[self.nextIndex[str(cam)]]
+            self.nextIndex[str(cam)] += 1
+        return self.log.get(cam, ts)
+
+    def run_inference_for_frame_array(self, image):
+        cam, ts = self.frameKey
+        record = self._lookup(cam, ts)
+        if record is None:
+            self.missingFrames += 1
+            return np.empty(0, DETECTION_DTYPE)
+
+        boxes, scores, classes = record
+        keep = scores > self.min_score_threshold
+        detections = np.empty(int(keep.sum()), DETECTION_DTYPE)
+        detections['box'] = boxes[keep]
+        detections['score'] = scores[keep]
+        detections['classId'] = classes[keep]
+        return detections
@@ -0,0 +1,132 @@
+import logging
+import os
+import resource
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_registry = dict()
+_registryLock = threading.Lock()
+
+
+def _residentMemoryMB():
+    """
+    Retourne la mémoire résidente du process en Mo (Linux), ou le pic de
+    mémoire résidente à défaut.
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _RegistryEntry:
+
+    def __init__(self, detector, loadTime, memoryMB):
+        self.detector = detector
+        self.loadTime = loadTime
+        self.memoryMB = memoryMB
+        self.lock = threading.RLock()
+        self.users = 0
+
+
+class SharedDetector:
+    """
+        Accès d'un ParcelTracker à un détecteur partagé du registre.
+
+        Chaque ParcelTracker garde sa propre clé d'image (setFrameKey) ; les
+        appels au détecteur sont sérialisés par le verrou de l'entrée pour
+        que plusieurs trackers puissent utiliser la même session en sécurité.
+    """
+
+    def __init__(self, entry):
+        self._entry = entry
+        self.frameKey = (None, None)
+
+    def __getattr__(self, name):
+        return getattr(self._entry.detector, name)
+
+    def setFrameKey(self, cam, ts):
+        self.frameKey = (cam, ts)
+
+    def run_inference_for_frame(self, image):
+        with self._entry.lock:
+            self._entry.detector.setFrameKey(*self.frameKey)
+            return self._entry.detector.run_inference_for_frame(image)
+
+    def run_inference_for_frame_array(self, image):
+        with self._entry.lock:
+            self._entry.detector.setFrameKey(*self.frameKey)
+            return self._entry.detector.run_inference_for_frame_array(image)
+
+    def run_inference_for_frames(self, images, frameKeys=None):
+        with self._entry.lock:
+            return self._entry.detector.run_inference_for_frames(images, frameKeys)
+
+    def run_inference_for_frames_array(self, images, frameKeys=None):
+        with self._entry.lock:
+            return self._entry.detector.run_inference_for_frames_array(images, frameKeys)
+
+
+def getSharedDetector(key, createFunction):
+    """
+    Retourne le détecteur du process associé à la clé, en le créant au premier
+    appel. Les appels suivants avec la même clé (même modèle, même seuil...)
+    réutilisent le détecteur déjà chargé et préchauffé.
+
+    Args:
+        key: tuple hashable décrivant tous les paramètres du détecteur.
+        createFunction: fonction sans argument créant le détecteur.
+
+    Returns:
+        Un SharedDetector propre à l'appelant.
+    """
+    with _registryLock:
+        entry = _registry.get(key)
+        if entry is None:
+            memoryBefore = _residentMemoryMB()
+            t0 = time.perf_counter()
+            detector = createFunction()
+            entry = _RegistryEntry(detector, time.perf_counter() - t0, _residentMemoryMB() - memoryBefore)
+            _registry[key] = entry
+            logger.info('Detector loaded in {:.1f} s, {:.0f} MB : {}'.format(entry.loadTime, entry.memoryMB, key))
+        else:
+            logger.info('Detector shared, saved {:.1f} s of loading and ~{:.0f} MB : {}'.format(
+                entry.loadTime, entry.memoryMB, key))
+        entry.users += 1
+    return SharedDetector(entry)
+
+
+def loadedDetector(detector):
+    """
+    Retourne le détecteur chargé derrière un SharedDetector, ou le détecteur
+    lui-même, pour regrouper dans un même appel batch les images des trackers
+    qui le partagent.
+
+    Args:
+        detector: le parcelDetector d'un ParcelTracker.
+
+    Returns:
+        Le détecteur réellement utilisé pour l'inférence.
+    """
+    if isinstance(detector, SharedDetector):
+        return detector._entry.detector
+    return detector
+
+
+def registryReport():
+    """
+    Résume les économies du partage des détecteurs du process.
+
+    Returns:
+        Un dictionnaire : nombre de détecteurs chargés, d'utilisateurs, temps de
+        chargement et mémoire économisés.
+    """
+    with _registryLock:
+        entries = list(_registry.values())
+    return {'detectors': len(entries),
+            'users': sum(entry.users for entry in entries),
+            'savedLoadTime': sum(entry.loadTime * (entry.users - 1) for entry in entries),
+            'savedMemoryMB': sum(entry.memoryMB * (entry.users - 1) for entry in entries)}
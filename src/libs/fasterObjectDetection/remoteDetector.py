@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import Client
+
+import numpy as np
+
+from libs.fasterObjectDetection.baseDetector import BaseDetector
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteDetector(BaseDetector):
+    """
+        Backend 'remote' : les images sont envoyées au serveur d'inférence
+        local (communication_server.InferenceServer) par une socket Unix,
+        authentifiés par la clé partagée avec le serveur. Le
+        modèle n'est chargé qu'une fois sur la machine, dans le serveur.
+    """
+
+    backendName = 'remote'
+
+    def __init__(self, PATH_TO_SOCKET, PATH_TO_LABELS, min_score_threshold=0.5,
+                 clientName=None, authkey='', connectTimeout=30):
+        """
+        Args:
+            PATH_TO_SOCKET: chemin de la socket Unix du serveur d'inférence.
+            PATH_TO_LABELS: chemin du label map json.
+            min_score_threshold: seuil de score, appliqué en plus de celui du serveur.
+            clientName: nom du client dans les statistiques du serveur.
+            authkey: clé partagée avec le serveur (authkey de inferenceServer.ini).
+            connectTimeout: attente maximale en secondes du démarrage du serveur.
+
+        Raises:
+            ValueError: si la clé est vide.
+        """
+        if not authkey:
+            raise ValueError('The remote backend requires a non empty inferenceAuthkey')
+        BaseDetector.__init__(self, PATH_TO_LABELS, min_score_threshold)
+        self.authkey = authkey.encode()
+        self.address = str(PATH_TO_SOCKET)
+        self.clientName = clientName if clientName is not None else 'pid{}'.format(os.getpid())
+        self.lock = threading.Lock()
+        self.conn = self._connect(connectTimeout)
+
+    def _connect(self, connectTimeout):
+        deadline = time.monotonic() + connectTimeout
+        while True:
+            try:
+                conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        conn.send(('hello', self.clientName))
+        logger.info('Connected to inference server {} as {}'.format(self.address, self.clientName))
+        return conn
+
+    def _submit(self, image):
+        image = np.ascontiguousarray(image)
+        cam, ts = self.frameKey
+        self.conn.send(('detect', cam, ts, image.shape, image.dtype.str))
+        self.conn.send_bytes(image.data.cast('B'))
+
+    def _receive(self):
+        kind, payload = self.conn.recv()
+        if kind == 'error':
+            raise RuntimeError('Inference server error : {}'.format(payload))
+        return payload[payload['score'] > self.min_score_threshold]
+
+    def run_inference_for_frame_array(self, image):
+        with self.lock:
+            self._submit(image)
+            return self._receive()
+
+    def run_inference_for_frames_array(self, images, frameKeys=None):
+        # toutes les images sont envoyées avant de lire les réponses pour
+        # qu'elles partent dans le même micro-batch côté serveur
+        with self.lock:
+            for i, image in enumerate(images):
+                if frameKeys is not None:
+                    self.setFrameKey(*frameKeys[i])
+                self._submit(image)
+            return [self._receive() for _ in images]
+
+    def serverStats(self):
+        """
+        Demande les statistiques du serveur d'inférence.
+
+        Returns:
+            Le dictionnaire de InferenceServer.stats.
+        """
+        with self.lock:
+            self.conn.send(('stats',))
+            return self.conn.recv()[1]
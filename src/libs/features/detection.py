@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
@@ -13,12 +14,98 @@ def filterPredictions(numObj, objects, trackerSpace):
     return len(filteredObjects), filteredObjects
 
 
+def cropImageToRoi(image, roi):
+    """
+    Découpe une image sur une zone relative, alignée sur les pixels.
+
+    Args:
+        image: l'image complète.
+        roi: la zone relative (ymin, xmin, ymax, xmax).
+
+    Returns:
+        La vue découpée et la zone relative exacte correspondant aux pixels gardés.
+    """
+    height, width = image.shape[:2]
+    y0, x0 = int(roi[0] * height), int(roi[1] * width)
+    y1, x1 = int(math.ceil(roi[2] * height)), int(math.ceil(roi[3] * width))
+    return image[y0:y1, x0:x1], (y0 / height, x0 / width, y1 / height, x1 / width)
+
+
+def fitImageSize(width, height, maxSize):
+    """
+    Calcule la taille d'une image redimensionnée pour tenir dans maxSize
+    en gardant ses proportions.
+
+    Args:
+        width: la largeur de l'image.
+        height: la hauteur de l'image.
+        maxSize: la taille maximale (largeur, hauteur).
+
+    Returns:
+        La taille (largeur, hauteur) entière de l'image redimensionnée.
+    """
+    scale = min(maxSize[0] / width, maxSize[1] / height)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def mapObjectsFromRoi(objects, roi):
+    """
+    Ramène les box des détections d'une image découpée en coordonnées
+    relatives à l'image complète.
+
+    Args:
+        objects: la liste des objets détectés [class, score, box] sur la découpe.
+        roi: la zone relative (ymin, xmin, ymax, xmax) de la découpe.
+
+    Returns:
+        La liste des objets avec des box relatives à l'image complète.
+    """
+    ymin, xmin, ymax, xmax = roi
+    height, width = ymax - ymin, xmax - xmin
+    return [[obj[0], obj[1], (ymin + obj[2][0] * height, xmin + obj[2][1] * width,
+                              ymin + obj[2][2] * height, xmin + obj[2][3] * width)]
+            for obj in objects]
+
+
+def undistortObjects(objects, trackerSpace):
+    """
+    Corrige la distortion des box des détections faites sur l'image brute
+    (undistortionMode = boxes).
+
+    Args:
+        objects: la liste des objets détectés [class, score, box].
+        trackerSpace: le TrackerSpace portant la calibration de la caméra.
+
+    Returns:
+        La liste des objets avec des box relatives à l'image corrigée.
+    """
+    if len(objects) == 0:
+        return objects
+    boxes = trackerSpace.undistortBoxes([obj[2] for obj in objects])
+    return [[obj[0], obj[1], tuple(box)] for obj, box in zip(objects, boxes.tolist())]
+
+
 def detectAndFilterParcels(parcelDetector, image, trackerSpace):
     """
     """
 
     numObj, objects = parcelDetector.run_inference_for_frame(image)
-    
+    return filterAndSortParcels(numObj, objects, trackerSpace)
+
+
+def filterAndSortParcels(numObj, objects, trackerSpace):
+    """
+    Filtre et trie des détections déjà calculées (par exemple par un appel
+    batch au détecteur) pour les préparer au tracking.
+
+    Args:
+        numObj: le nombre d'objets détectés.
+        objects: la liste des objets détectés [class, score, box].
+        trackerSpace: l'espace de tracking du tracker.
+
+    Returns:
+        Le nombre et la liste des objets sur le convoyeur, triés par xmax.
+    """
     ### trace logger
     if len(objects) !=0:
        for i in range(len(objects)):
@@ -32,4 +119,4 @@ def detectAndFilterParcels(parcelDetector, image, trackerSpace):
     print("----------- nombre d'element detecté sur le convoyeur : {} ---".format(numFilteredObj))
     # trie les colis par le front avant x_max
     filteredObjects.sort(key=lambda x: x[2][3], reverse=False) #Fait tenir debout tout le tracking. 
-    return numFilteredObj, filteredObjects
\ No newline at end of file
+    return numFilteredObj, filteredObjects
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+    Filtre de Kalman à vitesse constante de tous les Parcels suivis, calculé
+    pour l'ensemble des Parcels en quelques produits matriciels numpy.
+
+    Même modèle que KalmanFilterPredictor : état (ymin, xmin, ymax, xmax, vy,
+    vxmin, vxmax), mesure des 4 coordonnées de la relativeBox, bruit de
+    processus identité et bruit de mesure nul (valeurs du filtre OpenCV).
+
+    Les matrices du modèle étant fixes, le gain converge vers une valeur
+    stationnaire, solution de l'équation de Riccati discrète : en mode steady
+    les Parcels suivis depuis warmupFrames corrections sont corrigés avec ce
+    gain fixe, sans calcul de covariance.
+"""
+import numpy as np
+from scipy.linalg import solve_discrete_are
+
+KALMAN_MODES = ['opencv', 'batch', 'steady']
+
+STATE_SIZE = 7
+MEASUREMENT_SIZE = 4
+# écart relatif maximal de l'intervalle des images à 1/fps pour utiliser le gain stationnaire
+STEADY_DT_TOLERANCE = 0.25
+
+
+def transitionMatrix(dt):
+    """
+    Construit la matrice de transition du modèle à vitesse constante.
+
+    Args:
+        dt: temps entre 2 acquisitions, en secondes.
+
+    Returns:
+        La matrice (7, 7).
+    """
+    return np.array(
+        [[1, 0, 0, 0, dt, 0, 0], [0, 1, 0, 0, 0, dt, 0], [0, 0, 1, 0, dt, 0, 0],
+         [0, 0, 0, 1, 0, 0, dt], [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0],
+         [0, 0, 0, 0, 0, 0, 1]], np.float64)
+
+
+def steadyStateGain(transition, processNoiseCov, measurementNoiseCov):
+    """
+    Calcule la covariance prédite et le gain stationnaires du filtre, la
+    mesure étant les 4 premières composantes de l'état.
+
+    Args:
+        transition: matrice de transition (7, 7).
+        processNoiseCov: covariance du bruit de processus (7, 7).
+        measurementNoiseCov: covariance du bruit de mesure (4, 4).
+
+    Returns:
+        La covariance prédite (7, 7) solution de l'équation de Riccati
+        discrète et le gain (7, 4) correspondant.
+    """
+    measurement = np.eye(MEASUREMENT_SIZE, STATE_SIZE)
+    covariance = solve_discrete_are(transition.T, measurement.T, processNoiseCov, measurementNoiseCov)
+    innovationCov = covariance[:MEASUREMENT_SIZE, :MEASUREMENT_SIZE] + measurementNoiseCov
+    return covariance, covariance[:, :MEASUREMENT_SIZE] @ np.linalg.inv(innovationCov)
+
+
+class BatchKalmanPredictor(object):
+    """
+    Classe BatchKalmanPredictor permet de prédire la position de tous les
+    Parcels suivis, avec la même interface que KalmanFilterPredictor.
+
+    Les états et covariances des Parcels sont rangés dans des tableaux
+    contigus (N, 7) et (N, 7, 7), une ligne par Parcel dans l'ordre de la
+    dernière liste traitée. Contrairement au KalmanFilterPredictor, qui
+    partage un seul filtre OpenCV entre tous les Parcels, la covariance de
+    chaque Parcel est conservée d'une image à l'autre ; celle d'un nouveau
+    Parcel part de zéro comme un filtre OpenCV neuf, ou du bruit de
+    processus s'il arrive déjà prédit (Parcel entrant).
+
+    Avec warmupFrames, un Parcel corrigé au moins warmupFrames fois utilise
+    le gain stationnaire : sa correction et sa prédiction se réduisent à des
+    produits de l'état par des matrices fixes et sa covariance n'est plus
+    calculée. Le gain stationnaire suppose une correction à chaque image :
+    après une prédiction recalée sur un intervalle irrégulier (retime), la
+    correction repasse par le calcul complet.
+    """
+
+    def __init__(self, fps, warmupFrames=None):
+        """
+        Construit un objet BatchKalmanPredictor.
+
+        Args:
+            fps: la fréquence d'acquisition des images.
+            warmupFrames: nombre de corrections d'un Parcel avec calcul complet
+                de la covariance avant le passage au gain stationnaire, None
+                pour toujours calculer la covariance.
+
+        Attributes:
+            fps: la fréquence d'acquisition des images.
+            transitionMatrix: matrice de transition (7, 7).
+            processNoiseCov: covariance du bruit de processus (7, 7).
+            measurementNoiseCov: covariance du bruit de mesure (4, 4).
+            states: états prédits (N, 7) des Parcels de la dernière mise à jour.
+            covariances: covariances (N, 7, 7) des états prédits.
+            corrections: nombre de corrections (N,) de chaque Parcel.
+            rows: ligne de chaque Parcel dans states et covariances.
+            predictionDt: intervalle en secondes des prédictions courantes.
+            steadyCovariance, steadyGain: covariance prédite et gain
+                stationnaires, si warmupFrames est donné.
+        """
+        self.fps = fps
+        self.warmupFrames = warmupFrames
+
+        self.transitionMatrix = transitionMatrix(1 / self.fps)
+        self.processNoiseCov = np.eye(STATE_SIZE)
+        self.measurementNoiseCov = np.zeros((MEASUREMENT_SIZE, MEASUREMENT_SIZE))
+
+        self.steadyCovariance, self.steadyGain = None, None
+        if self.warmupFrames is not None:
+            self.steadyCovariance, self.steadyGain = steadyStateGain(self.transitionMatrix, self.processNoiseCov,
+                                                                     self.measurementNoiseCov)
+
+        self.states = np.zeros((0, STATE_SIZE))
+        self.covariances = np.zeros((0, STATE_SIZE, STATE_SIZE))
+        self.corrections = np.zeros(0, np.int64)
+        self.rows = dict()
+        self.predictionDt = 1 / self.fps
+
+    def _gatherCovariances(self, parcels):
+        """
+        Range les covariances et nombres de corrections des Parcels dans
+        l'ordre de la liste, une covariance nulle et aucune correction pour
+        les Parcels encore inconnus.
+
+        Returns:
+            Les tableaux des covariances et des nombres de corrections, et le
+            masque des Parcels inconnus.
+        """
+        rows = np.fromiter((self.rows.get(parcel, -1) for parcel in parcels), np.int64, len(parcels))
+        # la ligne -1 désigne la covariance nulle ajoutée en fin de tableau
+        padded = np.concatenate((self.covariances, np.zeros((1, STATE_SIZE, STATE_SIZE))))
+        corrections = np.append(self.corrections, 0)
+        return padded[rows], corrections[rows], rows < 0
+
+    def _gatherStates(self, parcels, fromPrediction):
+        """
+        Construit les états (N, 7) des Parcels, comme setPreviousState du
+        KalmanFilterPredictor.
+
+        Args:
+            parcels: liste des Parcel.
+            fromPrediction: booléen, partir de la position prédite
+                (nextRelativeBox) des Parcels déjà prédits plutôt que de la
+                relativeBox.
+
+        Returns:
+            Le tableau des états et le masque des Parcels partis de leur prédiction.
+        """
+        predicted = np.fromiter((fromPrediction and max(parcel.nextRelativeBox) != 0 for parcel in parcels),
+                                bool, len(parcels))
+        states = np.array([tuple(parcel.nextRelativeBox if isPredicted else parcel.relativeBox)
+                           + (parcel.speed[1], 0 if round(parcel.relativeBox[1], 2) == 0 else parcel.speed[0],
+                              parcel.speed[0])
+                           for parcel, isPredicted in zip(parcels, predicted.tolist())],
+                          np.float64).reshape(-1, STATE_SIZE)
+        return states, predicted
+
+    def correct(self, states, covariances, measurements):
+        """
+        Correction de Kalman de tous les états par leurs mesures.
+
+        Args:
+            states: états prédits (n, 7).
+            covariances: covariances prédites (n, 7, 7).
+            measurements: mesures (n, 4).
+
+        Returns:
+            Les états et covariances corrigés.
+        """
+        innovationCov = covariances[:, :MEASUREMENT_SIZE, :MEASUREMENT_SIZE] + self.measurementNoiseCov
+        # gain (n, 7, 4) : K = P H' S^-1 ; l'inversion batch des matrices 4x4
+        # est plus rapide que np.linalg.solve
+        gains = covariances[:, :, :MEASUREMENT_SIZE] @ np.linalg.inv(innovationCov)
+        innovations = measurements - states[:, :MEASUREMENT_SIZE]
+        states = states + np.einsum('nij,nj->ni', gains, innovations)
+        covariances = covariances - gains @ covariances[:, :MEASUREMENT_SIZE, :]
+        return states, covariances
+
+    def correctSteady(self, states, measurements):
+        """
+        Correction des états par le gain stationnaire.
+
+        Args:
+            states: états prédits (n, 7).
+            measurements: mesures (n, 4).
+
+        Returns:
+            Les états corrigés.
+        """
+        return states + (measurements - states[:, :MEASUREMENT_SIZE]) @ self.steadyGain.T
+
+    def predict(self, states, covariances):
+        """
+        Prédiction de Kalman de tous les états.
+
+        Returns:
+            Les états et covariances prédits.
+        """
+        states = states @ self.transitionMatrix.T
+        covariances = self.transitionMatrix @ covariances @ self.transitionMatrix.T + self.processNoiseCov
+        return states, covariances
+
+    def _steadyRows(self, corrections):
+        if self.warmupFrames is None:
+            return np.zeros(len(corrections), bool)
+        return corrections >= self.warmupFrames
+
+    def retime(self, parcels, dt):
+        """
+        Recale les prédictions, faites pour une image à 1/fps, sur l'intervalle
+        réel dt jusqu'à l'image courante (images perdues ou retardées). Le
+        modèle étant à vitesse constante, F(dt) = F(dt - 1/fps) F(1/fps) : les
+        états et covariances prédits sont avancés de dt - 1/fps.
+
+        Args:
+            parcels: liste des Parcel prédits.
+            dt: intervalle réel en secondes depuis l'image précédente.
+        """
+        delta = dt - self.predictionDt
+        if delta == 0 or len(self.rows) == 0:
+            return
+        step = transitionMatrix(delta)
+        self.states = self.states @ step.T
+        self.covariances = step @ (self.covariances - self.processNoiseCov) @ step.T + self.processNoiseCov
+        self.predictionDt = dt
+
+        # déplacement de la position prédite des Parcels, (vy, vxmin, vy, vxmax) * delta
+        shifts = delta * self.states[:, [4, 5, 4, 6]]
+        for parcel in parcels:
+            row = self.rows.get(parcel)
+            if row is None or max(parcel.nextRelativeBox) == 0:
+                continue
+            ymin, xmin, ymax, xmax = (a + b for a, b in zip(parcel.nextRelativeBox, shifts[row].tolist()))
+            parcel.nextRelativeBox = (ymin, xmin, ymax, xmax)
+            parcel.nextCenter = ((xmin + xmax) / 2, (ymin + ymax) / 2)
+
+    def _predictRows(self, states, covariances, steady):
+        """
+        Prédit tous les états, la covariance des seuls Parcels hors du régime
+        stationnaire.
+        """
+        if not np.any(steady):
+            return self.predict(states, covariances)
+        transient = ~steady
+        states = states @ self.transitionMatrix.T
+        if np.any(transient):
+            covariances[transient] = (self.transitionMatrix @ covariances[transient] @ self.transitionMatrix.T
+                                      + self.processNoiseCov)
+        covariances[steady] = self.steadyCovariance
+        return states, covariances
+
+    def _store(self, parcels, states, covariances, corrections):
+        self.states = states
+        self.covariances = covariances
+        self.corrections = corrections
+        self.rows = {parcel: i for i, parcel in enumerate(parcels)}
+        self.predictionDt = 1 / self.fps
+
+    def updateStates(self, parcels):
+        """
+        Corrige les Parcels déjà prédits par leur relativeBox puis prédit la
+        position suivante de tous les Parcels.
+
+        Args:
+            parcels: liste des Parcel à prédire.
+        """
+        covariances, corrections, unknown = self._gatherCovariances(parcels)
+        states, predicted = self._gatherStates(parcels, True)
+        # Parcel déjà prédit hors du filtre (Parcel entrant) : covariance d'une
+        # prédiction depuis un état connu
+        covariances[predicted & unknown] = self.processNoiseCov
+        steady = predicted & self._steadyRows(corrections)
+        if abs(self.predictionDt * self.fps - 1) > STEADY_DT_TOLERANCE:
+            steady[:] = False
+        if np.any(predicted):
+            measurements = np.array([tuple(parcel.relativeBox) for parcel in parcels],
+                                    np.float64).reshape(-1, MEASUREMENT_SIZE)
+            transient = predicted & ~steady
+            if np.any(transient):
+                states[transient], covariances[transient] = self.correct(
+                    states[transient], covariances[transient], measurements[transient])
+            if np.any(steady):
+                states[steady] = self.correctSteady(states[steady], measurements[steady])
+            corrections[predicted] += 1
+        states, covariances = self._predictRows(states, covariances, self._steadyRows(corrections))
+        self._store(parcels, states, covariances, corrections)
+
+        for parcel, (ymin, xmin, ymax, xmax, vy, _, vxmax) in zip(parcels, states.tolist()):
+            parcel.nextRelativeBox = (ymin, xmin, ymax, xmax)
+            parcel.speed = (vxmax, vy)
+            parcel.nextCenter = ((xmin + xmax) / 2, (ymin + ymax) / 2)
+
+    def predictStates(self, parcels):
+        """
+        Prédit la position suivante des Parcels sans correction, pour les images
+        où aucune détection n'est réalisée. L'état part de la position courante
+        (relativeBox) et de la vitesse du Parcel.
+
+        Args:
+            parcels: liste des Parcel à prédire.
+        """
+        covariances, corrections, _ = self._gatherCovariances(parcels)
+        states, _ = self._gatherStates(parcels, False)
+        states, covariances = self._predictRows(states, covariances, self._steadyRows(corrections))
+        self._store(parcels, states, covariances, corrections)
+
+        for parcel, (ymin, xmin, ymax, xmax, _, _, _) in zip(parcels, states.tolist()):
+            parcel.nextRelativeBox = (ymin, xmin, ymax, xmax)
+            parcel.nextCenter = ((xmin + xmax) / 2, (ymin + ymax) / 2)
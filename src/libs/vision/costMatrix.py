@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+    Matrices de coût de l'association Parcels / détections, calculées en une
+    seule opération numpy pour toutes les paires.
+
+    Les box sont des tableaux (N, 4) de coordonnées relatives
+    (ymin, xmin, ymax, xmax), les centres des tableaux (N, 2) (x, y).
+"""
+import numpy as np
+
+
+def boxesToArray(boxes):
+    """
+    Convertit une liste de box en tableau (N, 4).
+
+    Args:
+        boxes: liste de box (ymin, xmin, ymax, xmax), éventuellement vide.
+
+    Returns:
+        Le tableau float64 (N, 4).
+    """
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def centersFromBoxes(boxes):
+    """
+    Calcule les centres d'un tableau de box.
+
+    Args:
+        boxes: tableau (N, 4).
+
+    Returns:
+        Le tableau (N, 2) des centres (x, y).
+    """
+    return np.stack(((boxes[:, 1] + boxes[:, 3]) / 2, (boxes[:, 0] + boxes[:, 2]) / 2), axis=1)
+
+
+def iouMatrix(boxesA, boxesB):
+    """
+    Calcule l'IOU de toutes les paires de box.
+
+    Args:
+        boxesA: tableau (N, 4).
+        boxesB: tableau (M, 4).
+
+    Returns:
+        La matrice (N, M) des IOU. Une paire d'union nulle (box dégénérées)
+        a une IOU de 0.
+    """
+    yMin = np.maximum(boxesA[:, np.newaxis, 0], boxesB[np.newaxis, :, 0])
+    xMin = np.maximum(boxesA[:, np.newaxis, 1], boxesB[np.newaxis, :, 1])
+    yMax = np.minimum(boxesA[:, np.newaxis, 2], boxesB[np.newaxis, :, 2])
+    xMax = np.minimum(boxesA[:, np.newaxis, 3], boxesB[np.newaxis, :, 3])
+    inter = np.clip(xMax - xMin, 0, None) * np.clip(yMax - yMin, 0, None)
+
+    areaA = (boxesA[:, 3] - boxesA[:, 1]) * (boxesA[:, 2] - boxesA[:, 0])
+    areaB = (boxesB[:, 3] - boxesB[:, 1]) * (boxesB[:, 2] - boxesB[:, 0])
+    union = areaA[:, np.newaxis] + areaB[np.newaxis, :] - inter
+
+    iou = np.zeros_like(inter)
+    np.divide(inter, union, out=iou, where=union > 0)
+    return iou
+
+
+def iouScoreMatrix(boxesA, boxesB):
+    """
+    Calcule la matrice des scores basés sur l'IOU, score = 1 - IOU
+    (computeIOUforRelativeBoxes pour toutes les paires).
+
+    Args:
+        boxesA: tableau (N, 4).
+        boxesB: tableau (M, 4).
+
+    Returns:
+        La matrice (N, M) des scores.
+    """
+    return 1 - iouMatrix(boxesA, boxesB)
+
+
+def pairIouScores(boxesA, boxesB, rows, cols):
+    """
+    Calcule le score 1 - IOU des seules paires (boxesA[rows], boxesB[cols]).
+
+    Args:
+        boxesA: tableau (N, 4).
+        boxesB: tableau (M, 4).
+        rows: indices des box de boxesA.
+        cols: indices des box de boxesB.
+
+    Returns:
+        Le tableau des scores, un par paire.
+    """
+    a = boxesA[rows]
+    b = boxesB[cols]
+    inter = (np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+             * np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None))
+    union = (a[:, 3] - a[:, 1]) * (a[:, 2] - a[:, 0]) + (b[:, 3] - b[:, 1]) * (b[:, 2] - b[:, 0]) - inter
+    iou = np.zeros_like(inter)
+    np.divide(inter, union, out=iou, where=union > 0)
+    return 1 - iou
+
+
+def centerDistanceMatrix(centersA, centersB):
+    """
+    Calcule la distance euclidienne de toutes les paires de centres.
+
+    Args:
+        centersA: tableau (N, 2).
+        centersB: tableau (M, 2).
+
+    Returns:
+        La matrice (N, M) des distances.
+    """
+    delta = centersA[:, np.newaxis, :] - centersB[np.newaxis, :, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', delta, delta))
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
-from libs.vision.parcelAssociator import ParcelAssociator
+from libs.vision.parcelAssociator import (ParcelAssociator, computeCenterFromRelativeBox,
+                                          computeEuclideanDistForCenters)
 from libs.vision.kalmanPredictor import KalmanFilterPredictor
+from libs.vision.batchKalmanPredictor import BatchKalmanPredictor, KALMAN_MODES
 
 
 class DetectionTracker:
@@ -13,32 +15,112 @@ class DetectionTracker:
         objet réinsérer au milieu du convoyeur. Il permettrai également de gérer les fausses détections.
     """
 
-    def __init__(self, fps, traceInfo=False):
+    def __init__(self, fps, traceInfo=False, associationStrategy='hungarian', cascadeMaxCenterDistance=0.05,
+                 kalmanMode='opencv', kalmanWarmupFrames=20, variableDt=False):
         """
         Crée un objet DetectionTracker.
 
         Args:
             fps: vitesse d'acquisition du banc.
             traceInfo: booléen pour le traçage d'infos de debug.
+            associationStrategy: algorithme d'association du ParcelAssociator.
+            cascadeMaxCenterDistance: distance maximale des centres de la stratégie cascade.
+            kalmanMode: filtre de Kalman des Parcels (KALMAN_MODES) : opencv, un
+                filtre OpenCV partagé par tous les Parcels, batch, un filtre
+                par Parcel calculé pour tous les Parcels à la fois, ou steady,
+                batch avec gain stationnaire après kalmanWarmupFrames corrections.
+            kalmanWarmupFrames: nombre de corrections d'un Parcel avant le gain stationnaire.
+            variableDt: booléen, recaler les prédictions sur l'intervalle réel
+                entre deux images plutôt que 1/fps.
 
         Attributes:        
             PA: le ParcelAssociator du tracker.
             KF: le KalmanFilterPredictor du tracker.
             traceInfo: booléen pour le traçage d'infos de debug.
             fps: vitesse d'acquisition du banc.
+            frameDt: intervalle en secondes entre l'image précédente et l'image courante.
+            predictionErrors: par intervalle en nombre d'images,
+                [nombre, somme, maximum] des erreurs de prédiction.
         """
 
         self.fps = fps
         self.traceInfo = traceInfo
+        self.variableDt = variableDt
+        self.frameDt = 1 / self.fps
+        self.predictionErrors = dict()
 
-        self.PA = ParcelAssociator()
-        self.KF = KalmanFilterPredictor(self.fps)
+        self.PA = ParcelAssociator(associationStrategy, cascadeMaxCenterDistance)
+        if kalmanMode not in KALMAN_MODES:
+            raise ValueError('Unknown Kalman mode {}, expected one of {}'.format(kalmanMode, KALMAN_MODES))
+        if kalmanMode == 'batch':
+            self.KF = BatchKalmanPredictor(self.fps)
+        elif kalmanMode == 'steady':
+            self.KF = BatchKalmanPredictor(self.fps, kalmanWarmupFrames)
+        else:
+            self.KF = KalmanFilterPredictor(self.fps)
+
+    def advanceToFrame(self, trackedParcels, dt):
+        """
+        Prend en compte l'intervalle réel depuis l'image précédente : les
+        prédictions faites pour 1/fps sont recalées sur dt si variableDt.
+
+        Args:
+            trackedParcels: la liste des Parcel suivis.
+            dt: intervalle en secondes depuis l'image précédente, None s'il est
+                inconnu (1/fps est alors utilisé).
+        """
+        self.frameDt = 1 / self.fps if dt is None else dt
+        if self.variableDt and dt is not None:
+            self.KF.retime(trackedParcels, dt)
 
     def estimatePosition(self, trackedParcels, numObj, objects):
+        # centre de la box prédite (nextCenter n'est pas mis à jour à la création d'un Parcel)
+        predictedCenters = [(parcel, computeCenterFromRelativeBox(parcel.nextRelativeBox)) for parcel in trackedParcels
+                            if max(parcel.nextRelativeBox) != 0]
+
         # Réalise l'association optimale par IOU entre parcels et détection.
         unassociateDetections = self.PA.associateWithIOU(trackedParcels, numObj, objects)
 
+        # Erreur de prédiction des Parcels associés, par intervalle entre les images.
+        frames = max(1, int(round(self.frameDt * self.fps)))
+        for parcel, center in predictedCenters:
+            if parcel.numberOfTimesUndetected == 0:
+                error = computeEuclideanDistForCenters(center, parcel.center)
+                errors = self.predictionErrors.setdefault(frames, [0, 0.0, 0.0])
+                errors[0] += 1
+                errors[1] += error
+                errors[2] = max(errors[2], error)
+
         # Prédit l'état futur de tous les parcels suivis.
         self.KF.updateStates(trackedParcels)
 
         return unassociateDetections
+
+    def propagatePosition(self, trackedParcels):
+        """
+        Fait avancer les Parcels suivis sur leur prédiction, sans détection
+        (images sautées par la cadence de détection).
+
+        Args:
+            trackedParcels: la liste des Parcel suivis.
+        """
+        for parcel in trackedParcels:
+            if max(parcel.nextRelativeBox) != 0:
+                parcel.relativeBox = parcel.nextRelativeBox + tuple()
+                parcel.center = computeCenterFromRelativeBox(parcel.relativeBox)
+                parcel.isInterpolated = True
+
+        # Prédit l'état futur de tous les parcels suivis.
+        self.KF.predictStates(trackedParcels)
+
+    def predictionStats(self):
+        """
+        Retourne l'erreur de prédiction des Parcels associés, distance relative
+        entre le centre prédit et le centre détecté.
+
+        Returns:
+            Un dictionnaire par intervalle entre les images, en nombre d'images
+            à 1/fps : nombre de Parcels, erreurs moyenne et maximale.
+        """
+        return {frames: {'count': count, 'meanError': total / count, 'maxError': largest}
+                for frames, (count, total, largest) in sorted(self.predictionErrors.items())}
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+    Association Parcels / détections restreinte aux paires possibles.
+
+    Une paire n'est gardée par ParcelAssociator que si son IOU dépasse
+    1 - confidenceThreshold : les box doivent donc se recouvrir le long du
+    convoyeur (axe x). Les paires candidates sont trouvées par balayage des
+    détections triées par xmax, le problème est découpé en composantes
+    connexes indépendantes (union-find) et chaque composante est résolue
+    séparément par l'algorithme hongrois. Le coût suit le nombre de paires
+    candidates et non plus le produit Parcels x détections.
+"""
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from libs.vision.costMatrix import pairIouScores
+
+
+def sweepCandidatePairs(boxesA, boxesB):
+    """
+    Trouve les paires de box qui se recouvrent le long de l'axe x.
+
+    Args:
+        boxesA: tableau (N, 4) des box des Parcels.
+        boxesB: tableau (M, 4) des box des détections, de préférence triées par
+            xmax (detectAndFilterParcels) ; triées ici sinon.
+
+    Returns:
+        Les indices (rows, cols) des paires candidates.
+    """
+    if len(boxesA) == 0 or len(boxesB) == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    order = np.arange(len(boxesB))
+    xMaxB = boxesB[:, 3]
+    if np.any(xMaxB[1:] < xMaxB[:-1]):
+        order = np.argsort(xMaxB, kind='stable')
+        xMaxB = xMaxB[order]
+    xMinB = boxesB[order, 1]
+    # une détection qui recouvre la box du Parcel a xmax dans ]xmin, xmax + largeur maximale[
+    maxWidth = np.max(boxesB[:, 3] - boxesB[:, 1])
+    starts = np.searchsorted(xMaxB, boxesA[:, 1], side='right')
+    ends = np.searchsorted(xMaxB, boxesA[:, 3] + maxWidth, side='left')
+
+    counts = np.maximum(ends - starts, 0)
+    rows = np.repeat(np.arange(len(boxesA)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    sortedCols = np.repeat(starts, counts) + offsets
+    overlap = xMinB[sortedCols] < boxesA[rows, 3]
+    return rows[overlap], order[sortedCols[overlap]]
+
+
+def connectedComponents(rows, cols, numRows):
+    """
+    Regroupe les paires en composantes connexes (union-find), les lignes et
+    colonnes étant des noeuds distincts.
+
+    Returns:
+        La liste des composantes, chacune un tableau d'indices de paires.
+    """
+    parent = list(range(numRows + (int(cols.max()) + 1 if len(cols) > 0 else 0)))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        rootRow, rootCol = find(row), find(numRows + col)
+        if rootRow != rootCol:
+            parent[rootCol] = rootRow
+
+    components = dict()
+    for pair, row in enumerate(rows.tolist()):
+        components.setdefault(find(row), []).append(pair)
+    return [np.array(pairs) for pairs in components.values()]
+
+
+def gatedAssignment(boxesA, boxesB, confidenceThreshold):
+    """
+    Associe les box par composantes connexes des paires candidates.
+
+    Dans une composante, une paire non candidate a le score 1 (pas de
+    recouvrement) : seules les paires de score inférieur à confidenceThreshold
+    sont retournées, comme après le filtrage de l'association dense.
+
+    Args:
+        boxesA: tableau (N, 4) des box des Parcels.
+        boxesB: tableau (M, 4) des box des détections.
+        confidenceThreshold: score (1 - IOU) à partir duquel une paire est refusée.
+
+    Returns:
+        Les listes row_ind et col_ind des paires associées, triées par ligne.
+    """
+    rows, cols = sweepCandidatePairs(boxesA, boxesB)
+    if len(rows) == 0:
+        return [], []
+    scores = pairIouScores(boxesA, boxesB, rows, cols)
+    keep = scores < confidenceThreshold
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+    row_ind = []
+    col_ind = []
+    for pairs in connectedComponents(rows, cols, len(boxesA)):
+        if len(pairs) == 1:
+            row_ind.append(int(rows[pairs[0]]))
+            col_ind.append(int(cols[pairs[0]]))
+            continue
+        componentRows, localRows = np.unique(rows[pairs], return_inverse=True)
+        componentCols, localCols = np.unique(cols[pairs], return_inverse=True)
+        scoreMatrix = np.ones((len(componentRows), len(componentCols)))
+        scoreMatrix[localRows, localCols] = scores[pairs]
+        for i, j in zip(*linear_sum_assignment(scoreMatrix)):
+            if scoreMatrix[i, j] < confidenceThreshold:
+                row_ind.append(int(componentRows[i]))
+                col_ind.append(int(componentCols[j]))
+
+    order = np.argsort(row_ind, kind='stable')
+    return [row_ind[i] for i in order], [col_ind[i] for i in order]
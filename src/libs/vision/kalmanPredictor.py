@@ -111,3 +111,47 @@ class KalmanFilterPredictor(object):
             measurements = self.formatMeasurements(parcel)
             self.setPreviousState(parcel)
             self.update(parcel, measurements)
+
+    def retime(self, parcels, dt):
+        """
+        Recale la prédiction des Parcels, faite pour une image à 1/fps, sur
+        l'intervalle réel dt jusqu'à l'image courante (images perdues ou
+        retardées) : la position prédite avance de (dt - 1/fps) fois la vitesse.
+
+        Args:
+            parcels: liste des Parcel prédits.
+            dt: intervalle réel en secondes depuis l'image précédente.
+        """
+        delta = dt - 1 / self.fps
+        if delta == 0:
+            return
+        for parcel in parcels:
+            if max(parcel.nextRelativeBox) == 0:
+                continue
+            vxmax, vy = parcel.speed
+            vxmin = 0 if round(parcel.relativeBox[1], 2) == 0 else vxmax
+            ymin, xmin, ymax, xmax = parcel.nextRelativeBox
+            parcel.nextRelativeBox = (ymin + delta * vy, xmin + delta * vxmin, ymax + delta * vy, xmax + delta * vxmax)
+            parcel.nextCenter = ((parcel.nextRelativeBox[1] + parcel.nextRelativeBox[3]) / 2,
+                                 (parcel.nextRelativeBox[0] + parcel.nextRelativeBox[2]) / 2)
+
+    def predictStates(self, parcels):
+        """
+        Prédit la position suivante des Parcels sans correction, pour les images
+        où aucune détection n'est réalisée. L'état part de la position prédite
+        courante (nextRelativeBox) et de la vitesse du Parcel.
+
+        Args:
+            parcels: liste des Parcel à prédire.
+        """
+        for parcel in parcels:
+            vxmax, vy = parcel.speed
+            vxmin = 0 if round(parcel.relativeBox[1], 2) == 0 else vxmax
+            ymin, xmin, ymax, xmax = parcel.relativeBox
+            self.kalmanFilter.statePost = np.array([[ymin], [xmin], [ymax], [xmax], [vy], [vxmin], [vxmax]], np.float32)
+
+            predicted = self.kalmanFilter.predict()
+            parcel.nextRelativeBox = (float(predicted[0, 0]), float(predicted[1, 0]),
+                                      float(predicted[2, 0]), float(predicted[3, 0]))
+            parcel.nextCenter = ((parcel.nextRelativeBox[1] + parcel.nextRelativeBox[3]) / 2,
+                                 (parcel.nextRelativeBox[0] + parcel.nextRelativeBox[2]) / 2)
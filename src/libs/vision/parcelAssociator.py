@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
+import time
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 from copy import deepcopy
 
+from libs.vision.costMatrix import boxesToArray, centerDistanceMatrix, centersFromBoxes, iouScoreMatrix
+from libs.vision.gatedAssociation import gatedAssignment
+
+ASSOCIATION_STRATEGIES = ['hungarian', 'gated', 'greedy', 'cascade']
+
 
 class ParcelAssociator:
     """
@@ -11,20 +17,41 @@ class ParcelAssociator:
 
     """
 
-    def __init__(self):
+    def __init__(self, strategy='hungarian', cascadeMaxCenterDistance=0.05):
         """
         Crée un objet ParcelAssociator.
+
+        Args:
+            strategy: algorithme d'association par IOU (ASSOCIATION_STRATEGIES) :
+                hungarian : algorithme hongrois sur la matrice complète,
+                gated : algorithme hongrois sur les composantes connexes des
+                paires qui se recouvrent le long du convoyeur,
+                greedy : meilleure IOU mutuelle, algorithme hongrois en cas de conflit,
+                cascade : greedy puis, pour les Parcels et détections restants,
+                association par distance des centres.
+            cascadeMaxCenterDistance: distance relative maximale des centres
+                associés par le second étage de cascade.
         
         Attributes:
             traceInfo: booléen pour tracer les infos de débuggage.
+            timings: par étage d'association, [appels, durée totale, durée maximale].
 
         Todo:
             Réfléchir aux paramètres possibles et les ajouter au fichier de 
             configuration du ParcelTracker qui crée l'instance de ParcelAssociator.
         """
+        if strategy not in ASSOCIATION_STRATEGIES:
+            raise ValueError('Unknown association strategy {}, expected one of {}'.format(
+                strategy, ASSOCIATION_STRATEGIES))
+        self.strategy = strategy
+        self.cascadeMaxCenterDistance = cascadeMaxCenterDistance
         self.traceInfo = False
         self.confidenceThreshold = 0.75
 
+        self.timings = dict()
+        self.greedyFallbacks = 0
+        self.cascadeMatches = 0
+
     def associate(self, row_ind, col_ind, parcels, numObj, objects):
         """
         Associe les objets Parcel aux détections par rapport aux résultats
@@ -44,6 +71,9 @@ class ParcelAssociator:
         if self.traceInfo:
             print(str(row_ind) + '  ' + str(col_ind))
 
+        associatedRows = set(row_ind)
+        associatedCols = set(col_ind)
+
         ### Association : Mise à jour des champs du Parcel par les nouvelles données. 
         for i in range(len(row_ind)):
             parcels[row_ind[i]].relativeBox = objects[col_ind[i]][2] + tuple()
@@ -54,14 +84,14 @@ class ParcelAssociator:
 
         ### Incrémentation du compteur de chaque Parcel non associé.
         for i in range(len(parcels)):
-            if i not in row_ind:
+            if i not in associatedRows:
                 parcels[i].numberOfTimesUndetected += 1
                 parcels[i].isTracked = False
                 parcels[i].isInterpolated = True
                 parcels[i].relativeBox = deepcopy(parcels[i].nextRelativeBox)
 
         unassociateDetections = [i for i in range(numObj)
-                                 if i not in col_ind]
+                                 if i not in associatedCols]
 
         return unassociateDetections
 
@@ -78,28 +108,59 @@ class ParcelAssociator:
             iouMat: la matrice des scores basés sur l'IOU, contenant les scores de
             toutes les paires d'objet/Parcel. La matrice n'est pas forcément carrée.
         """
-        iouMat = np.zeros((len(parcels), numObj))
-        for i in range(len(parcels)):
-            for j in range(numObj):
-                ## Calcul du score basé sur l'IOU, score = 1 - IOU
-                iouMat[i, j] = computeIOUforRelativeBoxes(parcels[i].nextRelativeBox, objects[j][2])
-        return iouMat
+        ## Calcul du score basé sur l'IOU, score = 1 - IOU, pour toutes les paires
+        return iouScoreMatrix(boxesToArray([parcel.nextRelativeBox for parcel in parcels]),
+                              boxesToArray([obj[2] for obj in objects[:numObj]]))
 
     def associateWithIOU(self, parcels, numObj, objects):
         """
-        Associe à l'aide d'un algorithme hongrois (linear_sum_assignment)
-        les objets aux Parcel avec la matrice des scores basés sur l'IOU. 
+        Associe les objets aux Parcel avec la matrice des scores basés sur
+        l'IOU, selon la stratégie du ParcelAssociator (par défaut algorithme
+        hongrois, linear_sum_assignment).
 
         Args:
             parcels: pointeur sur la liste des trackedParcels du ParcelTracker.
             numObj: le nombre d'objets détectés.
             objects: la liste des objets détectés.
         """
-        scoreMatrix = self.computeIOUscoreMatrix(parcels, numObj, objects)
+        t0 = time.perf_counter()
+        if self.strategy == 'gated':
+            row_ind, col_ind = gatedAssignment(boxesToArray([parcel.nextRelativeBox for parcel in parcels]),
+                                               boxesToArray([obj[2] for obj in objects[:numObj]]),
+                                               self.confidenceThreshold)
+        else:
+            scoreMatrix = self.computeIOUscoreMatrix(parcels, numObj, objects)
+            if self.traceInfo:
+                print(str(scoreMatrix))
+            if self.strategy == 'hungarian':
+                row_ind, col_ind = self._hungarianAssignment(scoreMatrix)
+            else:
+                row_ind, col_ind = self._greedyAssignment(scoreMatrix)
+        self._recordTiming(self.strategy if self.strategy != 'cascade' else 'greedy', time.perf_counter() - t0)
+
+        if self.strategy == 'cascade':
+            t0 = time.perf_counter()
+            self._cascadeAssignment(parcels, numObj, objects, row_ind, col_ind)
+            self._recordTiming('cascade', time.perf_counter() - t0)
 
-        if self.traceInfo:
-            print(str(scoreMatrix))
+        ### TO DO :
+        ### - Vérifier que la matrice de score et le linear_sum est bien fonctionnel.
+        ### - Blinder en empêchant une association avec un IOU à 0 (soit un score de 1)
+        ### Pour se faire il faut retirer les indices perturbateurs ou reporter le problème
+        ### à la fonction associate en transmettant la scoreMatrix aussi (moins bien).
+        unassociateDetections = self.associate(row_ind, col_ind, parcels, numObj, objects)
+        return unassociateDetections
+
+    def _hungarianAssignment(self, scoreMatrix):
+        """
+        Association optimale sur la matrice complète des scores. Les paires
+        refusées par confidenceThreshold ne sont retirées qu'après l'algorithme
+        hongrois : elles peuvent peser sur le choix des paires gardées, ce qui
+        distingue cette stratégie de gated et greedy (problème élagué).
 
+        Returns:
+            Les listes row_ind et col_ind des paires de score inférieur à confidenceThreshold.
+        """
         ### Programmation dynamique donnant la liste des associations optimales.
         row_ind, col_ind = linear_sum_assignment(scoreMatrix)
         row_ind = row_ind.tolist()
@@ -110,14 +171,80 @@ class ParcelAssociator:
             if scoreMatrix[row_ind[i]][col_ind[i]] >= self.confidenceThreshold:
                 row_ind.pop(i)
                 col_ind.pop(i)
+        return row_ind, col_ind
 
-        ### TO DO :
-        ### - Vérifier que la matrice de score et le linear_sum est bien fonctionnel.
-        ### - Blinder en empêchant une association avec un IOU à 0 (soit un score de 1)
-        ### Pour se faire il faut retirer les indices perturbateurs ou reporter le problème
-        ### à la fonction associate en transmettant la scoreMatrix aussi (moins bien).
-        unassociateDetections = self.associate(row_ind, col_ind, parcels, numObj, objects)
-        return unassociateDetections
+    def _greedyAssignment(self, scoreMatrix):
+        """
+        Associe chaque Parcel à sa meilleure détection quand les meilleurs
+        choix sont mutuels : chaque Parcel ayant une détection acceptable est
+        le meilleur Parcel de sa meilleure détection, et inversement. Comme
+        gated, le problème résolu est élagué : les paires refusées par
+        confidenceThreshold prennent le score 1. La solution atteint alors la
+        borne inférieure du coût et est optimale ; sinon (conflit) l'algorithme
+        hongrois est utilisé sur la matrice élaguée.
+
+        Returns:
+            Les listes row_ind et col_ind des paires associées.
+        """
+        if scoreMatrix.size == 0:
+            return [], []
+        accepted = np.where(scoreMatrix < self.confidenceThreshold, scoreMatrix, 1.0)
+        rowBest = np.argmin(accepted, axis=1)
+        colBest = np.argmin(accepted, axis=0)
+        rows = np.flatnonzero(accepted[np.arange(accepted.shape[0]), rowBest] < self.confidenceThreshold)
+        cols = np.flatnonzero(accepted[colBest, np.arange(accepted.shape[1])] < self.confidenceThreshold)
+        if np.all(colBest[rowBest[rows]] == rows) and np.all(rowBest[colBest[cols]] == cols):
+            return rows.tolist(), rowBest[rows].tolist()
+
+        self.greedyFallbacks += 1
+        t0 = time.perf_counter()
+        assignment = self._hungarianAssignment(accepted)
+        self._recordTiming('hungarian', time.perf_counter() - t0)
+        return assignment
+
+    def _cascadeAssignment(self, parcels, numObj, objects, row_ind, col_ind):
+        """
+        Second étage de cascade : associe par distance des centres les Parcels
+        prédits et les détections restés sans association par IOU. Les paires
+        trouvées sont ajoutées à row_ind et col_ind.
+        """
+        associatedCols = set(col_ind)
+        associatedRows = set(row_ind)
+        leftRows = [i for i in range(len(parcels))
+                    if i not in associatedRows and max(parcels[i].nextRelativeBox) != 0]
+        leftCols = [j for j in range(numObj) if j not in associatedCols]
+        if len(leftRows) == 0 or len(leftCols) == 0:
+            return
+
+        parcelCenters = np.asarray([parcels[i].nextCenter for i in leftRows], dtype=np.float64)
+        objCenters = centersFromBoxes(boxesToArray([objects[j][2] for j in leftCols]))
+        distances = centerDistanceMatrix(parcelCenters, objCenters)
+        for i, j in zip(*linear_sum_assignment(distances)):
+            if distances[i, j] < self.cascadeMaxCenterDistance:
+                row_ind.append(leftRows[i])
+                col_ind.append(leftCols[j])
+                self.cascadeMatches += 1
+
+    def _recordTiming(self, name, duration):
+        timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += duration
+        timing[2] = max(timing[2], duration)
+
+    def stats(self):
+        """
+        Retourne les compteurs de l'association.
+
+        Returns:
+            Un dictionnaire : stratégie, par étage nombre d'appels et durées
+            moyenne et maximale en millisecondes, recours à l'algorithme
+            hongrois de la stratégie greedy et paires du second étage de cascade.
+        """
+        return {'strategy': self.strategy,
+                'timings': {name: {'calls': calls, 'meanMs': 1000 * total / calls, 'maxMs': 1000 * longest}
+                            for name, (calls, total, longest) in self.timings.items()},
+                'greedyFallbacks': self.greedyFallbacks,
+                'cascadeMatches': self.cascadeMatches}
 
     def computeCenterEuclidieanDistScoreMatrix(self, parcels, numObj, objects):
         """
@@ -133,12 +260,9 @@ class ParcelAssociator:
             contenant les scores de toutes les paires d'objet/Parcel. 
             La matrice n'est pas forcément carrée.
         """
-        edMat = np.zeros((len(parcels), numObj))
-        for i in range(len(parcels)):
-            for j in range(numObj):
-                objCenter = computeCenterFromRelativeBox(objects[j][2])
-                edMat[i, j] = computeEuclideanDistForCenters(parcels[i].nextCenter, objCenter)
-        return edMat
+        parcelCenters = np.asarray([parcel.nextCenter for parcel in parcels], dtype=np.float64).reshape(-1, 2)
+        objCenters = centersFromBoxes(boxesToArray([obj[2] for obj in objects[:numObj]]))
+        return centerDistanceMatrix(parcelCenters, objCenters)
 
     def associateWithEuclidieanDist(self, parcels, numObj, objects):
         """
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import logging
+from logging.handlers import WatchedFileHandler
+import signal
+import configparser as cfg
+
+from communication_server.InferenceServer import InferenceServer
+from config.directories import directories as dirs
+from libs.fasterObjectDetection.factory import createDetector
+from libs.features.detection import fitImageSize
+
+
+def ConfigureLogger(logger):
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s')
+    file_handler = WatchedFileHandler('/var/log/solystic/cars-inference.log')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+
+def createServerDetector(config, sectionName='DEFAULT'):
+    """
+    Charge le détecteur du serveur avec le modèle, les labels, le seuil et le
+    GPU de la section de parcelTracker.ini utilisée par les trackers.
+    """
+    trackerConfig = cfg.ConfigParser()
+    trackerConfig.read(dirs.dir_config / config.get(sectionName, 'configFileTracker'))
+    trackerSection = config.get(sectionName, 'sectionNameTracker')
+
+    # préchauffage à la taille de l'image complète ramenée dans inferenceSize
+    # (les trackers gardent les proportions de l'image ou de la découpe)
+    inferenceSize = trackerConfig.get(trackerSection, 'inferenceSize', fallback='')
+    initSize = (972, 1296, 3)
+    if inferenceSize.strip() != '':
+        width, height = fitImageSize(initSize[1], initSize[0], tuple(int(x) for x in inferenceSize.split(',')))
+        initSize = (height, width, 3)
+
+    return createDetector(config.get(sectionName, 'detectorBackend'),
+                          dirs.dir_model / trackerConfig.get(trackerSection, 'PATH_TO_CKPT'),
+                          dirs.dir_labels / trackerConfig.get(trackerSection, 'PATH_TO_LABELS'),
+                          trackerConfig.getfloat(trackerSection, 'detectionThreshold'),
+                          trackerConfig.get(trackerSection, 'gpuNum'),
+                          trackerConfig.getfloat(trackerSection, 'gpuMemoryFraction'),
+                          initSize=initSize,
+                          cpuThreads=trackerConfig.getint(trackerSection, 'cpuThreads', fallback=0),
+                          PATH_TO_CONFIG=dirs.dir_model / trackerConfig.get(trackerSection, 'PATH_TO_DNN_CONFIG', fallback=''))
+
+
+def mainInferenceServer(logger, sectionName='DEFAULT'):
+    config = cfg.ConfigParser()
+    config.read(dirs.dir_config / 'inferenceServer.ini')
+
+    detector = createServerDetector(config, sectionName)
+    server = InferenceServer(detector,
+                             config.get(sectionName, 'socketPath'),
+                             config.get(sectionName, 'authkey', fallback=''),
+                             config.getint(sectionName, 'maxBatchSize'),
+                             config.getfloat(sectionName, 'batchDeadlineMs'),
+                             config.getfloat(sectionName, 'statsInterval'))
+
+    def shutdown(signum, frame):
+        logger.info('Inference server shutting down...')
+        server.stop()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    server.run()
+    logger.info('Inference server stats : {}'.format(server.stats()))
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger()
+    ConfigureLogger(logger)
+    mainInferenceServer(logger)
@@ -9,6 +9,7 @@ import traceback
 import time
 import configparser as cfg
    
+from communication_server.AsyncIngestServer import AsyncIngestServer, CameraMailboxes
 from communication_server.HttpServer import HttpServer
 from config.directories import directories as dirs
 from parcelTrackerWorker import ParcelTrackerWorker
@@ -49,21 +50,28 @@ def readMainConfig(configFile, sectionName = 'DEFAULT'):
     ilot =  config.get(sectionName, 'ilot')
     return ilot, traitement
 
+def readIngestConfig(configFile, sectionName = 'DEFAULT'):
+    config = cfg.ConfigParser()
+    config.read(configFile)
+    return {'ingestServer': config.get(sectionName, 'ingestServer', fallback='flask'),
+            'maxBodyMB': config.getfloat(sectionName, 'ingestMaxBodyMB', fallback=16),
+            'keepAliveTimeout': config.getfloat(sectionName, 'ingestKeepAliveTimeout', fallback=60),
+            'statsInterval': config.getfloat(sectionName, 'ingestStatsInterval', fallback=60)}
+
 def mainLiveParcelDetection(logger):
-    imageQ = Queue(1)
+    ingestConfig = readIngestConfig(dirs.dir_config / 'mainParcelTracking.ini')
+    # serveur asyncio : une boîte aux lettres par caméra (dernière image gagnante) au lieu de la file
+    imageQ = CameraMailboxes() if ingestConfig['ingestServer'] == 'async' else Queue(1)
     incomingQ = Queue(1)
 
-    httpserv = HttpServer(imageQ, incomingQ, logger)
     if ginstanceID != "0":
         numPort = 5000 + (int(ginstanceID)-1)*10
-        port = str(numPort)
-        httpservProcess = Thread(target=httpservThread, args=(httpserv, '0.0.0.0', numPort))
     else:
-        httpservProcess = Thread(target=httpservThread, args=(httpserv, '0.0.0.0', 5000))
-        port = '5000'
+        numPort = 5000
+    port = str(numPort)
 
-    ilot, traitement = readMainConfig(dirs.dir_config +  'mainParcelTracking.ini')
-    configFile = dirs.dir_config + 'parcelTrackerWorker.ini'
+    ilot, traitement = readMainConfig(dirs.dir_config / 'mainParcelTracking.ini')
+    configFile = dirs.dir_config / 'parcelTrackerWorker.ini'
     sectionName = 'DEFAULT'
     if ginstanceID != '0':
         sectionName = 'ParcelTrackerWorker' + str(int(ginstanceID) + (4 * (traitement - 1)))
@@ -74,6 +82,16 @@ def mainLiveParcelDetection(logger):
     except Exception as ex:
         print('Tracker worker failed to start !!', ex)
         raise SystemExit()
+    # les images reçues passent par l'anneau partagé du worker si useFrameRing,
+    # par son tampon de gigue si useJitterBuffer
+    imageQ = liveDetectionProcess.imageQ
+    if ingestConfig['ingestServer'] == 'async':
+        httpserv = AsyncIngestServer(imageQ, incomingQ, logger, liveDetectionProcess.frameRing,
+                                     ingestConfig['maxBodyMB'], ingestConfig['keepAliveTimeout'],
+                                     ingestConfig['statsInterval'])
+    else:
+        httpserv = HttpServer(imageQ, incomingQ, logger, liveDetectionProcess.frameRing)
+    httpservProcess = Thread(target=httpservThread, args=(httpserv, '0.0.0.0', numPort))
     
     httpservProcess.start()
     liveDetectionProcess.start()
@@ -93,7 +111,10 @@ def mainLiveParcelDetection(logger):
     return
 
 def httpservThread(httpserv, host='0.0.0.0', port=5000, debug=False):    
-    httpserv.app.run(host=host, port=port, debug=debug)
+    if isinstance(httpserv, AsyncIngestServer):
+        httpserv.run(host, port)
+    else:
+        httpserv.app.run(host=host, port=port, debug=debug)
 
 if __name__ == '__main__':
     logger = logging.getLogger()
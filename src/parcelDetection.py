@@ -25,7 +25,9 @@ from constants import (C_PARCELTRACKER,
                        )
 from config.directories import directories as dirs
 from parcelTracker import ParcelTracker
+from libs.fasterObjectDetection.registry import loadedDetector, registryReport
 from utils.objectDetectionViz import drawParcelOnImageArray
+from utils.rawFrames import buildManifest, ReplaySource
 from utils.utils import draw_bounding_box_on_image_array
 from parcels.parcel import Parcel
 from parcels.parcelIdManager import ParcelIdManager
@@ -96,32 +98,30 @@ def load_image(PIdM, **kwargs):
         time.sleep(0.250)
 
 
-def loadImageServer(imageQueue, incomingQ):
-    dirlist = os.listdir(dirs.dir_raw)
+def loadImageServer(imageQueue, incomingQ, speed=1.0):
+    # rejeu des images de data/raw vers le worker, les camras deux  deux
+    # (cam1/cam2, cam3/cam4...), dans l'ordre des timestamps et au rythme de
+    # l'enregistrement (speed = 0 : le plus rapide possible).
+    # chaque image de la premire camra d'une paire est envoye avec la
+    # dernire image reue de la seconde ; les images sont envoyes encodes,
+    # le worker les dcode (ParcelTracker.decodeImage)
     PIdM = ParcelIdManager(C_UOOO)
-
-    # load_image(PIdM, **data)
-    for j in range(0,len(dirlist)-1,2):
-
-        imRoot = str(dirs.dir_raw) + "/"+ dirlist[j] +'/'
-        imRoot2 = str(dirs.dir_raw) +"/"+ dirlist[j+1] + '/'
-
-        images = os.listdir(imRoot)
-        images2 = os.listdir(imRoot2)
-        #if j > 500:<
-        #    break
-        #print(imRoot)
-        for i in range(min(len(images) - 1, len(images2) - 1)):
-            if i > 0 and i+1 < len(images2):
-                image = imRoot+ images[i]
-                image2 = imRoot2+ images2[i+1]
-                if np.random.randint(0,15) == 0:
-                    print('New incoming parcel')
-                    incomingQ.put(newParcel(PIdM))
-
-                if 'jpg' in image and 'jpg' in image2:
-                    imageQueue.put([image, image2])
-                time.sleep(0.250)
+    manifest = buildManifest()
+    camDirs = sorted({frame['cam'] for frame in manifest})
+
+    for j in range(0, len(camDirs) - 1, 2):
+        camPair = (camDirs[j], camDirs[j + 1])
+        source = ReplaySource([frame for frame in manifest if frame['cam'] in camPair], speed)
+        latest = dict()
+        for frame, data in source:
+            latest[frame['cam']] = data
+            if frame['cam'] != camPair[0] or camPair[1] not in latest:
+                continue
+            if np.random.randint(0, 15) == 0:
+                print('New incoming parcel')
+                incomingQ.put(newParcel(PIdM))
+            imageQueue.put([data, latest[camPair[1]]])
+        print('Replay {} : {}'.format(camPair, source.stats()))
 
 
 def parcelDetection():
@@ -138,10 +138,40 @@ def parcelDetection():
     return None
 
 
+def detectTrackerFrames(trackers, ts=None):
+    """
+    Lance la detection sur les images de plusieurs trackers.
+
+    Args:
+        trackers: liste des (ParcelTracker, image, camera).
+        ts: timestamp des images, None pour le rejeu dans l'ordre du journal.
+
+    Returns:
+        La liste des (numObj, objects) de chaque tracker, (0, None) hors cadence de detection.
+    """
+    # un appel batch par dtecteur charg : seuls les trackers qui partagent le
+    # mme dtecteur (registre, mme _detectorKey) sont regroups
+    # (les trackers hors cadence de dtection ne sont pas passs au dtecteur)
+    groups = dict()
+    for i, (tracker, image, cam) in enumerate(trackers):
+        if tracker.shouldDetect():
+            groups.setdefault(id(loadedDetector(tracker.parcelDetector)), []).append(i)
+
+    detections = [(0, None)] * len(trackers)
+    for group in groups.values():
+        frames = [trackers[i][0].prepareImage(trackers[i][1]) for i in group]
+        frameKeys = [(trackers[i][2], ts) for i in group]
+        results = trackers[group[0]][0].parcelDetector.run_inference_for_frames(frames, frameKeys)
+        for i, result in zip(group, results):
+            detections[i] = trackers[i][0].mapDetections(*result)
+    return detections
+
+
 def parcelDetectionWorker(imageQueue, incomingQ):
     configFile = dirs.dir_config / C_PARCELTRACKER
     parcelTracker1 = ParcelTracker(configFile, C_TRACKER1)
     parcelTracker2 = ParcelTracker(configFile, C_TRACKER2)
+    print('Detector sharing : {}'.format(registryReport()))
 
     # displayDetection = True
     fps = 8
@@ -155,8 +185,8 @@ def parcelDetectionWorker(imageQueue, incomingQ):
         
         image = imageQueue.get()
 
-        image_cam1 = cv2.imread(str(image[0]))
-        image_cam2 = cv2.imread(str(image[1]))
+        image_cam1 = parcelTracker1.decodeImage(image[0])
+        image_cam2 = parcelTracker2.decodeImage(image[1])
 
         incParcel = None
         while not incomingQ.empty():
@@ -166,7 +196,11 @@ def parcelDetectionWorker(imageQueue, incomingQ):
         parcelS_1 = parcelTracker1.trackerSpace.beltBoundaries
         parcelS_2 = parcelTracker1.trackerSpace.beltBoundaries
         print("beltboundaries", parcelS_1)
-        parcels, objects, numObj = parcelTracker1.update(image_cam1, [incParcel], 1)
+
+        # dtection des deux camras, en un seul appel si les trackers partagent le dtecteur
+        detections = detectTrackerFrames([(parcelTracker1, image_cam1, 1), (parcelTracker2, image_cam2, 2)])
+
+        parcels, objects, numObj = parcelTracker1.updateWithDetections(*detections[0], [incParcel], 1)
         # print("object", objects)
         print("Parcels", parcels)
         image = cv2.cvtColor(image_cam1, cv2.COLOR_BGR2RGB)
@@ -187,7 +221,7 @@ def parcelDetectionWorker(imageQueue, incomingQ):
 
         # tracker 2
         parcelsCopy = deepcopy(parcels)
-        parcels2, objects, numObj = parcelTracker2.update(image_cam2, parcelsCopy, 2)
+        parcels2, objects, numObj = parcelTracker2.updateWithDetections(*detections[1], parcelsCopy, 2)
         
         image2 = cv2.cvtColor(image_cam2, cv2.COLOR_BGR2RGB)
         # affichage limites du convoyeur sous la deuxieme camera
@@ -208,6 +242,8 @@ def parcelDetectionWorker(imageQueue, incomingQ):
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
         ite += 1
+        if ite % 100 == 0 and hasattr(parcelTracker1.parcelDetector, 'stats'):
+            print('Detection cache : {}'.format(parcelTracker1.parcelDetector.stats()))
 
     # vidcap.release()
     # out.release()
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 import configparser as cfg
+import hashlib
+import json
 import os
+import shutil
 import traceback
 
 import cv2
 import numpy as np
 
 from config.directories import directories as dirs
+from libs.features.detection import cropImageToRoi
+
+# version du format des artefacts compilés, à incrémenter si leur contenu change
+COMPILED_FORMAT = 1
+# géométrie du TrackerSpace enregistrée dans l'artefact compilé
+_GEOMETRY_FIELDS = ['beltBoundaries', 'primeAssociationAreas', 'zoneUnit0', 'realPositionOfCenter',
+                    'imageCenter', 'imageSize', 'quadraticResolutionCoefficient', 'cameraHeight',
+                    'deltaImageBoundary', 'yGapWithPreviousCam', 'doUndistortion', 'undistortionMode',
+                    'calibrationFile']
 
 class TrackerSpace():
     """
@@ -14,18 +26,39 @@ class TrackerSpace():
     Il définit tout ce qui se trouve dans le champ caméra du tracker avec les positions réelles.
     """
 
-    def __init__(self, configFile, trackerName = 'DEFAULT'):
+    def __init__(self, configFile, trackerName = 'DEFAULT', compiledCacheDir=None):
+        """
+        Args:
+            configFile: fichier de configuration de l'espace de tracking (dans config/).
+            trackerName: section du fichier de configuration.
+            compiledCacheDir: dossier des artefacts compilés (géométrie et cartes
+                de correction en virgule fixe, projetées en mémoire), None pour
+                toujours relire la configuration et la calibration.
+        """
         
         self.beltBoundaries = []
         self.primeAssociationAreas = dict()
         self.zoneUnit0 = ''
         
-        self._loadConfig(dirs.dir_config / configFile, trackerName)
-        
-        self.cameraMatrix = self.cameraCalibration['cameraMatrix']
-        self.distortionCoeff = self.cameraCalibration['distortionCoeff']
-        self.undistortionMapx = self.cameraCalibration['mapx']
-        self.undistortionMapy = self.cameraCalibration['mapy']
+        configPath = dirs.dir_config / configFile
+        compiledPath = None
+        if compiledCacheDir is not None:
+            compiledPath = self._compiledPath(configPath, trackerName, compiledCacheDir)
+        if compiledPath is None or not self._loadCompiled(compiledPath):
+            self._loadConfig(configPath, trackerName)
+            self.cameraMatrix = self.cameraCalibration['cameraMatrix']
+            self.distortionCoeff = self.cameraCalibration['distortionCoeff']
+            self.newCameraMatrix = self.cameraCalibration['newCameraMatrix'] if 'newCameraMatrix' in self.cameraCalibration else None
+            self.floatUndistortionMaps = (self.cameraCalibration['mapx'], self.cameraCalibration['mapy'])
+            # cartes en virgule fixe : chemin rapide de cv2.remap
+            self.undistortionMap1, self.undistortionMap2 = cv2.convertMaps(*self.floatUndistortionMaps, cv2.CV_16SC2)
+            if compiledPath is not None:
+                self._saveCompiled(compiledPath)
+        self.mapHeight, self.mapWidth = self.undistortionMap1.shape[:2]
+        ## cartes de correction mises à l'échelle des images décodées en résolution réduite
+        self.scaledUndistortionMaps = dict()
+        ## matrice de projection des points corrigés, estimée à la première correction de box
+        self.undistortedCameraMatrix = None
         ## info pour dessiner zone tracking sur le convoyeur sur l'image
         self.xMin, self.yMin = self.beltBoundaries[0][1], self.beltBoundaries[0][0]   
         self.xMax, self.yMax = self.beltBoundaries[0][3], self.beltBoundaries[0][2] 
@@ -55,6 +88,9 @@ class TrackerSpace():
             self.deltaImageBoundary = config.getfloat(trackerName, 'deltaImageBoundary')
             self.yGapWithPreviousCam = config.getfloat(trackerName, 'yGapWithPreviousCam')
             self.doUndistortion = config.getboolean(trackerName, 'doUndistortion')
+            self.undistortionMode = config.get(trackerName, 'undistortionMode', fallback='image')
+            if self.undistortionMode not in ('image', 'boxes'):
+                raise ValueError('undistortionMode must be image or boxes : ' + self.undistortionMode)
             
             for boundary in beltBoundariesStr.split(';'):
                 bs = [float(x) for x in boundary.split(',')]
@@ -66,6 +102,7 @@ class TrackerSpace():
             self.quadraticResolutionCoefficient = (float(quadraticResolutionCoefficientStr.split(',')[0]),
                                                float(quadraticResolutionCoefficientStr.split(',')[1]),
                                                float(quadraticResolutionCoefficientStr.split(',')[2]))
+            self.calibrationFile = cameraCalibrationStr
             self.cameraCalibration = np.load(dirs.dir_config / cameraCalibrationStr)
             
             if primeAssociationAreasStr != '':
@@ -98,6 +135,24 @@ class TrackerSpace():
                 return True, area
         return False, None
 
+    def getInferenceRoi(self, margin=0.0):
+        """
+        Calcule la zone de l'image utile au tracking : l'union des limites du
+        convoyeur et des zones d'association, élargie d'une marge.
+
+        Args:
+            margin: marge relative ajoutée de chaque côté.
+
+        Returns:
+            La zone relative (ymin, xmin, ymax, xmax), bornée à l'image.
+        """
+        areas = list(self.beltBoundaries) + list(self.primeAssociationAreas.values())
+        ymin = max(0.0, min(area[0] for area in areas) - margin)
+        xmin = max(0.0, min(area[1] for area in areas) - margin)
+        ymax = min(1.0, max(area[2] for area in areas) + margin)
+        xmax = min(1.0, max(area[3] for area in areas) + margin)
+        return ymin, xmin, ymax, xmax
+
     def getBeltRealPointCoordinatesForScene(self, point):
 
         xsc = self.realPositionOfCenter[0] - int(abs(self.beltBoundaries[0][1] - self.imageCenter[0]) * self.imageSize[0] / self.quadraticResolutionCoefficient[-1])
@@ -218,9 +273,215 @@ class TrackerSpace():
         return a * x * x + b * x + c
 
 
+    def _compiledPath(self, configPath, trackerName, compiledCacheDir):
+        """
+        Retourne le dossier de l'artefact compilé : son nom contient un hash du
+        fichier de configuration, toute modification du .ini l'invalide.
+        """
+        try:
+            with open(configPath, 'rb') as fp:
+                configBytes = fp.read()
+        except OSError:
+            return None
+        h = hashlib.blake2b(digest_size=8)
+        h.update(str(COMPILED_FORMAT).encode('ascii'))
+        h.update(trackerName.encode('utf-8'))
+        h.update(configBytes)
+        return dirs.dir_model / compiledCacheDir / '{}_{}'.format(trackerName, h.hexdigest())
+
+    def _calibrationStamp(self):
+        stat = os.stat(dirs.dir_config / self.calibrationFile)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _loadCompiled(self, compiledPath):
+        """
+        Charge l'artefact compilé s'il existe et si la calibration .npz n'a pas
+        changé depuis sa création. Les cartes sont projetées en mémoire.
+
+        Returns:
+            True si l'artefact a été chargé.
+        """
+        try:
+            with open(compiledPath / 'geometry.json') as fp:
+                geometry = json.load(fp)
+            self.calibrationFile = geometry['calibrationFile']
+            if geometry['calibrationStamp'] != self._calibrationStamp():
+                return False
+            for field in _GEOMETRY_FIELDS:
+                setattr(self, field, geometry[field])
+            self.beltBoundaries = [tuple(boundary) for boundary in self.beltBoundaries]
+            self.primeAssociationAreas = {zone: tuple(area) for zone, area in self.primeAssociationAreas.items()}
+            for field in ('realPositionOfCenter', 'imageCenter', 'imageSize', 'quadraticResolutionCoefficient'):
+                setattr(self, field, tuple(getattr(self, field)))
+            self.cameraMatrix = np.load(compiledPath / 'cameraMatrix.npy')
+            self.distortionCoeff = np.load(compiledPath / 'distortionCoeff.npy')
+            newCameraMatrixPath = compiledPath / 'newCameraMatrix.npy'
+            self.newCameraMatrix = np.load(newCameraMatrixPath) if newCameraMatrixPath.exists() else None
+            self.undistortionMap1 = np.load(compiledPath / 'map1.npy', mmap_mode='r')
+            self.undistortionMap2 = np.load(compiledPath / 'map2.npy', mmap_mode='r')
+        except (OSError, ValueError, KeyError, TypeError):
+            self.beltBoundaries = []
+            self.primeAssociationAreas = dict()
+            self.zoneUnit0 = ''
+            return False
+        self.floatUndistortionMaps = None
+        return True
+
+    def _saveCompiled(self, compiledPath):
+        """
+        Écrit l'artefact compilé (écriture dans un dossier temporaire puis
+        renommage) et supprime les artefacts périmés du même tracker.
+        """
+        tmpPath = compiledPath.with_name(compiledPath.name + '.tmp{}'.format(os.getpid()))
+        try:
+            tmpPath.mkdir(parents=True, exist_ok=True)
+            geometry = {field: getattr(self, field) for field in _GEOMETRY_FIELDS}
+            geometry['calibrationStamp'] = self._calibrationStamp()
+            with open(tmpPath / 'geometry.json', 'w') as fp:
+                json.dump(geometry, fp)
+            np.save(tmpPath / 'cameraMatrix.npy', self.cameraMatrix)
+            np.save(tmpPath / 'distortionCoeff.npy', self.distortionCoeff)
+            if self.newCameraMatrix is not None:
+                np.save(tmpPath / 'newCameraMatrix.npy', self.newCameraMatrix)
+            np.save(tmpPath / 'map1.npy', self.undistortionMap1)
+            np.save(tmpPath / 'map2.npy', self.undistortionMap2)
+            for stale in compiledPath.parent.glob(compiledPath.name.rsplit('_', 1)[0] + '_*'):
+                if stale != tmpPath:
+                    shutil.rmtree(stale, ignore_errors=True)
+            os.replace(tmpPath, compiledPath)
+        except OSError as e:
+            print('TrackerSpace: compiled artefact not written : {}'.format(e))
+            shutil.rmtree(tmpPath, ignore_errors=True)
+
+    def getFloatUndistortionMaps(self):
+        """
+        Retourne les cartes de correction en virgule flottante (mapx, mapy) à
+        la résolution de la caméra, reconstruites depuis les cartes en virgule
+        fixe si la calibration vient d'un artefact compilé.
+        """
+        if self.floatUndistortionMaps is None:
+            self.floatUndistortionMaps = cv2.convertMaps(np.asarray(self.undistortionMap1),
+                                                         np.asarray(self.undistortionMap2), cv2.CV_32FC1)
+        return self.floatUndistortionMaps
+
+    def getUndistortionMaps(self, width, height):
+        """
+        Retourne les cartes de correction de la distortion pour une image de
+        la taille donnée. Les cartes de calibration sont à la résolution de la
+        caméra ; pour une image décodée en résolution réduite elles sont
+        rééchantillonnées et leurs coordonnées divisées par le facteur d'échelle.
+
+        Args:
+            width: largeur de l'image en pixels.
+            height: hauteur de l'image en pixels.
+
+        Returns:
+            Les cartes en virgule fixe (map1, map2) à passer à cv2.remap.
+        """
+        if (width, height) == (self.mapWidth, self.mapHeight):
+            return self.undistortionMap1, self.undistortionMap2
+        maps = self.scaledUndistortionMaps.get((width, height))
+        if maps is None:
+            mapx, mapy = self.getFloatUndistortionMaps()
+            scaleX, scaleY = self.mapWidth / width, self.mapHeight / height
+            # centres de pixels : x_réduit = (x + 0.5) / échelle - 0.5
+            mapx = (cv2.resize(mapx, (width, height), interpolation=cv2.INTER_LINEAR) + 0.5) / scaleX - 0.5
+            mapy = (cv2.resize(mapy, (width, height), interpolation=cv2.INTER_LINEAR) + 0.5) / scaleY - 0.5
+            maps = cv2.convertMaps(mapx.astype(np.float32), mapy.astype(np.float32), cv2.CV_16SC2)
+            self.scaledUndistortionMaps[(width, height)] = maps
+        return maps
+
+    def _estimateUndistortedCameraMatrix(self):
+        """
+        Estime la matrice de projection utilisée pour construire les cartes de
+        correction (newCameraMatrix de initUndistortRectifyMap) : les points
+        corrigés par undistortPoints tombent alors exactement là où la
+        correction de l'image complète les placerait.
+
+        Returns:
+            La matrice 3x3 de projection des points corrigés.
+        """
+        if self.newCameraMatrix is not None:
+            return self.newCameraMatrix
+        height, width = self.mapHeight, self.mapWidth
+        mapx, mapy = self.getFloatUndistortionMaps()
+        v, u = np.mgrid[0:height:height // 20, 0:width:width // 20]
+        sources = np.stack([mapx[v, u], mapy[v, u]], -1).reshape(-1, 1, 2)
+        valid = ((sources[:, 0, 0] >= 0) & (sources[:, 0, 0] < width)
+                 & (sources[:, 0, 1] >= 0) & (sources[:, 0, 1] < height))
+        normalized = cv2.undistortPoints(sources[valid].astype(np.float64), self.cameraMatrix,
+                                         self.distortionCoeff).reshape(-1, 2)
+        ones = np.ones(len(normalized))
+        (fx, cx), _, _, _ = np.linalg.lstsq(np.stack([normalized[:, 0], ones], 1), u.reshape(-1)[valid], rcond=None)
+        (fy, cy), _, _, _ = np.linalg.lstsq(np.stack([normalized[:, 1], ones], 1), v.reshape(-1)[valid], rcond=None)
+        return np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]])
+
+    def undistortBoxes(self, boxes):
+        """
+        Corrige la distortion de box détectées sur l'image brute, sans
+        corriger l'image complète. Quatre points de chaque box sont corrigés
+        par cv2.undistortPoints, la box corrigée est leur enveloppe. Ce sont
+        les points où les bords d'un objet rectangulaire touchent sa box brute :
+        le point de chaque côté le plus proche du centre optique en barillet,
+        les coins en coussinet. L'approximation est la moins bonne loin du
+        centre optique (voir benchmark.py undistortion).
+
+        Args:
+            boxes: box relatives (ymin, xmin, ymax, xmax) de l'image brute.
+
+        Returns:
+            Le tableau (N, 4) des box relatives dans l'image corrigée.
+        """
+        boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return boxes
+        if self.undistortedCameraMatrix is None:
+            self.undistortedCameraMatrix = self._estimateUndistortedCameraMatrix()
+
+        height, width = self.mapHeight, self.mapWidth
+        ymin, xmin, ymax, xmax = boxes.T
+        if self.distortionCoeff.reshape(-1)[0] < 0:
+            # distortion en barillet : un bord droit de l'objet touche la box brute
+            # en son point le plus proche du centre optique
+            cx = (self.cameraMatrix[0, 2] + 0.5) / width
+            cy = (self.cameraMatrix[1, 2] + 0.5) / height
+            xc, yc = np.clip(cx, xmin, xmax), np.clip(cy, ymin, ymax)
+            xs = np.stack([xc, xmax, xc, xmin], 1)
+            ys = np.stack([ymin, yc, ymax, yc], 1)
+        else:
+            # distortion en coussinet : les extrémités sont aux coins
+            xs = np.stack([xmin, xmax, xmax, xmin], 1)
+            ys = np.stack([ymin, ymin, ymax, ymax], 1)
+        # coordonnées relatives -> centres de pixels
+        points = np.stack([xs * width - 0.5, ys * height - 0.5], -1).reshape(-1, 1, 2)
+        points = cv2.undistortPoints(points, self.cameraMatrix, self.distortionCoeff,
+                                     P=self.undistortedCameraMatrix).reshape(len(boxes), 4, 2)
+        xs = (points[:, :, 0] + 0.5) / width
+        ys = (points[:, :, 1] + 0.5) / height
+        return np.clip(np.stack([ys.min(1), xs.min(1), ys.max(1), xs.max(1)], 1), 0.0, 1.0)
+
     def undistortImage(self, image):
-        undistortedImage = cv2.remap(image, self.undistortionMapx, self.undistortionMapy, cv2.INTER_LINEAR)
+        map1, map2 = self.getUndistortionMaps(image.shape[1], image.shape[0])
+        undistortedImage = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
         return undistortedImage
+
+    def undistortImageRoi(self, image, roi):
+        """
+        Corrige la distortion de la seule zone utile de l'image : les cartes
+        sont découpées sur la zone, cv2.remap ne calcule que ses pixels.
+        Équivalent à cropImageToRoi(undistortImage(image), roi).
+
+        Args:
+            image: image brute de la caméra.
+            roi: la zone relative (ymin, xmin, ymax, xmax) dans l'image corrigée.
+
+        Returns:
+            La zone corrigée et la zone relative exacte correspondant aux pixels gardés.
+        """
+        map1, map2 = self.getUndistortionMaps(image.shape[1], image.shape[0])
+        map1, exactRoi = cropImageToRoi(map1, roi)
+        map2, _ = cropImageToRoi(map2, roi)
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR), exactRoi
         
 
 def isInDelimitedArea(bbox, area):
@@ -6,12 +6,16 @@ import traceback
 import time
 import numpy as np
 import os
+import cv2
 
 from config.directories import directories as dirs
 from libs.features.featuresExtractor import setParcelsWidthRef
 from libs.features.heightEstimator import HeightEstimator
-from libs.features.detection import detectAndFilterParcels
-from libs.fasterObjectDetection.detector import ObjectDetector
+from libs.features.detection import filterAndSortParcels, cropImageToRoi, mapObjectsFromRoi, undistortObjects, \
+    fitImageSize
+from libs.fasterObjectDetection.factory import createDetector
+from libs.fasterObjectDetection.detectionCache import CachedDetector, detectorIdentity
+from libs.fasterObjectDetection.registry import getSharedDetector, registryReport
 from libs.vision.parcelAssociator import ParcelAssociator
 from libs.vision.detectionTracker import DetectionTracker
 from libs.motion.peer2peerTracker import Peer2peerTracker
@@ -22,6 +26,9 @@ COLORS = ['Blue', 'Cyan', 'Orange', 'DeepPink',
           'LawnGreen', 'Lime', 'Purple', 'Green',
           'Turquoise', 'Violet', 'Yellow', 'Magenta']
 
+# durée en secondes d'une unité de timestamp des images (paramètre ts des requêtes)
+TIMESTAMP_UNITS = {'s': 1.0, 'ms': 1e-3, 'us': 1e-6}
+
 logger = logging.getLogger(__name__)
 
 
@@ -35,13 +42,15 @@ class ParcelTracker():
         objet réinsérer au milieu du convoyeur. Il permettrai également de gérer les fausses détections.
     """
 
-    def __init__(self, configFile, trackerType='DEFAULT', logger=None):
+    def __init__(self, configFile, trackerType='DEFAULT', logger=None, detector=None):
         """
         Crée un objet ParcelTracker.
 
         Args:
             configFile: fichier de configuration a charger.
             trackerType: section du fichier de configuration a charger.
+            detector: détecteur à utiliser à la place de celui décrit dans
+                le fichier de configuration (rejeu, benchmark...).
 
         Attributes:        
             trackedParcels: la liste des Parcel trackés.
@@ -59,11 +68,6 @@ class ParcelTracker():
         self.logger = logger
         self._loadConfig(configFile, trackerType)
 
-        self.parcelDetector = ObjectDetector(dirs.dir_model / self.PATH_TO_CKPT,
-                                             dirs.dir_labels / self.PATH_TO_LABELS,
-                                             self.detectionThreshold, self.gpuNum,
-                                             self.gpuMemoryFraction)
-
         self.PIdM = ParcelIdManager(self.unitName)
         self.colors = COLORS
         self.trackedParcels = []
@@ -71,10 +75,45 @@ class ParcelTracker():
         self.fakeParcels = dict()
         self.parcelInfo = self.newParcel()
 
-        self.PA = ParcelAssociator()
+        self.PA = ParcelAssociator(self.associationStrategy, self.cascadeMaxCenterDistance)
         self.HE = HeightEstimator()
-        self.detectionTracker = DetectionTracker(self.fps)
-        self.trackerSpace = TrackerSpace(self.trackerSpaceConfig, self.unitName)
+        self.detectionTracker = DetectionTracker(self.fps, associationStrategy=self.associationStrategy,
+                                                 cascadeMaxCenterDistance=self.cascadeMaxCenterDistance,
+                                                 kalmanMode=self.kalmanMode,
+                                                 kalmanWarmupFrames=self.kalmanWarmupFrames,
+                                                 variableDt=self.kalmanVariableDt)
+        self.trackerSpace = TrackerSpace(self.trackerSpaceConfig, self.unitName,
+                                         self.trackerSpaceCache if self.trackerSpaceCache != '' else None)
+        ## zone de l'image passée au détecteur, None pour l'image complète
+        ## (les détections rejouées sont déjà relatives à l'image complète)
+        self.inferenceRoi = None
+        if self.cropToBeltRoi and self.detectorBackend != 'recorded':
+            self.inferenceRoi = self.trackerSpace.getInferenceRoi(self.beltRoiMargin)
+        self.croppedRoi = None
+        ## correction de la distortion sur les box détectées plutôt que sur l'image
+        ## (les détections rejouées sont déjà corrigées)
+        self.boxUndistortion = (self.trackerSpace.doUndistortion and self.trackerSpace.undistortionMode == 'boxes'
+                                and self.detectorBackend != 'recorded')
+        ## décodage JPEG en résolution réduite (mise à l'échelle DCT de libjpeg)
+        self.decodeScale, self.decodeFlag = self._chooseDecodeScale()
+        ## le préchauffage du détecteur se fait à la taille des images préparées
+        if self.inferenceSize is not None:
+            width, height = fitImageSize(*self._preparedImageSize(), self.inferenceSize)
+            self.warmupSize = (height, width, 3)
+
+        if detector is not None:
+            self.parcelDetector = detector
+        elif self.shareDetector:
+            self.parcelDetector = getSharedDetector(self._detectorKey(), self._createDetector)
+            if self.logger is not None:
+                self.logger.info('Detector sharing : {}'.format(registryReport()))
+        else:
+            self.parcelDetector = self._createDetector()
+
+        ## cadence de détection : nombre d'images depuis la dernière détection
+        self.framesSinceDetection = 0
+        ## timestamp de l'image précédente de chaque caméra, pour l'intervalle réel entre les images
+        self.lastFrameTs = dict()
 
         ## info pour dessiner zone tracking sur le convoyeur et sur l'image
         self.xMinLimit, self.yMinLimit = self.trackerSpace.xMin, self.trackerSpace.yMin
@@ -87,6 +126,55 @@ class ParcelTracker():
 
         self.p2pTracker = Peer2peerTracker()
 
+    def setAssociationStrategy(self, strategy):
+        """
+        Change l'algorithme d'association des Parcels suivis et entrants
+        (comparaison des stratégies par benchmark.py).
+
+        Args:
+            strategy: une des libs.vision.parcelAssociator.ASSOCIATION_STRATEGIES.
+        """
+        self.associationStrategy = strategy
+        self.PA = ParcelAssociator(strategy, self.cascadeMaxCenterDistance)
+        self.detectionTracker.PA = ParcelAssociator(strategy, self.cascadeMaxCenterDistance)
+
+    def _detectorKey(self):
+        """
+        Retourne la clé du détecteur dans le registre du process : tous les
+        paramètres qui changent le modèle chargé ou ses sorties, et la taille
+        des images du préchauffage (warmupSize, dérivée de inferenceSize).
+        """
+        return (self.detectorBackend, self.PATH_TO_CKPT, self.PATH_TO_LABELS, self.detectionThreshold,
+                self.gpuNum, self.gpuMemoryFraction, self.cpuThreads, self.PATH_TO_DNN_CONFIG,
+                self.detectionLog, self.inferenceSocket, self.inferenceAuthkey, self.detectionCache,
+                self.detectionCacheDir, self.warmupSize)
+
+    def _createDetector(self):
+        """
+        Crée le détecteur décrit par le fichier de configuration, enveloppé
+        par le cache de détections si detectionCache.
+        """
+        parcelDetector = createDetector(self.detectorBackend,
+                                        dirs.dir_model / self.PATH_TO_CKPT,
+                                        dirs.dir_labels / self.PATH_TO_LABELS,
+                                        self.detectionThreshold, self.gpuNum,
+                                        self.gpuMemoryFraction,
+                                        initSize=self.warmupSize,
+                                        cpuThreads=self.cpuThreads,
+                                        PATH_TO_CONFIG=dirs.dir_model / self.PATH_TO_DNN_CONFIG,
+                                        PATH_TO_LOG=dirs.dir_model / self.detectionLog,
+                                        PATH_TO_SOCKET=self.inferenceSocket,
+                                        clientName=self.unitName,
+                                        authkey=self.inferenceAuthkey)
+        if self.detectionCache:
+            identity = detectorIdentity(self.detectorBackend, dirs.dir_model / self.PATH_TO_CKPT,
+                                        self.detectionThreshold, self.PATH_TO_LABELS)
+            parcelDetector = CachedDetector(parcelDetector, identity,
+                                            self.detectionCacheEntries,
+                                            dirs.dir_model / self.detectionCacheDir,
+                                            self.detectionCacheDiskMB * 1024 * 1024)
+        return parcelDetector
+
     def _loadConfig(self, configFile, trackerType):
         """
         Charge le fichier de configuration du ParcelTracker.
@@ -110,12 +198,46 @@ class ParcelTracker():
             self.numberOfTimeUndedectedThresholdPicked = config.getint(trackerType,
                                                                        'numberOfTimeUndedectedThresholdPicked')
 
+            self.detectorBackend = config.get(trackerType, 'detectorBackend', fallback='tensorflow')
             self.PATH_TO_CKPT = config.get(trackerType, 'PATH_TO_CKPT')
+            self.PATH_TO_DNN_CONFIG = config.get(trackerType, 'PATH_TO_DNN_CONFIG', fallback='')
+            self.detectionLog = config.get(trackerType, 'detectionLog', fallback='')
+            self.inferenceSocket = config.get(trackerType, 'inferenceSocket',
+                                              fallback='/tmp/parcelInference/inference.sock')
+            self.inferenceAuthkey = config.get(trackerType, 'inferenceAuthkey', fallback='')
+            self.cpuThreads = config.getint(trackerType, 'cpuThreads', fallback=0)
+            self.shareDetector = config.getboolean(trackerType, 'shareDetector', fallback=True)
+            self.detectionCache = config.getboolean(trackerType, 'detectionCache', fallback=False)
+            self.detectionCacheEntries = config.getint(trackerType, 'detectionCacheEntries', fallback=256)
+            self.detectionCacheDir = config.get(trackerType, 'detectionCacheDir', fallback='detectionCache')
+            self.detectionCacheDiskMB = config.getint(trackerType, 'detectionCacheDiskMB', fallback=0)
             self.PATH_TO_LABELS = config.get(trackerType, 'PATH_TO_LABELS')
             self.gpuNum = config.get(trackerType, 'gpuNum')
             self.gpuMemoryFraction = config.getfloat(trackerType, 'gpuMemoryFraction')
             self.detectionThreshold = config.getfloat(trackerType, 'detectionThreshold')
             self.trackerSpaceConfig = config.get(trackerType, 'trackerSpaceConfig')
+            self.trackerSpaceCache = config.get(trackerType, 'trackerSpaceCache', fallback='')
+            self.detectionInterval = config.getint(trackerType, 'detectionInterval', fallback=1)
+            self.adaptiveDetectionInterval = config.getboolean(trackerType, 'adaptiveDetectionInterval', fallback=True)
+            self.detectionZoneMargin = config.getfloat(trackerType, 'detectionZoneMargin', fallback=0.05)
+            inferenceSizeStr = config.get(trackerType, 'inferenceSize', fallback='')
+            self.inferenceSize = None
+            self.warmupSize = (972, 1296, 3)
+            if inferenceSizeStr.strip() != '':
+                self.inferenceSize = tuple(int(x) for x in inferenceSizeStr.split(','))
+            self.cropToBeltRoi = config.getboolean(trackerType, 'cropToBeltRoi', fallback=False)
+            self.associationStrategy = config.get(trackerType, 'associationStrategy', fallback='hungarian')
+            self.cascadeMaxCenterDistance = config.getfloat(trackerType, 'cascadeMaxCenterDistance', fallback=0.05)
+            self.kalmanMode = config.get(trackerType, 'kalmanMode', fallback='opencv')
+            self.kalmanWarmupFrames = config.getint(trackerType, 'kalmanWarmupFrames', fallback=20)
+            self.kalmanVariableDt = config.getboolean(trackerType, 'kalmanVariableDt', fallback=False)
+            self.kalmanMaxFrameInterval = config.getfloat(trackerType, 'kalmanMaxFrameInterval', fallback=5)
+            self.timestampUnit = config.get(trackerType, 'timestampUnit', fallback='ms')
+            if self.timestampUnit not in TIMESTAMP_UNITS:
+                raise ValueError('Unknown timestampUnit {}, expected one of {}'.format(
+                    self.timestampUnit, list(TIMESTAMP_UNITS)))
+            self.reducedDecode = config.getboolean(trackerType, 'reducedDecode', fallback=False)
+            self.beltRoiMargin = config.getfloat(trackerType, 'beltRoiMargin', fallback=0.02)
             self.areaConfidenceThreshold = config.getfloat(trackerType, 'areaConfidenceThreshold')
             self.xLimitParcel = config.getint(trackerType, 'xLimitParcel')
             self.defaultHeight = config.getint(trackerType, 'defaultHeight')
@@ -333,31 +455,244 @@ class ParcelTracker():
 
         return exitingParcels, removedParcels
 
-    def update(self, image, incomingParcels, cam):
+    def _preparedImageSize(self):
+        """
+        Retourne la taille nominale de la zone passée au détecteur, avant
+        redimensionnement (image complète ou zone du convoyeur si cropToBeltRoi).
+
+        Returns:
+            La taille (largeur, hauteur) en pixels de l'image pleine résolution.
+        """
+        roi = self.inferenceRoi if self.inferenceRoi is not None else (0.0, 0.0, 1.0, 1.0)
+        return ((roi[3] - roi[1]) * self.trackerSpace.imageSize[0],
+                (roi[2] - roi[0]) * self.trackerSpace.imageSize[1])
+
+    def _chooseDecodeScale(self):
+        """
+        Choisit le plus grand facteur de réduction du décodage JPEG (2, 4 ou 8)
+        pour lequel la zone passée au détecteur garde au moins la résolution
+        d'inférence, c'est-à-dire sa taille une fois ramenée dans inferenceSize
+        en gardant ses proportions.
+
+        Returns:
+            Le facteur de réduction et le flag de cv2.imdecode correspondant.
+        """
+        if not self.reducedDecode or self.inferenceSize is None:
+            return 1, cv2.IMREAD_COLOR
+        width, height = self._preparedImageSize()
+        targetWidth, targetHeight = fitImageSize(width, height, self.inferenceSize)
+        for scale, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                            (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if width / scale >= targetWidth and height / scale >= targetHeight:
+                return scale, flag
+        return 1, cv2.IMREAD_COLOR
+
+    def decodeImage(self, buffer):
+        """
+        Décode une image JPEG reçue de la caméra, en résolution réduite si
+        reducedDecode le permet. Les coordonnées des box étant relatives et les
+        cartes de correction adaptées à la taille de l'image (TrackerSpace),
+        la suite du traitement est inchangée.
+
+        Args:
+            buffer: tableau numpy uint8 de l'image encodée.
+
+        Returns:
+            L'image décodée.
+        """
+        return cv2.imdecode(buffer, self.decodeFlag)
+
+    def prepareImage(self, image):
+        """
+        Prépare une image brute pour la détection (correction de la distortion,
+        découpe sur la zone du convoyeur si cropToBeltRoi, redimensionnement pour
+        tenir dans inferenceSize en gardant les proportions de l'image).
+
+        Args:
+            image: image brute de la caméra.
+
+        Returns:
+            L'image prête à être passée au détecteur.
+        """
+        # correction de la distortion des images (sinon corrigée sur les box par mapDetections)
+        if self.trackerSpace.doUndistortion and not self.boxUndistortion:
+            if self.inferenceRoi is not None:
+                # seule la zone utile est corrigée
+                image, self.croppedRoi = self.trackerSpace.undistortImageRoi(image, self.inferenceRoi)
+            else:
+                image = self.trackerSpace.undistortImage(image)
+        elif self.inferenceRoi is not None:
+            image, self.croppedRoi = cropImageToRoi(image, self.inferenceRoi)
+        # les box étant relatives, le redimensionnement ne change pas les coordonnées
+        if self.inferenceSize is not None:
+            targetSize = fitImageSize(image.shape[1], image.shape[0], self.inferenceSize)
+            if targetSize != (image.shape[1], image.shape[0]):
+                downscale = targetSize[0] < image.shape[1]
+                image = cv2.resize(image, targetSize,
+                                   interpolation=cv2.INTER_AREA if downscale else cv2.INTER_LINEAR)
+        return image
+
+    def mapDetections(self, numObj, objects):
+        """
+        Ramène les détections d'une image préparée en coordonnées relatives
+        à l'image complète corrigée de la distortion.
+
+        Args:
+            numObj: le nombre d'objets detectes.
+            objects: la liste des objets detectes sur l'image préparée.
+
+        Returns:
+            Le nombre et la liste des objets en coordonnées de l'image complète.
+        """
+        if self.croppedRoi is not None:
+            objects = mapObjectsFromRoi(objects, self.croppedRoi)
+        if self.boxUndistortion:
+            objects = undistortObjects(objects, self.trackerSpace)
+        return numObj, objects
+
+    def detect(self, image):
+        """
+        Détecte les objets d'une image préparée par prepareImage.
+
+        Returns:
+            Le nombre et la liste des objets en coordonnées de l'image complète.
+        """
+        numObj, objects = self.parcelDetector.run_inference_for_frame(image)
+        return self.mapDetections(numObj, objects)
+
+    def _countParcelsNearZones(self):
+        """
+        Compte les Parcels proches de l'entrée du convoyeur ou d'une zone
+        d'association, ainsi que les Parcels à venir de l'unité précédente.
+
+        Returns:
+            Le nombre de Parcels nécessitant une détection fréquente.
+        """
+        nearCount = len(self.incomingParcels)
+        for parcel in self.trackedParcels:
+            box = parcel.nextRelativeBox if max(parcel.nextRelativeBox) != 0 else parcel.relativeBox
+            if box[1] < self.trackerSpace.xMin + self.detectionZoneMargin:
+                nearCount += 1
+            elif self.trackerSpace.isInPrimeAssociationArea(box)[0]:
+                nearCount += 1
+        return nearCount
+
+    def shouldDetect(self, framesSinceDetection=None):
+        """
+        Indique si l'image courante doit passer par le détecteur. La cadence
+        detectionInterval est raccourcie (adaptiveDetectionInterval) selon le
+        nombre de Parcels proches de l'entrée ou des zones d'association.
+
+        Args:
+            framesSinceDetection: nombre d'images depuis la dernière détection,
+                None pour le compteur du tracker. Utilisé par le pipeline qui
+                décide de la détection avant que le tracking de l'image précédente
+                ne soit terminé.
+
+        Returns:
+            True si la détection doit être réalisée.
+        """
+        if framesSinceDetection is None:
+            framesSinceDetection = self.framesSinceDetection
+        interval = self.detectionInterval
+        if interval > 1 and self.adaptiveDetectionInterval:
+            interval = max(1, interval // (1 + self._countParcelsNearZones()))
+        return framesSinceDetection + 1 >= interval
+
+    def update(self, image, incomingParcels, cam, ts=None, preparedRoi=None):
         """
         Mets à jour tous les objets suivis et réalise le suivi.
         Seul methode du tracker utilisable.
 
+        Args:
+            image: image brute de la caméra.
+            incomingParcels: Parcels venant de l'unité précédente.
+            cam :  num camera realisant l'acquisition de l'image traitée
+            ts: timestamp de l'image (paramètre ts de la requête), optionnel.
+            preparedRoi: pour une image déjà passée par prepareImage (stockage
+                de benchmark utils.frameStore), la zone relative de l'image
+                complète qu'elle couvre. None pour une image brute.
+
+        Returns:
+            Tous les objets suivis, sortants et retires.
+
+        """
+        if not self.shouldDetect():
+            # image sautée : prédiction seule par le filtre de Kalman
+            return self.updateWithDetections(0, None, incomingParcels, cam, ts)
+
+        if preparedRoi is None:
+            image = self.prepareImage(image)
+        else:
+            self.croppedRoi = preparedRoi
+        self.parcelDetector.setFrameKey(cam, ts)
+        numObj, objects = self.detect(image)
+        return self.updateWithDetections(numObj, objects, incomingParcels, cam, ts)
+
+    def frameInterval(self, cam, ts):
+        """
+        Calcule l'intervalle réel depuis l'image précédente de la caméra à
+        partir des timestamps des images, borné à kalmanMaxFrameInterval
+        images à 1/fps.
+
+        Args:
+            cam: caméra de l'image courante.
+            ts: timestamp de l'image courante, en unités timestampUnit.
+
+        Returns:
+            L'intervalle en secondes, None pour la première image, une image
+            sans timestamp ou un timestamp qui ne croît pas (image dupliquée ou
+            dans le désordre).
+        """
+        try:
+            ts = float(ts)
+        except (TypeError, ValueError):
+            return None
+        lastTs = self.lastFrameTs.get(cam)
+        if lastTs is not None and ts <= lastTs:
+            return None
+        self.lastFrameTs[cam] = ts
+        if lastTs is None:
+            return None
+        return min((ts - lastTs) * TIMESTAMP_UNITS[self.timestampUnit], self.kalmanMaxFrameInterval / self.fps)
+
+    def updateWithDetections(self, numObj, objects, incomingParcels, cam, ts=None):
+        """
+        Mets à jour tous les objets suivis à partir de détections calculées
+        ailleurs (appel batch multi-caméras, replay...). Les détections doivent
+        provenir d'une image passée par prepareImage et être ramenées en
+        coordonnées de l'image complète par mapDetections.
+
         Args:
             numObj: le nombre d'objets detectes.
-            objects: la liste des objets detectes.
+            objects: la liste des objets detectes [class, score, box], non filtrée.
+                None pour une image sans détection : les Parcels suivis
+                avancent alors sur leur prédiction.
             incomingParcels: Parcels venant de l'unité précédente.
             cam :  num camera realisant l'acquisition de l'image traitée
+            ts: timestamp de l'image (paramètre ts de la requête), optionnel,
+                pour l'intervalle réel depuis l'image précédente.
 
         Returns:
             Tous les objets suivis, sortants et retires.
 
         """
         t = time.perf_counter()
-        # correction de la distortion des images
-        if self.trackerSpace.doUndistortion:
-            image = self.trackerSpace.undistortImage(image)
+        detected = objects is not None
+
+        # prédictions de Kalman recalées sur l'intervalle réel depuis l'image précédente
+        self.detectionTracker.advanceToFrame(self.trackedParcels, self.frameInterval(cam, ts))
 
         # calcul des longueur et large de colis
         setParcelsWidthRef(self.trackedParcels, self.trackerSpace)
 
-        # Détecte, filtre et prépare les objets pour le tracking.
-        numObj, objects = detectAndFilterParcels(self.parcelDetector, image, self.trackerSpace)
+        # Filtre et prépare les objets pour le tracking.
+        if detected:
+            numObj, objects = filterAndSortParcels(numObj, objects, self.trackerSpace)
+            self.framesSinceDetection = 0
+        else:
+            numObj, objects = 0, []
+            self.framesSinceDetection += 1
 
         # Filtre les parcels envoyés par l'unité précédente pour ne garder que ceux à venir.
         self._filterIncomingParcels(incomingParcels)
@@ -368,11 +703,15 @@ class ParcelTracker():
         # mise à jour des positions relatives des colis trackés
         self.p2pTracker.updatePositions(self.trackedParcels)
 
-        # Réalise l'association optimale par IOU entre parcels et détection.
-        # et utilisation du filtre de kalman
-        unassociateDetections = self.detectionTracker.estimatePosition(self.trackedParcels, numObj, objects)
-        # gestion des colis entrant et association
-        self._manageIncomingAndNewParcels(numObj, objects, unassociateDetections)
+        if detected:
+            # Réalise l'association optimale par IOU entre parcels et détection.
+            # et utilisation du filtre de kalman
+            unassociateDetections = self.detectionTracker.estimatePosition(self.trackedParcels, numObj, objects)
+            # gestion des colis entrant et association
+            self._manageIncomingAndNewParcels(numObj, objects, unassociateDetections)
+        else:
+            # pas de détection : prédiction seule du filtre de kalman
+            self.detectionTracker.propagatePosition(self.trackedParcels)
 
         # met à jour des coordonnées réelles et des coordonnées images
         self.setRealPosition()
@@ -7,26 +7,39 @@ from io import BytesIO
 import configparser as cfg
 import traceback
 import cv2
-from threading import Thread, Event
-from queue import Empty
+from threading import Thread, Event, Lock
+from queue import Empty, Full, Queue
 
 
+from communication_server.JitterBuffer import JitterBuffer
 from communication_server.ParcelsClient import ParcelsClient
 from parcelTracker import ParcelTracker
 from parcels.parcel import parcelListFromPickle, parcelListToPickle
 
 class ParcelTrackerWorker(Thread):
 
-    def __init__(self, configFile, sectionName, imageQ, incomingQ, logger):
+    def __init__(self, configFile, sectionName, imageQ, incomingQ, logger, frameRing=None):
         Thread.__init__(self)
 
         self._loadConfig(configFile, sectionName)
 
         self.stoppingFlag = Event()
         self.imageQ = imageQ
+        self.frameRing = frameRing
+        if self.frameRing is None and self.useFrameRing:
+            # anneau créé par le worker, à passer au HttpServer qui y écrit les images reçues
+            from communication_server.FrameRing import FrameRing
+            self.frameRing = FrameRing('parcelFrames_' + sectionName, self.frameRingCameras,
+                                       self.frameRingSlots, self.frameRingSlotMB * 1024 * 1024)
+        if self.useJitterBuffer and self.frameRing is None:
+            # tampon créé par le worker, à passer au serveur de réception à la place de imageQ
+            self.imageQ = JitterBuffer(self.jitterHoldMs, self.jitterDeadlineMs,
+                                       self.jitterGroupWindowMs, self.jitterMaxFrames)
+        self.framesReceived = 0
         self.incomingQ = incomingQ
         self.logger = logger
         self.httpClient=ParcelsClient(logger)
+        self.framesSinceDetection = 0
         try:
             self.parcelTracker = ParcelTracker(self.configFileTracker, self.sectionNameTracker, self.logger)    
         except Exception as ex:
@@ -42,6 +55,19 @@ class ParcelTrackerWorker(Thread):
             self.configFileTracker =  config.get(sectionName, 'configFileTracker')
             self.sectionNameTracker =  config.get(sectionName, 'sectionNameTracker')
             self.timeoutImage =  config.getint(sectionName, 'timeoutImage')
+            self.pipelined = config.getboolean(sectionName, 'pipelined', fallback=False)
+            self.pipelineQueueSize = config.getint(sectionName, 'pipelineQueueSize', fallback=2)
+            self.pipelineReportInterval = config.getint(sectionName, 'pipelineReportInterval', fallback=100)
+            self.useFrameRing = config.getboolean(sectionName, 'useFrameRing', fallback=False)
+            self.frameRingCameras = config.getint(sectionName, 'frameRingCameras', fallback=4)
+            self.frameRingSlots = config.getint(sectionName, 'frameRingSlots', fallback=4)
+            self.frameRingSlotMB = config.getint(sectionName, 'frameRingSlotMB', fallback=8)
+            self.useJitterBuffer = config.getboolean(sectionName, 'useJitterBuffer', fallback=False)
+            self.jitterHoldMs = config.getfloat(sectionName, 'jitterHoldMs', fallback=60)
+            self.jitterDeadlineMs = config.getfloat(sectionName, 'jitterDeadlineMs', fallback=500)
+            self.jitterGroupWindowMs = config.getfloat(sectionName, 'jitterGroupWindowMs', fallback=20)
+            self.jitterMaxFrames = config.getint(sectionName, 'jitterMaxFrames', fallback=32)
+            self.jitterReportInterval = config.getint(sectionName, 'jitterReportInterval', fallback=100)
         except Exception as e:
             if not os.path.isfile(configFile): 
                 print('ParcelTrackerWorker: No such config file : ' + configFile)     
@@ -55,78 +81,130 @@ class ParcelTrackerWorker(Thread):
                 raise SystemExit('ParcelTrackerWorker: Problem loading configuration file : ' + configFile)
 
     def run(self):
+        if self.pipelined:
+            self._runPipelined()
+        else:
+            self._runSequential()
+        print('Exiting tracking loop')
+        return
+
+    def _readIncomingParcels(self, cam):
+        """
+        Récupère les derniers Parcels envoyés par le tracker N-1.
+
+        Returns:
+            La liste des Parcels entrants, [None] s'il n'y en a pas.
+        """
+        incomingParcels = ""
+
+        while self.incomingQ.empty() == False:
+            self.logger.info("--- self.incomingQ is not empty---") 
+            fromIncomingQ = self.incomingQ.get()
+            incomingParcels = fromIncomingQ['file']
+            self.logger.info("--- incomingParcels {} ---".format(incomingParcels))
+
+        if len(incomingParcels) > 0:
+            new_parcels = parcelListFromPickle(incomingParcels)
+            self.logger.info("--- new_parcels {} ---".format(new_parcels))
+            for obj in new_parcels:
+                self.logger.info("parcelID :{} parcelBarcode:{} cam:{}: New parcel incoming Id".format(obj.parcelID, obj.parcelBarcode, cam))
+        else:
+            new_parcels = [None]
+            self.logger.info("No new incoming parcels")
+        return new_parcels
+
+    def _decodeImage(self, imageStream):
+        file_bytes = np.asarray(bytearray(imageStream.read()), dtype=np.uint8)
+        return self.parcelTracker.decodeImage(file_bytes)
+
+    def _decodeBuffer(self, buffer):
+        t0 = time.perf_counter()
+        image = self.parcelTracker.decodeImage(buffer)
+        self.decodeTime = time.perf_counter() - t0
+        return image
+
+    def _nextImage(self):
+        """
+        Attend la prochaine image, depuis l'anneau partagé si useFrameRing
+        (décodage directement sur le slot), sinon depuis imageQ (le tampon de
+        gigue si useJitterBuffer).
+
+        Returns:
+            L'image décodée, la caméra, le timestamp et la durée du décodage.
+
+        Raises:
+            Empty: si aucune image n'arrive avant timeoutImage.
+        """
+        if self.frameRing is not None:
+            frame = self.frameRing.get(timeout=self.timeoutImage, decode=self._decodeBuffer)
+            return frame.data, frame.cam, frame.ts, self.decodeTime
+        fromQ = self.imageQ.get(timeout=self.timeoutImage)
+        self.framesReceived += 1
+        if isinstance(self.imageQ, JitterBuffer) and self.framesReceived % self.jitterReportInterval == 0:
+            self.logger.info('--- Jitter buffer : {} ---'.format(self.imageQ.stats()))
+        t0 = time.perf_counter()
+        image = self._decodeImage(fromQ['file'])
+        return image, fromQ['cam'], fromQ['ts'], time.perf_counter() - t0
+
+    def _reportPredictionErrors(self):
+        # erreur de prédiction de Kalman par intervalle réel entre les images
+        self.logger.info('--- Kalman prediction error by frame interval : {} ---'.format(
+            self.parcelTracker.detectionTracker.predictionStats()))
+
+    def _publish(self, parcels, numObj, cam, ts):
+        """
+        Envoie le résultat du tracking au séquenceur et les informations
+        d'affichage à l'ihm.
+        """
+        parcelsinfo = self.parcelTracker.parcelInfo
+        ## info zone de tracking et association
+        self.logger.info("zoneAssociation : {}".format(self.parcelTracker.zoneAssociation))
+        if self.parcelTracker.zoneAssociation != '':
+            parcelsinfo["zoneAsso"] = (self.parcelTracker.yMinAss, self.parcelTracker.xMinAss, self.parcelTracker.yMaxAss,  self.parcelTracker.xMaxAss)
+        parcelsinfo["zoneTracking"] = (self.parcelTracker.yMinLimit, self.parcelTracker.xMinLimit, self.parcelTracker.yMaxLimit, self.parcelTracker.xMaxLimit)
+        parcelsinfo["Cam"] = cam
+        # affichage du parcelsinf0
+        self.logger.info("parcelsInfo : {}".format(parcelsinfo))
+        self.logger.info("--- Tracking {} parcels cam :{} ---".format(len(parcels), cam))
+        self.logger.info("--- Number of objects {} cam :{}  ---".format(numObj, cam))
+
+    # Envoi trt_result
+        jsondump = parcelListToPickle(parcels)
+
+        headers = {'Content-type': 'application/octet-stream'}
+        url = "http://127.0.0.1:80/sequenceur/trtresult?from={}&to={}&ts={}".format(cam,cam,ts)
+
+    # Fin envoi trt_result sequenceur 
+        self.httpClient.post(url=url,headers=headers,data=jsondump)
+    # Envoi trt_result ihm
+        jsondump1 = parcelListToPickle(parcelsinfo)
+        url1 = "http://127.0.0.1:5001/parcelsinfo?Cam={}&ts={}".format(cam, ts)
+        self.httpClient.post(url=url1,headers=headers,data=jsondump1)
+
+    def _runSequential(self):
+        framesTracked = 0
         while not self.stoppingFlag.is_set():
             try:
-                fromQ =  self.imageQ.get(timeout=self.timeoutImage)
-                imageStream = fromQ['file']
-                cam=fromQ['cam']
-                ts=fromQ['ts']
+                image, cam, ts, timingPrepro = self._nextImage()
+                t0 = time.perf_counter() - timingPrepro
             # As soon as we have a new image, we get the previous object from tracker N-1
-                incomingParcels = ""
-
-                while self.incomingQ.empty() == False:
-                    self.logger.info("--- self.incomingQ is not empty---") 
-                    fromIncomingQ = self.incomingQ.get()
-                    incomingParcels = fromIncomingQ['file']
-                    self.logger.info("--- incomingParcels {} ---".format(incomingParcels))
-        
-                if len(incomingParcels) > 0:
-                    new_parcels = parcelListFromPickle(incomingParcels)
-                    self.logger.info("--- new_parcels {} ---".format(new_parcels))
-                    for obj in new_parcels:
-                        self.logger.info("parcelID :{} parcelBarcode:{} cam:{}: New parcel incoming Id".format(obj.parcelID, obj.parcelBarcode, cam))
-                else:
-                    new_parcels = [None]
-                    self.logger.info("No new incoming parcels")
-        
-                t0 = time.perf_counter()
-                file_bytes = np.asarray(bytearray(imageStream.read()), dtype=np.uint8)
-                image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-                #if self.imageResize != None:
-                #    image = cv2.resize(image, self.imageResize)
-
-                t1 = time.perf_counter()
-                timingPrepro = t1-t0        
+                new_parcels = self._readIncomingParcels(cam)
                 self.logger.info("--- Preprocess {} seconds ---".format(timingPrepro)) 
                 t2 = time.perf_counter()
-                parcels = []
                 
-                parcels, parcelsinfo, objects, numObj = self.parcelTracker.update(image, new_parcels, cam)
-                ## info zone de tracking et association
-                self.logger.info("zoneAssociation : {}".format(self.parcelTracker.zoneAssociation))
-                if self.parcelTracker.zoneAssociation != '':
-                    parcelsinfo["zoneAsso"] = (self.parcelTracker.yMinAss, self.parcelTracker.xMinAss, self.parcelTracker.yMaxAss,  self.parcelTracker.xMaxAss)
-                parcelsinfo["zoneTracking"] = (self.parcelTracker.yMinLimit, self.parcelTracker.xMinLimit, self.parcelTracker.yMaxLimit, self.parcelTracker.xMaxLimit)
-                parcelsinfo["Cam"] = cam
-                # affichage du parcelsinf0
-                self.logger.info("parcelsInfo : {}".format(parcelsinfo))
+                parcels, objects, numObj = self.parcelTracker.update(image, new_parcels, cam, ts)
                 t3 = time.perf_counter()
                 timingTracking = t3 - t2
                 self.logger.info("--- Algo tracking {} seconds cam: {} ---".format(timingTracking, cam))
-                self.logger.info("--- Tracking {} parcels cam :{} ---".format(len(parcels), cam))
-                self.logger.info("--- Number of objects {} cam :{}  ---".format(numObj, cam))
-                # for p in parcels:
-                    # for attr, value in p.__dict__.items():            
-                        # self.logger.info("{} : {}".format(attr, value))
-                    # self.logger.info("")
-                
-            # Envoi trt_result
-                jsondump = parcelListFromPickle(parcels)
-                
-                headers = {'Content-type': 'application/octet-stream'}
-                url = "http://127.0.0.1:80/sequenceur/trtresult?from={}&to={}&ts={}".format(cam,cam,ts)
 
-            # Fin envoi trt_result sequenceur 
-                self.httpClient.post(url=url,headers=headers,data=jsondump)
+                self._publish(parcels, numObj, cam, ts)
                 t4 = time.perf_counter()
-            # Envoi trt_result ihm
-                jsondump1 = parcelListToPickle(parcelsinfo)
-                url1 = "http://127.0.0.1:5001/parcelsinfo?Cam={}&ts={}".format(cam, ts)
-                self.httpClient.post(url=url1,headers=headers,data=jsondump1)
-
 
                 endTime = t4 - t0
                 self.logger.info("--- Full trt {} seconds ---".format(endTime))
+                framesTracked += 1
+                if framesTracked % self.pipelineReportInterval == 0:
+                    self._reportPredictionErrors()
             except Exception as e:
                 if isinstance(e, Empty):
                     self.logger.error('Queue was empty, timeout after {}s'.format(self.timeoutImage))
@@ -136,6 +214,131 @@ class ParcelTrackerWorker(Thread):
                     self.logger.error(traceback.format_exc())
                     raise SystemExit()
 
+    def _runPipelined(self):
+        """
+        Pipeline à trois étages reliés par des files bornées, dans l'ordre des
+        images : décodage + préparation (correction de la distortion, découpe,
+        redimensionnement), inférence, tracking + envoi des résultats. Le débit
+        est limité par l'étage le plus lent et non plus par la somme des étages.
+        """
+        self.decodedQ = Queue(maxsize=self.pipelineQueueSize)
+        self.detectedQ = Queue(maxsize=self.pipelineQueueSize)
+        self.stageStats = {name: StageStats(name) for name in ('decode', 'inference', 'tracking')}
+        # protège l'état du tracker lu par l'étage de décodage (cadence de détection)
+        self.trackerLock = Lock()
+        self.stageError = None
 
-        print('Exiting tracking loop')
-        return
+        stages = [Thread(target=self._stageLoop, args=(self._decodeStage,), name='decodeStage'),
+                  Thread(target=self._stageLoop, args=(self._inferenceStage,), name='inferenceStage')]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        self._stageLoop(self._trackingStage)
+        self.stoppingFlag.set()
+        for stage in stages:
+            stage.join(timeout=self.timeoutImage)
+
+        if self.stageError is not None:
+            raise SystemExit()
+
+    def _stageLoop(self, stage):
+        while not self.stoppingFlag.is_set():
+            try:
+                stage()
+            except Empty:
+                continue
+            except Exception as e:
+                self.logger.error('--- Crash tracker pipeline {} : {} ---'.format(stage.__name__, e))
+                self.logger.error(traceback.format_exc())
+                self.stageError = e
+                self.stoppingFlag.set()
+
+    def _putStage(self, q, item):
+        # ne bloque pas indéfiniment si le pipeline est arrêté pendant que la file est pleine
+        while not self.stoppingFlag.is_set():
+            try:
+                q.put(item, timeout=self.timeoutImage)
+                return
+            except Full:
+                continue
+
+    def _decodeStage(self):
+        try:
+            image, cam, ts, timingDecode = self._nextImage()
+        except Empty:
+            self.logger.error('Queue was empty, timeout after {}s'.format(self.timeoutImage))
+            print('Queue was empty, timeout after {}s'.format(self.timeoutImage))
+            raise
+
+        t0 = time.perf_counter()
+        # la cadence est décidée ici avec un compteur propre au pipeline, le
+        # tracking des images précédentes pouvant encore être en cours
+        with self.trackerLock:
+            detect = self.parcelTracker.shouldDetect(self.framesSinceDetection)
+        if detect:
+            image = self.parcelTracker.prepareImage(image)
+            self.framesSinceDetection = 0
+        else:
+            image = None
+            self.framesSinceDetection += 1
+        self.stageStats['decode'].add(timingDecode + time.perf_counter() - t0)
+
+        self._putStage(self.decodedQ, (image, cam, ts))
+
+    def _inferenceStage(self):
+        image, cam, ts = self.decodedQ.get(timeout=self.timeoutImage)
+
+        t0 = time.perf_counter()
+        if image is not None:
+            self.parcelTracker.parcelDetector.setFrameKey(cam, ts)
+            numObj, objects = self.parcelTracker.detect(image)
+        else:
+            # image sautée : prédiction seule par le filtre de Kalman
+            numObj, objects = 0, None
+        self.stageStats['inference'].add(time.perf_counter() - t0)
+
+        self._putStage(self.detectedQ, (numObj, objects, cam, ts))
+
+    def _trackingStage(self):
+        numObj, objects, cam, ts = self.detectedQ.get(timeout=self.timeoutImage)
+
+        t0 = time.perf_counter()
+        # les Parcels du tracker N-1 sont lus au plus tard, juste avant le tracking
+        new_parcels = self._readIncomingParcels(cam)
+        with self.trackerLock:
+            parcels, objects, numObj = self.parcelTracker.updateWithDetections(numObj, objects, new_parcels, cam, ts)
+        self._publish(parcels, numObj, cam, ts)
+        stats = self.stageStats['tracking']
+        stats.add(time.perf_counter() - t0)
+
+        if stats.count % self.pipelineReportInterval == 0:
+            self.logger.info('--- Pipeline cam {} : {} ---'.format(
+                cam, ' | '.join(str(s) for s in self.stageStats.values())))
+            self._reportPredictionErrors()
+            for s in self.stageStats.values():
+                s.reset()
+
+
+class StageStats:
+    """
+        Latence d'un étage du pipeline sur la dernière fenêtre de mesure.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def __str__(self):
+        mean = self.total / self.count if self.count > 0 else 0.0
+        return '{} mean {:.1f} ms max {:.1f} ms ({} frames)'.format(self.name, 1000 * mean, 1000 * self.max, self.count)
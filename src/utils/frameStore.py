@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+    Stockage compact d'un enregistrement pour les benchmarks : les images
+    décodées (et éventuellement préparées pour la détection) sont écrites les
+    unes à la suite des autres dans un seul fichier lu par memory-map, avec un
+    index par image (caméra, timestamp, position, dimensions).
+
+    Un dossier de stockage contient :
+        frames.bin : les pixels uint8, chaque image alignée sur 64 octets.
+        index.npy : le tableau structuré INDEX_DTYPE.
+        meta.json : le format et la section du tracker ayant préparé les images.
+"""
+import json
+
+import cv2
+import numpy as np
+
+from utils.rawFrames import ReplaySource
+
+STORE_FORMAT = 1
+_ALIGNMENT = 64
+FULL_FRAME_ROI = (0.0, 0.0, 1.0, 1.0)
+
+# roi : zone relative de l'image complète couverte par l'image stockée
+INDEX_DTYPE = np.dtype([('cam', 'S32'), ('ts', np.int64), ('seq', np.int64), ('offset', np.int64),
+                        ('height', np.int32), ('width', np.int32), ('channels', np.int32),
+                        ('roi', np.float64, 4)])
+
+
+def packFrames(frames, storePath, parcelTracker=None, workers=4):
+    """
+    Décode des images enregistrées et les écrit dans un dossier de stockage,
+    dans l'ordre de rejeu (ReplaySource).
+
+    Args:
+        frames: images du manifeste (utils.rawFrames.buildManifest).
+        storePath: dossier de stockage, créé si besoin.
+        parcelTracker: tracker dont le décodage et prepareImage (correction de
+            la distortion, découpe, redimensionnement) sont appliqués. None
+            pour stocker les images brutes décodées en couleur.
+        workers: nombre de threads de lecture et de décodage.
+
+    Returns:
+        Le FrameStore ouvert sur le dossier.
+    """
+    storePath.mkdir(parents=True, exist_ok=True)
+    decode = parcelTracker.decodeImage if parcelTracker is not None else \
+        (lambda data: cv2.imdecode(data, cv2.IMREAD_COLOR))
+
+    index = np.zeros(len(frames), INDEX_DTYPE)
+    offset = 0
+    source = ReplaySource(frames, speed=0, prefetch=2 * workers, workers=workers, decode=decode)
+    with open(storePath / 'frames.bin', 'wb') as fp:
+        for i, (frame, image) in enumerate(source):
+            roi = FULL_FRAME_ROI
+            if parcelTracker is not None:
+                # prepareImage n'est pas réentrant (croppedRoi) : appelé dans ce thread
+                parcelTracker.croppedRoi = None
+                image = parcelTracker.prepareImage(image)
+                roi = parcelTracker.croppedRoi if parcelTracker.croppedRoi is not None else FULL_FRAME_ROI
+            image = np.ascontiguousarray(image)
+            if image.ndim == 2:
+                image = image[:, :, np.newaxis]
+            index[i] = (str(frame['cam']).encode('utf-8')[:32], frame['ts'], frame['seq'], offset,
+                        image.shape[0], image.shape[1], image.shape[2], roi)
+            fp.write(image.data.cast('B'))
+            padding = -image.nbytes % _ALIGNMENT
+            fp.write(bytes(padding))
+            offset += image.nbytes + padding
+
+    np.save(storePath / 'index.npy', index)
+    with open(storePath / 'meta.json', 'w') as fp:
+        json.dump({'format': STORE_FORMAT,
+                   'prepared': parcelTracker is not None,
+                   'section': parcelTracker.unitName if parcelTracker is not None else None}, fp)
+    return FrameStore(storePath)
+
+
+class FrameStore:
+    """
+        Lecture d'un dossier de stockage (packFrames). Les images sont des vues
+        en lecture seule sur le memory-map : aucune copie, et seules les pages
+        lues sont chargées en mémoire.
+    """
+
+    def __init__(self, storePath):
+        """
+        Args:
+            storePath: dossier de stockage.
+
+        Raises:
+            ValueError: si le format du stockage n'est pas celui attendu.
+        """
+        with open(storePath / 'meta.json') as fp:
+            meta = json.load(fp)
+        if meta.get('format') != STORE_FORMAT:
+            raise ValueError('FrameStore {} : unsupported format {}'.format(storePath, meta.get('format')))
+        self.storePath = storePath
+        self.prepared = meta['prepared']
+        self.section = meta['section']
+        self.index = np.load(storePath / 'index.npy')
+        if len(self.index) > 0:
+            self.data = np.memmap(storePath / 'frames.bin', np.uint8, 'r')
+        else:
+            self.data = np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def image(self, i):
+        """
+        Returns:
+            La vue (hauteur, largeur, canaux) de l'image i, sans copie.
+        """
+        entry = self.index[i]
+        shape = (int(entry['height']), int(entry['width']), int(entry['channels']))
+        start = int(entry['offset'])
+        return self.data[start:start + shape[0] * shape[1] * shape[2]].reshape(shape)
+
+    def cameras(self):
+        return sorted({cam.decode('utf-8') for cam in np.unique(self.index['cam'])})
+
+    def frames(self, cam=None):
+        """
+        Parcourt les images d'une caméra (ou de toutes) dans l'ordre du stockage.
+
+        Args:
+            cam: caméra, None pour toutes.
+
+        Returns:
+            Un itérateur de tuples (cam, ts, image, roi). roi est la zone
+            relative de l'image complète couverte par l'image, à passer à
+            ParcelTracker.update (preparedRoi) si le stockage est préparé.
+        """
+        key = None if cam is None else str(cam).encode('utf-8')[:32]
+        for i in range(len(self.index)):
+            entry = self.index[i]
+            if key is not None and entry['cam'] != key:
+                continue
+            yield entry['cam'].decode('utf-8'), int(entry['ts']), self.image(i), \
+                tuple(float(x) for x in entry['roi'])
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+    Accès aux images enregistrées de data/raw.
+
+    Les noms de fichiers des caméras sont de la forme
+    192.168.77.111_img_726292717_00001079.jpg : IP caméra, timestamp en
+    millisecondes, numéro de séquence.
+"""
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config.directories import directories as dirs
+
+RAW_FRAME_PATTERN = re.compile(r'^(?P<ip>[0-9.]+)_img_(?P<ts>\d+)_(?P<seq>\d+)\.jpg$')
+
+
+def parseRawFrameName(fileName):
+    """
+    Décompose le nom d'une image enregistrée.
+
+    Args:
+        fileName: nom du fichier (sans dossier).
+
+    Returns:
+        Le tuple (ip, timestamp, sequence) ou None si le nom ne correspond pas.
+    """
+    match = RAW_FRAME_PATTERN.match(fileName)
+    if match is None:
+        return None
+    return match.group('ip'), int(match.group('ts')), int(match.group('seq'))
+
+
+def listRawFrames(camDir, rawDir=None):
+    """
+    Liste les images d'un dossier caméra de data/raw triées par timestamp.
+
+    Args:
+        camDir: nom du dossier caméra (cam1, cam2...).
+        rawDir: dossier des images, data/raw par défaut.
+
+    Returns:
+        La liste des dictionnaires {'path', 'cam', 'ip', 'ts', 'seq'}.
+    """
+    rawDir = dirs.dir_raw if rawDir is None else rawDir
+    frames = []
+    for fileName in os.listdir(rawDir / camDir):
+        parsed = parseRawFrameName(fileName)
+        if parsed is not None:
+            ip, ts, seq = parsed
+            frames.append({'path': rawDir / camDir / fileName,
+                           'cam': camDir, 'ip': ip, 'ts': ts, 'seq': seq})
+    frames.sort(key=lambda frame: (frame['ts'], frame['seq']))
+    return frames
+
+
+def buildManifest(rawDir=None, cacheFile='manifest.json'):
+    """
+    Construit le manifeste de toutes les images enregistrées de data/raw,
+    trié par caméra puis timestamp. Le manifeste est mis en cache dans le
+    dossier des images et reconstruit si un dossier caméra a changé.
+
+    Args:
+        rawDir: dossier des images, data/raw par défaut.
+        cacheFile: nom du fichier cache, None pour ne pas utiliser de cache.
+
+    Returns:
+        La liste des dictionnaires {'path', 'cam', 'ip', 'ts', 'seq'}.
+    """
+    rawDir = dirs.dir_raw if rawDir is None else rawDir
+    camDirs = sorted(entry.name for entry in os.scandir(rawDir) if entry.is_dir())
+    stamps = {camDir: os.stat(rawDir / camDir).st_mtime_ns for camDir in camDirs}
+
+    cachePath = rawDir / cacheFile if cacheFile is not None else None
+    if cachePath is not None:
+        try:
+            with open(cachePath) as fp:
+                cached = json.load(fp)
+            if cached['stamps'] == stamps:
+                return [{'path': rawDir / cam / fileName, 'cam': cam, 'ip': ip, 'ts': ts, 'seq': seq}
+                        for cam, fileName, ip, ts, seq in cached['frames']]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    frames = []
+    for camDir in camDirs:
+        frames.extend(listRawFrames(camDir, rawDir))
+    if cachePath is not None:
+        try:
+            with open(cachePath, 'w') as fp:
+                json.dump({'stamps': stamps,
+                           'frames': [[frame['cam'], frame['path'].name, frame['ip'], frame['ts'], frame['seq']]
+                                      for frame in frames]}, fp)
+        except OSError:
+            pass
+    return frames
+
+
+def readEncodedFrame(frame):
+    """
+    Lit une image enregistrée sans la décoder.
+
+    Returns:
+        Le tableau numpy uint8 de l'image encodée (à passer à cv2.imdecode).
+    """
+    return np.fromfile(str(frame['path']), dtype=np.uint8)
+
+
+class ReplaySource:
+    """
+        Rejoue des images enregistrées dans l'ordre des timestamps, toutes
+        caméras confondues.
+
+        Les horloges des caméras n'étant pas synchronisées, le temps de chaque
+        caméra est compté depuis sa première image. La lecture (et le décodage
+        éventuel) est faite à l'avance par un pool de threads ; le rythme est
+        celui de l'enregistrement (speed = 1), accéléré N fois (speed = N) ou
+        le plus rapide possible (speed = 0).
+    """
+
+    def __init__(self, frames, speed=1.0, prefetch=8, workers=4, decode=None):
+        """
+        Args:
+            frames: images du manifeste à rejouer (buildManifest).
+            speed: facteur de vitesse, 0 pour le plus rapide possible.
+            prefetch: nombre d'images lues à l'avance.
+            workers: nombre de threads de lecture.
+            decode: fonction appliquée à l'image encodée dans les threads de
+                lecture (par exemple ParcelTracker.decodeImage), None pour
+                fournir l'image encodée.
+        """
+        firstTs = dict()
+        for frame in frames:
+            firstTs[frame['cam']] = min(frame['ts'], firstTs.get(frame['cam'], frame['ts']))
+        self.frames = sorted(frames, key=lambda frame: (frame['ts'] - firstTs[frame['cam']], frame['cam'], frame['seq']))
+        self.replayTimes = [(frame['ts'] - firstTs[frame['cam']]) / 1000 for frame in self.frames]
+        self.speed = speed
+        self.prefetch = max(1, prefetch)
+        self.workers = workers
+        self.decode = decode
+
+        self.delivered = 0
+        self.lateFrames = 0
+        self.maxLag = 0.0
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _load(self, frame):
+        data = readEncodedFrame(frame)
+        return self.decode(data) if self.decode is not None else data
+
+    def __iter__(self):
+        """
+        Returns:
+            Un itérateur de tuples (frame, image) dans l'ordre de rejeu.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            nextIndex = 0
+            t0 = time.perf_counter()
+            for i in range(len(self.frames)):
+                while nextIndex < len(self.frames) and len(pending) < self.prefetch:
+                    pending.append(pool.submit(self._load, self.frames[nextIndex]))
+                    nextIndex += 1
+                image = pending.popleft().result()
+
+                if self.speed > 0:
+                    lag = time.perf_counter() - t0 - self.replayTimes[i] / self.speed
+                    if lag < 0:
+                        time.sleep(-lag)
+                    else:
+                        # le consommateur ne suit pas le rythme de l'enregistrement
+                        self.lateFrames += lag > 0.001
+                        self.maxLag = max(self.maxLag, lag)
+
+                self.delivered += 1
+                self.elapsed = time.perf_counter() - t0
+                yield self.frames[i], image
+
+    def stats(self):
+        """
+        Returns:
+            Un dictionnaire : images fournies, durée, débit, images en retard
+            sur le rythme demandé et retard maximal.
+        """
+        return {'frames': self.delivered,
+                'elapsed': self.elapsed,
+                'fps': self.delivered / self.elapsed if self.elapsed > 0 else 0.0,
+                'lateFrames': self.lateFrames,
+                'maxLag': self.maxLag}